@@ -1,4 +1,15 @@
+import heapq
+import locale
 import operator
+from array import array
+from bisect import bisect_left, insort
+from itertools import islice
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 #HASHING
 def build_id_hash_map(books_list):
@@ -7,43 +18,93 @@ def build_id_hash_map(books_list):
         book_map[book.id] = book
     return book_map
 
-#MERGE SORT
-def merge_sort(books, key='title', reverse=False):
+#MERGE SORT (decorate-sort-undecorate, bottom-up, stable, multi-key)
+NUMPY_THRESHOLD = 200000
+
+def sort_value(value, locale_aware=False):
+    if isinstance(value, str):
+        value = value.casefold()
+        if locale_aware:
+            value = locale.strxfrm(value)
+    return value
+
+def parse_sort_spec(key, reverse=False):
+    """
+    'title' -> [('title', False)]. A list gives several keys, most significant
+    first, each either a field name or a (field, descending) pair. reverse
+    flips every direction.
+    """
+    if isinstance(key, str):
+        key = [key]
+    spec = []
+    for part in key:
+        field, descending = (part, False) if isinstance(part, str) else part
+        spec.append((field, descending != reverse))
+    return spec
+
+def merge_sort(books, key='title', reverse=False, locale_aware=False, backend='auto'):
+    books = list(books)
     if len(books) <= 1:
         return books
+    spec = parse_sort_spec(key, reverse)
 
-    mid = len(books) // 2
-    left = merge_sort(books[:mid], key, reverse)
-    right = merge_sort(books[mid:], key, reverse)
+    if backend == 'numpy' or (backend == 'auto' and np is not None and len(books) >= NUMPY_THRESHOLD):
+        return [books[i] for i in numpy_sort_order(books, spec, locale_aware)]
 
-    return merge(left, right, key, reverse)
+    if all(descending == spec[0][1] for _, descending in spec):
+        # One direction: a single pass over precomputed tuple keys.
+        getters = [operator.attrgetter(field) for field, _ in spec]
+        keys = [tuple(sort_value(get(book), locale_aware) for get in getters) for book in books]
+        return [books[i] for i in merge_order(keys, spec[0][1])]
 
-def merge(left, right, key, reverse):
-    result = []
-    i = j = 0
-    while i < len(left) and j < len(right):
-        val_left = getattr(left[i], key)
-        val_right = getattr(right[j], key)
-        
-        if isinstance(val_left, str): val_left = val_left.lower()
-        if isinstance(val_right, str): val_right = val_right.lower()
+    # Mixed directions: stable passes from the least significant key up.
+    for field, descending in reversed(spec):
+        get = operator.attrgetter(field)
+        keys = [sort_value(get(book), locale_aware) for book in books]
+        books = [books[i] for i in merge_order(keys, descending)]
+    return books
 
+def merge_order(keys, reverse=False):
+    """Stable permutation sorting keys: iterative bottom-up merge between two reused buffers."""
+    n = len(keys)
+    src = list(range(n))
+    dst = [0] * n
+    width = 1
+    while width < n:
+        for lo in range(0, n, 2 * width):
+            mid = min(lo + width, n)
+            hi = min(lo + 2 * width, n)
+            i, j, k = lo, mid, lo
+            while i < mid and j < hi:
+                a, b = src[i], src[j]
+                # Only take from the right run when strictly better: keeps it stable.
+                if (keys[b] > keys[a]) if reverse else (keys[b] < keys[a]):
+                    dst[k] = b
+                    j += 1
+                else:
+                    dst[k] = a
+                    i += 1
+                k += 1
+            dst[k:k + mid - i] = src[i:mid]
+            k += mid - i
+            dst[k:k + hi - j] = src[j:hi]
+        src, dst = dst, src
+        width *= 2
+    return src
 
-        if reverse:
-            condition = val_left > val_right
-        else:
-            condition = val_left < val_right
-
-        if condition:
-            result.append(left[i])
-            i += 1
-        else:
-            result.append(right[j])
-            j += 1
-            
-    result.extend(left[i:])
-    result.extend(right[j:])
-    return result
+def numpy_sort_order(books, spec, locale_aware=False):
+    if np is None:
+        raise ImportError("numpy is required for the numpy sort backend")
+    columns = []
+    for field, descending in spec:
+        get = operator.attrgetter(field)
+        values = np.array([sort_value(get(book), locale_aware) for book in books])
+        if values.dtype.kind not in 'iuf':
+            # Strings can't be negated; sort on their dense rank instead.
+            values = np.unique(values, return_inverse=True)[1]
+        columns.append(-values if descending else values)
+    # lexsort is stable and treats its last column as the primary key.
+    return np.lexsort(columns[::-1]).tolist()
 
 #BINARY SEARCH
 def binary_search(sorted_books, target_title):
@@ -63,32 +124,559 @@ def binary_search(sorted_books, target_title):
             high = mid - 1
     return None
 
-#BINARY SEARCH TREE
-class BSTNode:
-    def __init__(self, book):
-        self.book = book
+#BALANCED BINARY SEARCH TREE (AVL, iterative, size-augmented for order statistics)
+class AVLNode:
+    __slots__ = ('key', 'item', 'left', 'right', 'height', 'size')
+
+    def __init__(self, key, item):
+        self.key = key
+        self.item = item
         self.left = None
         self.right = None
+        self.height = 1
+        self.size = 1
+
+def _height(node):
+    return node.height if node else 0
+
+def _size(node):
+    return node.size if node else 0
+
+def _update(node):
+    node.height = 1 + max(_height(node.left), _height(node.right))
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+def _rotate_right(node):
+    pivot = node.left
+    node.left = pivot.right
+    pivot.right = node
+    _update(node)
+    _update(pivot)
+    return pivot
+
+def _rotate_left(node):
+    pivot = node.right
+    node.right = pivot.left
+    pivot.left = node
+    _update(node)
+    _update(pivot)
+    return pivot
+
+def _rebalance(node):
+    _update(node)
+    balance = _height(node.left) - _height(node.right)
+    if balance > 1:
+        if _height(node.left.left) < _height(node.left.right):
+            node.left = _rotate_left(node.left)
+        return _rotate_right(node)
+    if balance < -1:
+        if _height(node.right.right) < _height(node.right.left):
+            node.right = _rotate_right(node.right)
+        return _rotate_left(node)
+    return node
+
+class AVLTree:
+    """
+    Ordered index keyed by key_func(item); keys must be unique, e.g. (year, id).
+    Insert, delete, rank and k-th lookups are O(log n) and nothing recurses
+    deeper than the tree height, so pre-sorted input can't degrade it.
+    """
+
+    def __init__(self, key_func, items=()):
+        self.key_func = key_func
+        pairs = sorted(((key_func(item), item) for item in items), key=lambda pair: pair[0])
+        self.root = self._build(pairs, 0, len(pairs))
+
+    def _build(self, pairs, lo, hi):
+        # Recursion depth is log2(n) here: the input is already sorted.
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        node = AVLNode(*pairs[mid])
+        node.left = self._build(pairs, lo, mid)
+        node.right = self._build(pairs, mid + 1, hi)
+        _update(node)
+        return node
+
+    def __len__(self):
+        return _size(self.root)
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def _fix_path(self, path):
+        # Walk back up from the changed leaf, rebalancing and re-linking.
+        for i in range(len(path) - 1, -1, -1):
+            node = _rebalance(path[i])
+            if i == 0:
+                self.root = node
+            elif path[i - 1].left is path[i]:
+                path[i - 1].left = node
+            else:
+                path[i - 1].right = node
+
+    def add(self, item):
+        key = self.key_func(item)
+        path = []
+        node = self.root
+        while node:
+            if key == node.key:
+                node.item = item
+                return
+            path.append(node)
+            node = node.left if key < node.key else node.right
+
+        leaf = AVLNode(key, item)
+        if not path:
+            self.root = leaf
+            return
+        if key < path[-1].key:
+            path[-1].left = leaf
+        else:
+            path[-1].right = leaf
+        self._fix_path(path)
+
+    def remove(self, item):
+        key = self.key_func(item)
+        path = []
+        node = self.root
+        while node and node.key != key:
+            path.append(node)
+            node = node.left if key < node.key else node.right
+        if node is None:
+            return
+
+        if node.left and node.right:
+            # Pull the in-order successor up and delete it from its old spot.
+            path.append(node)
+            successor = node.right
+            while successor.left:
+                path.append(successor)
+                successor = successor.left
+            node.key, node.item = successor.key, successor.item
+            node = successor
+
+        child = node.left or node.right
+        if not path:
+            self.root = child
+            return
+        if path[-1].left is node:
+            path[-1].left = child
+        else:
+            path[-1].right = child
+        self._fix_path(path)
+
+    #ORDER STATISTICS
+    def rank_left(self, key):
+        """Number of keys < key."""
+        rank = 0
+        node = self.root
+        while node:
+            if node.key < key:
+                rank += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return rank
+
+    def rank_right(self, key):
+        """Number of keys <= key."""
+        rank = 0
+        node = self.root
+        while node:
+            if node.key <= key:
+                rank += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return rank
+
+    def kth(self, k):
+        """k-th smallest item, 0-based."""
+        if k < 0:
+            k += len(self)
+        node = self.root
+        while node:
+            left_size = _size(node.left)
+            if k < left_size:
+                node = node.left
+            elif k == left_size:
+                return node.item
+            else:
+                k -= left_size + 1
+                node = node.right
+        raise IndexError("AVLTree index out of range")
+
+    #ITERATION
+    def iter_from(self, start):
+        """Ascending items from position start onwards."""
+        stack = []
+        node = self.root
+        k = start
+        while node:
+            left_size = _size(node.left)
+            if k < left_size:
+                stack.append(node)
+                node = node.left
+            elif k == left_size:
+                stack.append(node)
+                break
+            else:
+                k -= left_size + 1
+                node = node.right
+        while stack:
+            node = stack.pop()
+            yield node.item
+            node = node.right
+            while node:
+                stack.append(node)
+                node = node.left
+
+    def descending(self):
+        stack = []
+        node = self.root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.right
+            node = stack.pop()
+            yield node.item
+            node = node.left
+
+    def slice(self, start, end):
+        if start >= end:
+            return []
+        return list(islice(self.iter_from(start), end - start))
+
+    def range(self, low_key, high_key):
+        """Items with low_key <= key < high_key, ascending."""
+        start = self.rank_left(low_key)
+        return self.slice(start, self.rank_left(high_key))
+
+
+#PREFIX SEARCH (sorted array of (text, id), every match of a prefix is one contiguous run)
+class PrefixIndex:
+    def __init__(self, entries=()):
+        # Bulk load: one sort, instead of an O(n) insort per entry.
+        self.entries = sorted(entries)
+
+    def add(self, text, item_id):
+        insort(self.entries, (text, item_id))
 
-def insert_bst(root, book):
-    if root is None:
-        return BSTNode(book)
-    if book.year < root.book.year:
-        root.left = insert_bst(root.left, book)
+    def remove(self, text, item_id):
+        pos = bisect_left(self.entries, (text, item_id))
+        if pos < len(self.entries) and self.entries[pos] == (text, item_id):
+            del self.entries[pos]
+
+    def matches(self, prefix, limit=None):
+        results = []
+        i = bisect_left(self.entries, (prefix,))
+        while i < len(self.entries) and self.entries[i][0].startswith(prefix):
+            results.append(self.entries[i])
+            if limit is not None and len(results) >= limit:
+                break
+            i += 1
+        return results
+
+    def search(self, prefix, limit=None):
+        return [item_id for _, item_id in self.matches(prefix, limit)]
+
+
+#N-GRAM INVERTED INDEX (substring search)
+def ngrams(text, size):
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+class NgramIndex:
+    """
+    Substring search. Each n-gram (trigram by default) of the indexed texts
+    maps to a sorted array of the ids of the items containing it; a query
+    intersects the arrays of its own n-grams and checks the survivors' texts
+    with str.find. Queries shorter than n scan every stored text instead.
+    Ids must fit in an unsigned 32-bit int.
+    """
+
+    def __init__(self, n=3, items=()):
+        self.n = n
+        self.texts = {}
+        postings = {}
+        for item_id, *texts in items:
+            self.texts[item_id] = tuple(texts)
+            for gram in self._grams(texts):
+                postings.setdefault(gram, []).append(item_id)
+        self.postings = {gram: array('I', sorted(ids)) for gram, ids in postings.items()}
+
+    def _grams(self, texts):
+        grams = set()
+        for text in texts:
+            grams |= ngrams(text, self.n)
+        return grams
+
+    def add(self, item_id, *texts):
+        self.remove(item_id)
+        self.texts[item_id] = texts
+        for gram in self._grams(texts):
+            ids = self.postings.get(gram)
+            if ids is None:
+                self.postings[gram] = array('I', (item_id,))
+            else:
+                ids.insert(bisect_left(ids, item_id), item_id)
+
+    def remove(self, item_id):
+        texts = self.texts.pop(item_id, None)
+        if texts is None:
+            return
+        for gram in self._grams(texts):
+            ids = self.postings.get(gram)
+            if ids is None:
+                continue
+            pos = bisect_left(ids, item_id)
+            if pos < len(ids) and ids[pos] == item_id:
+                del ids[pos]
+                if not ids:
+                    del self.postings[gram]
+
+    def ranked(self, query):
+        """Unsorted (field, position, length, id) tuples for every item containing query."""
+        if not query:
+            return []
+        if len(query) < self.n:
+            candidates = self.texts
+        else:
+            postings = [self.postings.get(gram) for gram in ngrams(query, self.n)]
+            if not all(postings):
+                return []
+            # Intersect smallest posting list first, then drop false positives.
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for ids in postings[1:]:
+                candidates.intersection_update(ids)
+                if not candidates:
+                    return []
+
+        ranked = []
+        for item_id in candidates:
+            for field, text in enumerate(self.texts[item_id]):
+                pos = text.find(query)
+                if pos != -1:
+                    ranked.append((field, pos, len(text), item_id))
+                    break
+        return ranked
+
+    def search(self, query, limit=None):
+        ranked = self.ranked(query)
+        if limit is None:
+            ranked.sort()
+        else:
+            ranked = top_k(ranked, limit, key=None)
+        return [entry[-1] for entry in ranked]
+
+
+#FUZZY SEARCH (BK-tree over the Levenshtein distance of single words)
+def levenshtein(a, b):
+    # A shared prefix/suffix never costs anything; trimming it first keeps
+    # the O(len(a) * len(b)) table small for near-identical words.
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    a, b = a[start:end_a], b[start:end_b]
+    if len(a) < len(b):
+        a, b = b, a
+    if not b:
+        return len(a)
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        left = i
+        for j, cb in enumerate(b):
+            # Inline min() of substitute / delete / insert: this loop is the
+            # whole cost of building and searching the BK-tree.
+            cost = previous[j] + (ca != cb)
+            if previous[j + 1] + 1 < cost:
+                cost = previous[j + 1] + 1
+            if left + 1 < cost:
+                cost = left + 1
+            current.append(cost)
+            left = cost
+        previous = current
+    return previous[-1]
+
+def typo_budget(word):
+    # Short words get no typos, or "cat" would match half the dictionary.
+    # Plain Levenshtein counts a swapped pair ("tolkein") as two edits, so
+    # longer words get two.
+    if len(word) < 4:
+        return 0
+    return 1 if len(word) < 7 else 2
+
+class BKNode:
+    __slots__ = ('word', 'children')
+
+    def __init__(self, word):
+        self.word = word
+        self.children = {}
+
+class BKTree:
+    """
+    Children hang off an edge labelled with their distance to the parent. By
+    the triangle inequality, words within `tolerance` of a query can only sit
+    under edges labelled d - tolerance .. d + tolerance (d = distance from the
+    query to the node), so a search skips most of the tree.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, word):
+        if self.root is None:
+            self.root = BKNode(word)
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            d = levenshtein(word, node.word)
+            if d == 0:
+                return
+            child = node.children.get(d)
+            if child is None:
+                node.children[d] = BKNode(word)
+                self.size += 1
+                return
+            node = child
+
+    def search(self, word, tolerance):
+        """(distance, word) for every word within tolerance, unsorted."""
+        found = []
+        if self.root is None:
+            return found
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = levenshtein(word, node.word)
+            if d <= tolerance:
+                found.append((d, node.word))
+            for edge, child in node.children.items():
+                if d - tolerance <= edge <= d + tolerance:
+                    stack.append(child)
+        return found
+
+class FuzzyIndex:
+    """
+    Typo-tolerant word search. Every distinct word of the indexed texts goes
+    into a BK-tree once; postings map each word to the items using it.
+    The tree is only built on the first search (most indexes never get a
+    fuzzy query before they are rebuilt). After that, words whose last item
+    is removed stay in the tree (deleting from a BK-tree means rebuilding
+    the subtree) but have no postings, so they never produce results; once
+    they outnumber the live words the tree is dropped and built afresh.
+    """
+
+    def __init__(self):
+        self.tree = None
+        self.dead = 0
+        self.postings = {}
+        self.words = {}
+
+    def add(self, item_id, *texts):
+        self.remove(item_id)
+        words = {word for text in texts for word in text.split()}
+        self.words[item_id] = words
+        for word in words:
+            bucket = self.postings.get(word)
+            if bucket is None:
+                bucket = self.postings[word] = set()
+                if self.tree is not None:
+                    size = self.tree.size
+                    self.tree.add(word)
+                    if self.tree.size == size:
+                        # Was a dead word; live again.
+                        self.dead -= 1
+            bucket.add(item_id)
+
+    def remove(self, item_id):
+        for word in self.words.pop(item_id, ()):
+            bucket = self.postings.get(word)
+            if bucket is not None:
+                bucket.discard(item_id)
+                if not bucket:
+                    del self.postings[word]
+                    if self.tree is not None:
+                        self.dead += 1
+        if self.dead > len(self.postings):
+            self.tree = None
+            self.dead = 0
+
+    @staticmethod
+    def build_tree(words):
+        tree = BKTree()
+        for word in words:
+            tree.add(word)
+        return tree
+
+    def install(self, tree, words):
+        """
+        Start using `tree`, built from `words` (a set of the postings' words
+        taken earlier), catching up on words added or removed since.
+        """
+        for word in self.postings.keys() - words:
+            tree.add(word)
+        self.tree = tree
+        self.dead = len(words - self.postings.keys())
+
+    def ensure_tree(self):
+        if self.tree is None:
+            words = set(self.postings)
+            self.install(self.build_tree(words), words)
+        return self.tree
+
+    def ranked(self, query):
+        """
+        Unsorted (missing words, total distance, id) for every item with a word
+        close to any word of the query: items matching every query word come
+        first, then the ones needing the fewest edits.
+        """
+        terms = query.split()
+        tree = self.ensure_tree()
+        closest = {}
+        for position, term in enumerate(terms):
+            for distance, word in tree.search(term, typo_budget(term)):
+                for item_id in self.postings.get(word, ()):
+                    best = closest.setdefault(item_id, [None] * len(terms))
+                    if best[position] is None or distance < best[position]:
+                        best[position] = distance
+
+        ranked = []
+        for item_id, best in closest.items():
+            matched = [d for d in best if d is not None]
+            ranked.append((len(terms) - len(matched), sum(matched), item_id))
+        return ranked
+
+    def search(self, query, limit=None):
+        ranked = self.ranked(query)
+        if limit is None:
+            ranked.sort()
+        else:
+            ranked = top_k(ranked, limit, key=None)
+        return [entry[-1] for entry in ranked]
+
+
+#TOP-K (heap based partial sort, O(n log k) instead of sorting everything)
+def top_k(items, k, key='title', reverse=False):
+    if key is None:
+        key_func = None
+    elif callable(key):
+        key_func = key
     else:
-        root.right = insert_bst(root.right, book)
-    return root
-
-#Ascending)
-def inorder_traversal(root, result_list):
-    if root:
-        inorder_traversal(root.left, result_list)
-        result_list.append(root.book)
-        inorder_traversal(root.right, result_list)
-
-#(Descending)
-def reverse_inorder_traversal(root, result_list):
-    if root:
-        reverse_inorder_traversal(root.right, result_list)
-        result_list.append(root.book)
-        reverse_inorder_traversal(root.left, result_list)
\ No newline at end of file
+        getter = operator.attrgetter(key)
+
+        def key_func(item):
+            value = getter(item)
+            return value.lower() if isinstance(value, str) else value
+
+    if reverse:
+        return heapq.nlargest(k, items, key=key_func)
+    return heapq.nsmallest(k, items, key=key_func)
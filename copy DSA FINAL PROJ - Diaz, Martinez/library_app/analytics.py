@@ -0,0 +1,196 @@
+"""
+Loan history and the counters built from it.
+
+Every borrow and return appends a LoanEvent in the same transaction as
+the stock change (stock.py calls record_borrows / record_returns); that
+one INSERT is all they add to the write lock a borrow holds. roll_up()
+later folds the new events into the BookStats rows and the hourly, daily
+and all-time LoanCounter rows, many loans per UPDATE. It runs before the
+popular listing and the dashboard read them, and on every sweep_overdue
+and reconcile_stock pass. Reports then read those counters instead of
+scanning the ledger, so they cost the same however long the history gets.
+History starts with this feature: loans made before it only show up
+when they are returned.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import BookStats, LoanCounter, LoanEvent
+from .pagination import Page, encode_cursor
+
+# Fixed start for the single all-time counter row.
+ALL_TIME = datetime(2000, 1, 1, tzinfo=timezone.get_fixed_timezone(0))
+
+
+def bump(model, lookup, **deltas):
+    """Add deltas to the row matching lookup, creating it if needed."""
+    increments = {field: F(field) + n for field, n in deltas.items()}
+    if model.objects.filter(**lookup).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Someone else created it first.
+        model.objects.filter(**lookup).update(**increments)
+
+
+def buckets(moment):
+    """(period, start) of every counter a moment falls into."""
+    local = timezone.localtime(moment)
+    hour = local.replace(minute=0, second=0, microsecond=0)
+    return [(LoanCounter.HOUR, hour), (LoanCounter.DAY, hour.replace(hour=0)), (LoanCounter.ALL, ALL_TIME)]
+
+
+#RECORDING
+# Call these inside the borrow / return transaction.
+def record_borrows(loans, now=None):
+    """loans: (user_id, book_id) pairs that were just lent out."""
+    loans = list(loans)
+    if not loans:
+        return
+    now = now or timezone.now()
+    LoanEvent.objects.bulk_create([
+        LoanEvent(kind=LoanEvent.BORROW, user_id=user_id, book_id=book_id, at=now) for user_id, book_id in loans
+    ])
+
+
+def record_returns(loans, now=None):
+    """loans: (user_id, book_id, borrowed_at) of loans that just ended."""
+    loans = list(loans)
+    if not loans:
+        return
+    now = now or timezone.now()
+    LoanEvent.objects.bulk_create([
+        LoanEvent(
+            kind=LoanEvent.RETURN, user_id=user_id, book_id=book_id, at=now,
+            loan_seconds=max(0, int((now - borrowed_at).total_seconds())),
+        )
+        for user_id, book_id, borrowed_at in loans
+    ])
+
+
+#ROLL-UP
+def roll_up(batch_size=5000):
+    """
+    Add the LoanEvents not counted yet to BookStats and LoanCounter,
+    batch_size at a time, one transaction each. Returns how many.
+    """
+    rolled = 0
+    while True:
+        events = list(
+            LoanEvent.objects.filter(rolled_up=False).order_by('id')
+            .values_list('id', 'kind', 'book_id', 'at', 'loan_seconds')[:batch_size]
+        )
+        if not events:
+            return rolled
+        with transaction.atomic():
+            claimed = LoanEvent.objects.filter(pk__in=[event[0] for event in events], rolled_up=False).update(rolled_up=True)
+            if claimed != len(events):
+                # Another process is rolling these up right now; leave them to it.
+                transaction.set_rollback(True)
+                return rolled
+            add_to_counters(events)
+        rolled += len(events)
+
+
+def add_to_counters(events):
+    # [borrows, returns, loan seconds] per book and per counter row.
+    per_book = defaultdict(lambda: [0, 0, 0])
+    per_counter = defaultdict(lambda: [0, 0, 0])
+    for _, kind, book_id, at, seconds in events:
+        deltas = (1, 0, 0) if kind == LoanEvent.BORROW else (0, 1, seconds or 0)
+        totals = [per_counter[bucket] for bucket in buckets(at)]
+        if book_id is not None:
+            totals.append(per_book[book_id])
+        for total in totals:
+            for i, n in enumerate(deltas):
+                total[i] += n
+
+    for book_id, (borrows, returns, seconds) in per_book.items():
+        bump(BookStats, {'book_id': book_id}, borrow_count=borrows, return_count=returns, loan_seconds=seconds)
+    for (period, start), (borrows, returns, seconds) in per_counter.items():
+        bump(LoanCounter, {'period': period, 'start': start}, borrows=borrows, returns=returns, loan_seconds=seconds)
+
+
+#POPULAR LISTING
+def popular_page(index, after=None, before=None, per_page=20):
+    """
+    Most borrowed books first, straight from BookStats: a keyset walk down
+    the (borrow_count, book) index. Not cached, since every borrow can
+    reorder it. Cursors are (borrow_count, book_id).
+    """
+    roll_up()
+    rows = BookStats.objects.filter(borrow_count__gt=0)
+    if after is not None:
+        count, book_id = after
+        rows = rows.filter(Q(borrow_count__lt=count) | Q(borrow_count=count, book_id__lt=book_id))
+    elif before is not None:
+        count, book_id = before
+        rows = rows.filter(Q(borrow_count__gt=count) | Q(borrow_count=count, book_id__gt=book_id))
+    if before is not None:
+        rows = rows.order_by('borrow_count', 'book_id')
+    else:
+        rows = rows.order_by('-borrow_count', '-book_id')
+
+    keys = list(rows.values_list('borrow_count', 'book_id')[:per_page + 1])
+    more = len(keys) > per_page
+    keys = keys[:per_page]
+    if before is not None:
+        keys.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = after is not None, more
+
+    items = [index.by_id[book_id] for _, book_id in keys if book_id in index.by_id]
+    if not keys:
+        return Page(items)
+    return Page(
+        items,
+        encode_cursor(keys[-1]) if has_next else None,
+        encode_cursor(keys[0]) if has_prev else None,
+    )
+
+
+#DASHBOARD
+def loan_dashboard(now=None, top=10, hours=24, days=30):
+    """Everything the staff loan stats page shows; a fixed number of indexed reads."""
+    roll_up()
+    now = timezone.localtime(now or timezone.now())
+    this_hour = now.replace(minute=0, second=0, microsecond=0)
+    today = this_hour.replace(hour=0)
+
+    # One read of the last week's hourly rows (at most 168) serves both the
+    # recent series and the busiest hours of the day.
+    week = max(timedelta(days=7), timedelta(hours=hours))
+    hourly = {c.start: c for c in LoanCounter.objects.filter(period=LoanCounter.HOUR, start__gt=this_hour - week)}
+    by_hour_of_day = Counter()
+    for start, counter in hourly.items():
+        if start > this_hour - timedelta(days=7):
+            by_hour_of_day[timezone.localtime(start).hour] += counter.borrows
+    daily = {c.start: c for c in LoanCounter.objects.filter(
+        period=LoanCounter.DAY, start__gt=today - timedelta(days=days),
+    )}
+
+    return {
+        'totals': LoanCounter.objects.filter(period=LoanCounter.ALL, start=ALL_TIME).first(),
+        'popular': list(BookStats.objects.filter(borrow_count__gt=0).select_related('book')
+                        .order_by('-borrow_count', '-book_id')[:top]),
+        'hourly': series(hourly, this_hour, hours, timedelta(hours=1)),
+        'daily': series(daily, today, days, timedelta(days=1)),
+        'busiest_hours': [(hour, n) for hour, n in by_hour_of_day.most_common(5) if n],
+    }
+
+
+def series(counters, last, n, step):
+    """n (start, borrows, returns) rows ending at `last`, newest first, zero-filled."""
+    rows = []
+    for i in range(n):
+        start = last - step * i
+        counter = counters.get(start)
+        rows.append((start, counter.borrows if counter else 0, counter.returns if counter else 0))
+    return rows
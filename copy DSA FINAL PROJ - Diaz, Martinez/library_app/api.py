@@ -0,0 +1,202 @@
+"""
+Read-only JSON API for kiosk and mobile clients.
+
+GET /api/books/            same q / type / sort / dir / year_from / year_to
+                           parameters as library_home, plus limit and fields
+GET /api/my-borrowings/    the caller's loans, newest first
+GET /api/waitlist/<id>/    the caller's place in a book's waitlist
+
+The lists use cursor pagination (after / before tokens from the previous
+response), read only the requested columns with values() and stream the
+JSON body. Every response carries an ETag built from the catalog/loan
+version counters, so polling something unchanged costs one small query and
+a 304.
+"""
+import json
+from datetime import datetime
+from functools import wraps
+
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_GET
+
+from .cache import digest
+from .catalog_index import current_versions, get_catalog
+from .listing import catalog_page
+from .models import Book, Borrowing, Reservation
+from .pagination import decode_cursor, encode_cursor
+from .stock import queue_position
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+BOOK_FIELDS = ('id', 'title', 'author', 'year', 'quantity', 'available', 'pdf_stub')
+BOOK_DEFAULT_FIELDS = ('id', 'title', 'author', 'year', 'quantity', 'available')
+# API name -> values() lookup
+LOAN_FIELDS = {
+    'id': 'id',
+    'book_id': 'book_id',
+    'book_title': 'book__title',
+    'borrowed_at': 'borrowed_at',
+    'status': 'status',
+}
+
+
+def api_login_required(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'authentication required'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def parse_fields(raw, allowed, default):
+    if not raw:
+        return list(default), None
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        return None, f"unknown field(s): {', '.join(unknown)}"
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields, None
+
+
+def parse_limit(raw):
+    try:
+        return max(1, min(MAX_LIMIT, int(raw)))
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def stream_page(rows, next_cursor, prev_cursor):
+    """Yields the response body piece by piece instead of building one big string."""
+    yield '{"results":['
+    for i, row in enumerate(rows):
+        yield (',' if i else '') + json.dumps(row, default=json_default)
+    yield '],"next":%s,"prev":%s}' % (json.dumps(next_cursor), json.dumps(prev_cursor))
+
+
+def json_stream_response(etag, rows, next_cursor, prev_cursor):
+    response = StreamingHttpResponse(stream_page(rows, next_cursor, prev_cursor), content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+#BOOKS
+@require_GET
+@api_login_required
+def book_list(request):
+    fields, error = parse_fields(request.GET.get('fields'), BOOK_FIELDS, BOOK_DEFAULT_FIELDS)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+    limit = parse_limit(request.GET.get('limit'))
+
+    version, loan_version = current_versions()
+    etag = f'W/"books-{version}-{loan_version}-{digest(request.GET.urlencode())}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    index = get_catalog(version)
+    page, _, _ = catalog_page(index, request.GET, per_page=limit)
+    ids = [book.id for book in page.items]
+    # Only the requested columns, straight from the database (fresh stock),
+    # without building model instances.
+    by_id = {row['id']: row for row in Book.objects.filter(id__in=ids).values(*fields)}
+    rows = (by_id[book_id] for book_id in ids if book_id in by_id)
+    return json_stream_response(etag, rows, page.next_cursor, page.prev_cursor)
+
+
+#BORROWINGS
+@require_GET
+@api_login_required
+def my_borrowings(request):
+    fields, error = parse_fields(request.GET.get('fields'), LOAN_FIELDS, LOAN_FIELDS)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+    limit = parse_limit(request.GET.get('limit'))
+
+    version, loan_version = current_versions()
+    etag = f'W/"loans-{request.user.pk}-{version}-{loan_version}-{digest(request.GET.urlencode())}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    loans = Borrowing.objects.filter(user=request.user)
+    # Newest first; keyset on (borrowed_at, id).
+    after = decode_cursor(request.GET.get('after'))
+    before = decode_cursor(request.GET.get('before'))
+    ordering = ['-borrowed_at', '-id']
+    cursor = after or before
+    if cursor:
+        try:
+            stamp, loan_id = cursor
+            stamp, loan_id = datetime.fromisoformat(stamp), int(loan_id)
+        except (TypeError, ValueError):
+            # Not one of ours: serve the first page, with no prev cursor.
+            after = before = None
+        else:
+            if after:
+                loans = loans.filter(Q(borrowed_at__lt=stamp) | Q(borrowed_at=stamp, id__lt=loan_id))
+            else:
+                loans = loans.filter(Q(borrowed_at__gt=stamp) | Q(borrowed_at=stamp, id__gt=loan_id))
+                ordering = ['borrowed_at', 'id']
+
+    lookups = {LOAN_FIELDS[name] for name in fields} | {'borrowed_at', 'id'}
+    rows = list(loans.order_by(*ordering).values(*lookups)[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if ordering[0] == 'borrowed_at':
+        rows.reverse()
+        has_next, has_prev = bool(rows), has_more
+    else:
+        has_next, has_prev = has_more, bool(after) and bool(rows)
+
+    def key(row):
+        return encode_cursor([row['borrowed_at'].isoformat(), row['id']])
+
+    next_cursor = key(rows[-1]) if rows and has_next else None
+    prev_cursor = key(rows[0]) if rows and has_prev else None
+    projected = ({name: row[LOAN_FIELDS[name]] for name in fields} for row in rows)
+    return json_stream_response(etag, projected, next_cursor, prev_cursor)
+
+
+#WAITLIST
+@require_GET
+@api_login_required
+def waitlist_position(request, book_id):
+    # Cheap to poll: loans and waitlist changes all bump the loan version.
+    version, loan_version = current_versions()
+    etag = f'W/"waitlist-{request.user.pk}-{book_id}-{version}-{loan_version}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    reservation = Reservation.objects.filter(user=request.user, book_id=book_id).first()
+    if reservation is not None:
+        body = {
+            'book_id': book_id,
+            'status': 'waiting',
+            'position': queue_position(reservation),
+            'waiting': Reservation.objects.filter(book_id=book_id).count(),
+        }
+    elif Borrowing.objects.filter(user=request.user, book_id=book_id).exists():
+        # Either borrowed directly or a returned copy was passed on to them.
+        body = {'book_id': book_id, 'status': 'borrowed', 'position': None}
+    else:
+        body = {'book_id': book_id, 'status': 'none', 'position': None}
+
+    response = JsonResponse(body)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
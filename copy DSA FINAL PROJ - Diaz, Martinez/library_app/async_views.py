@@ -0,0 +1,144 @@
+"""
+Async versions of the catalog and borrow flows, for serving under ASGI.
+
+Enabled with LIBRARY_ASYNC_VIEWS (see library_system/asgi.py). Database
+reads use the async ORM; only the sorting and searching from algo.py run
+on a small dedicated thread pool, so they don't stall the event loop and
+nothing waiting on I/O holds one of its threads. Cache reads and writes
+(and the book cards, which are mostly cache hits) go through
+sync_to_async(thread_sensitive=False); the borrow/return transactions and
+template rendering go through plain sync_to_async because Django's
+transactions and template context processors are sync-only.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import aget_object_or_404, redirect, render
+from django.utils.cache import get_conditional_response
+
+from .cache import cached_catalog_page, cached_results, is_live, store_results
+from . import snapshot
+from .catalog_index import catalog, get_catalog
+from .listing import catalog_page
+from .models import Book, Borrowing, CatalogState
+from .perf import rendering
+from .stock import borrow_or_reserve, return_copy
+from .views import (
+    apply_stock, borrow_redirect, library_context, page_etag, readable_on_page, waitlist_for, with_etag,
+)
+
+CPU_POOL = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'LIBRARY_CPU_THREADS', 4),
+    thread_name_prefix='catalog-cpu',
+)
+
+
+async def run_cpu(func, *args):
+    """
+    Run CPU-bound, database-free work on the bounded pool. Nothing closes
+    database connections opened on these threads, so keep the ORM out.
+    """
+    loop = asyncio.get_running_loop()
+    # run_in_executor doesn't carry context variables over; copy them so
+    # the perf timings still see this request.
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(CPU_POOL, partial(context.run, func, *args))
+
+
+def cache_io(func):
+    """Cache access, off the event loop but not tied to the main thread."""
+    return sync_to_async(func, thread_sensitive=False)
+
+
+async def load_user(request):
+    # Resolve the lazy user once, asynchronously, so later sync code
+    # (templates, context processors) doesn't query for it again.
+    request.user = await request.auser()
+    return request.user
+
+
+async def current_versions_async():
+    return await CatalogState.objects.filter(pk=1).values_list('version', 'loan_version').afirst() or (0, 0)
+
+
+async def get_catalog_async(version):
+    if getattr(settings, 'CATALOG_SNAPSHOT', 'off') != 'off':
+        # Already mapped at this version: no disk or database access.
+        index = snapshot.loaded(version)
+        if index is None:
+            index = await sync_to_async(get_catalog)(version)
+        return index
+    if version != catalog.version:
+        await sync_to_async(catalog.rebuild)(version)
+    return catalog
+
+
+@login_required
+async def library_home(request):
+    await load_user(request)
+    version, loan_version = await current_versions_async()
+    # Message storage may read the session, which is sync-only.
+    etag = await sync_to_async(page_etag)(request, version, loan_version)
+    if etag:
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified:
+            return not_modified
+    index = await get_catalog_async(version)
+    if index.version != version:
+        # An older snapshot (see views.library_home).
+        etag = None
+
+    if is_live(request.GET):
+        # Queries BookStats, so it runs where the ORM's connections are
+        # managed rather than on CPU_POOL.
+        page, message, sort_by = await sync_to_async(cached_catalog_page)(index, request.GET)
+    else:
+        result = await cache_io(cached_results)(index, request.GET)
+        if result is None:
+            result = await run_cpu(catalog_page, index, request.GET)
+            await cache_io(store_results)(index, request.GET, result)
+        page, message, sort_by = result
+
+    stock = {}
+    async for book_id, available in Book.objects.filter(id__in=[b.id for b in page.items]).values_list('id', 'available'):
+        stock[book_id] = available
+    page.items = apply_stock(page.items, stock)
+    readable = await sync_to_async(readable_on_page)(request.user, page.items)
+
+    context = await cache_io(library_context)(request, page, message, sort_by, readable)
+    with rendering():
+        response = await sync_to_async(render)(request, 'library_app/library.html', context)
+    return with_etag(response, etag)
+
+
+@login_required
+async def borrow_book(request, book_id):
+    user = await load_user(request)
+    book = await aget_object_or_404(Book, id=book_id)
+
+    outcome, _, created = await sync_to_async(borrow_or_reserve)(user, book)
+    return await sync_to_async(borrow_redirect)(request, book, outcome, created)
+
+
+@login_required
+async def my_books(request):
+    user = await load_user(request)
+    borrowed = [item async for item in Borrowing.objects.filter(user=user).select_related('book')]
+    waiting = await sync_to_async(waitlist_for)(user)
+    with rendering():
+        return await sync_to_async(render)(request, 'library_app/my_books.html', {'borrowed': borrowed, 'waiting': waiting})
+
+
+@login_required
+async def return_book(request, borrowing_id):
+    user = await load_user(request)
+    borrow_record = await aget_object_or_404(Borrowing, id=borrowing_id, user=user)
+
+    await sync_to_async(return_copy)(borrow_record)
+
+    return redirect('my_books')
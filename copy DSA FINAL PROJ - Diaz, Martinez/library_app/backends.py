@@ -0,0 +1,66 @@
+"""
+Authentication backend that caches the logged-in user.
+
+Every view is behind @login_required, so every request loads the user row
+for its session. CachedModelBackend keeps that row in the USER_CACHE_ALIAS
+cache for USER_CACHE_TIMEOUT seconds; signals.py forgets it whenever the
+user is saved, deleted or their groups / permissions change. Changes made
+with queryset.update() bypass those signals and show up after the timeout.
+
+Only the columns other than the password hash are cached, plus the session
+hash derived from it, which is all login_required / get_user check. The
+password is left deferred, so it's read from the database if something
+actually needs it (and save() won't write it back).
+
+Signals only clear the cache in the process they run in, so unless
+USER_CACHE_ALIAS is a cache every worker shares, a deactivated user or a
+revoked is_staff can go unnoticed in other workers until the timeout.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import transaction
+
+
+def user_cache():
+    return caches[getattr(settings, 'USER_CACHE_ALIAS', 'default')]
+
+
+def user_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def forget_user(user_id):
+    user_cache().delete(user_key(user_id))
+    # Again after commit, in case a request re-cached the old row meanwhile.
+    transaction.on_commit(lambda: user_cache().delete(user_key(user_id)))
+
+
+def cached_fields(user):
+    """What gets cached for user: (attnames, values, session hash), no password."""
+    fields = [f.attname for f in user._meta.concrete_fields if f.attname != 'password']
+    return fields, [getattr(user, name) for name in fields], user.get_session_auth_hash()
+
+
+def cached_user(UserModel, entry):
+    fields, values, session_hash = entry
+    user = UserModel.from_db(UserModel._default_manager.db, fields, values)
+    user.get_session_auth_hash = lambda: session_hash
+    return user
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        key = user_key(user_id)
+        entry = user_cache().get(key)
+        if entry is None:
+            try:
+                user = UserModel._default_manager.get(pk=user_id)
+            except UserModel.DoesNotExist:
+                return None
+            user_cache().set(key, cached_fields(user), getattr(settings, 'USER_CACHE_TIMEOUT', 300))
+        else:
+            user = cached_user(UserModel, entry)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,497 @@
+"""
+Benchmark suite for algo.py and the catalog views.
+
+Run through `python manage.py bench`. Each suite is a function registered
+with @suite(name) that takes the run options and yields
+(name, measurement dict) pairs; the command collects them into one JSON file
+and can compare it with an earlier run to flag regressions.
+"""
+import asyncio
+import gc
+import gzip
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from types import ModuleType
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import algo, async_views, large_sort, views
+from .catalog_index import BookRecord, CatalogIndex, bump_version, load_records, year_key
+from .models import Book, Borrowing
+
+SUITES = {}
+
+SHAPES = ('random', 'sorted_years', 'duplicate_titles')
+
+WORDS = (
+    'shadow', 'river', 'games', 'pride', 'murder', 'garden', 'winter', 'empire', 'secret',
+    'island', 'night', 'silver', 'house', 'storm', 'letters', 'crown', 'glass', 'dragon',
+)
+SURNAMES = ('Austen', 'Christie', 'Collins', 'Diaz', 'Martinez', 'Tolkien', 'Le Guin', 'Orwell', 'Morrison')
+
+
+def suite(name):
+    def register(func):
+        SUITES[name] = func
+        return func
+    return register
+
+
+#DATASETS
+def make_books(n, shape='random', seed=0):
+    """
+    n unsaved Book instances with ids set. Shapes:
+    random           - shuffled titles and years
+    sorted_years     - years ascending in id order, like a catalog bulk-loaded by publication date
+    duplicate_titles - only a handful of distinct titles
+    """
+    rnd = random.Random(seed)
+    distinct = 10 if shape == 'duplicate_titles' else n
+    books = []
+    for i in range(n):
+        title_no = rnd.randrange(distinct)
+        title = f"{WORDS[title_no % len(WORDS)].title()} {WORDS[(title_no // len(WORDS)) % len(WORDS)]} {title_no}"
+        year = 1800 + (i * 225) // max(n, 1) if shape == 'sorted_years' else rnd.randrange(1800, 2025)
+        quantity = rnd.randrange(1, 6)
+        books.append(Book(
+            id=i + 1, title=title, author=f"{rnd.choice('ABCDEFGHJKLMNPRST')}. {rnd.choice(SURNAMES)}",
+            year=year, quantity=quantity, available=quantity,
+        ))
+    return books
+
+
+def load_dataset(n, shape='random', borrowings=0, users=10, seed=0, batch_size=5000):
+    """Replace the Book/Borrowing tables with a generated dataset. Returns the users."""
+    Borrowing.objects.all().delete()
+    Book.objects.all().delete()
+    books = make_books(n, shape, seed)
+    for start in range(0, n, batch_size):
+        Book.objects.bulk_create(books[start:start + batch_size])
+
+    people = []
+    for i in range(users):
+        user, _ = User.objects.get_or_create(username=f'bench{i}')
+        user.set_password('bench')
+        user.save()
+        people.append(user)
+
+    rnd = random.Random(seed)
+    loans = []
+    for book in rnd.sample(books, min(borrowings, n)):
+        loans.append(Borrowing(user=rnd.choice(people), book=book))
+        book.available -= 1
+    Borrowing.objects.bulk_create(loans, batch_size=batch_size)
+    Book.objects.bulk_update([loan.book for loan in loans], ['available'], batch_size=batch_size)
+
+    # bulk_create skips signals; make every process rebuild its index once.
+    bump_version()
+    return people
+
+
+#MEASUREMENT
+def measure(func, repeat=3):
+    """Median wall time over `repeat` runs, plus the tracemalloc peak of one run."""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': statistics.median(times), 'peak_kb': round(peak / 1024, 1)}
+
+
+def measure_request(client, url, repeat=3):
+    """Median time of GET url and the number of SQL queries one request makes."""
+    # The log is a bounded deque; a full one would make every count 0.
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    assert response.status_code == 200, f"{url} returned {response.status_code}"
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        client.get(url)
+        times.append(time.perf_counter() - start)
+    return {'seconds': statistics.median(times), 'queries': len(queries), 'bytes': len(response.content)}
+
+
+def measure_memory(load, n):
+    """Memory kept alive by load()'s result, per book, and the cost of a full GC pass over it."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    seconds = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    gc.collect()
+    gc_seconds = time.perf_counter() - start
+    del result
+    return {
+        'seconds': seconds,
+        'bytes_per_book': retained // max(n, 1),
+        'peak_kb': round(peak / 1024, 1),
+        'gc_ms': round(gc_seconds * 1000, 2),
+    }
+
+
+#SUITES
+@suite('algo')
+def algo_suite(options):
+    for n in options['sizes']:
+        for shape in SHAPES:
+            books = make_books(n, shape)
+            tag = f"[{shape},n={n}]"
+            repeat = options['repeat']
+
+            yield f"merge_sort{tag}", measure(lambda: algo.merge_sort(books, key='title'), repeat)
+            yield f"baseline.sorted{tag}", measure(lambda: sorted(books, key=lambda b: b.title.casefold()), repeat)
+            yield f"merge_sort.multi_key{tag}", measure(lambda: algo.merge_sort(books, key=['author', ('year', True), 'title']), repeat)
+
+            by_title = algo.merge_sort(books, key='title')
+            titles = [b.title.lower() for b in by_title]
+            targets = [b.title for b in random.Random(1).sample(by_title, min(1000, n))]
+            yield f"binary_search.x{len(targets)}{tag}", measure(lambda: [algo.binary_search(by_title, t) for t in targets], repeat)
+            yield f"baseline.bisect.x{len(targets)}{tag}", measure(lambda: [bisect_left(titles, t.lower()) for t in targets], repeat)
+
+            yield f"build_id_hash_map{tag}", measure(lambda: algo.build_id_hash_map(books), repeat)
+            yield f"baseline.dict_comprehension{tag}", measure(lambda: {b.id: b for b in books}, repeat)
+
+            def avl_inserts():
+                tree = algo.AVLTree(year_key)
+                for book in books:
+                    tree.add(book)
+                return list(tree)
+            yield f"avl_tree.inserts{tag}", measure(avl_inserts, repeat)
+            yield f"avl_tree.bulk_build{tag}", measure(lambda: list(algo.AVLTree(year_key, books)), repeat)
+            yield f"baseline.sorted_years{tag}", measure(lambda: sorted(books, key=year_key), repeat)
+
+            yield f"top_k.20{tag}", measure(lambda: algo.top_k(books, 20, key='title'), repeat)
+
+            def fuzzy_build():
+                index = algo.FuzzyIndex()
+                for book in books:
+                    index.add(book.id, book.title.lower(), book.author.lower())
+                index.ensure_tree()
+                return index
+            fuzzy = fuzzy_build()
+            typos = ('shadw', 'rivre', 'christy', 'martnez stomr', 'dragn 12')
+            vocabulary = list(fuzzy.postings)
+            yield f"fuzzy.build{tag}", measure(fuzzy_build, repeat)
+            yield f"fuzzy.search.x{len(typos)}{tag}", measure(lambda: [fuzzy.search(q, 20) for q in typos], repeat)
+            yield f"baseline.levenshtein_scan.x{len(typos)}{tag}", measure(
+                lambda: [[algo.levenshtein(term, word) for term in q.split() for word in vocabulary] for q in typos], repeat
+            )
+
+
+@suite('large_sort')
+def large_sort_suite(options):
+    """merge_sort against parallel_sort per worker count and external_sort, by catalog size."""
+    for n in options['sizes']:
+        # BookRecords, as the export and index jobs would sort; they pickle cheaply.
+        books = [BookRecord.from_book(book) for book in make_books(n)]
+        tag = f"[n={n}]"
+        repeat = options['repeat']
+        yield f"merge_sort{tag}", measure(lambda: algo.merge_sort(books, key='title'), repeat)
+        for workers in options['workers']:
+            yield f"parallel_sort.w{workers}{tag}", measure(
+                lambda: large_sort.parallel_sort(books, key='title', workers=workers, min_size=0), repeat
+            )
+        run_size = max(1000, n // 10)
+        # Consumed one item at a time, as an export would; peak_kb is then
+        # about one run instead of the whole catalog.
+        yield f"external_sort.run{run_size}{tag}", measure(
+            lambda: sum(1 for _ in large_sort.external_sort(books, key='title', run_size=run_size)), repeat
+        )
+
+
+@suite('views')
+def views_suite(options):
+    for n in options['view_sizes']:
+        for shape in ('random', 'sorted_years'):
+            users = load_dataset(n, shape, borrowings=min(n // 10, 500))
+            client = Client()
+            client.force_login(users[0])
+            tag = f"[{shape},n={n}]"
+
+            start = time.perf_counter()
+            client.get('/')
+            yield f"library_home.cold{tag}", {'seconds': time.perf_counter() - start}
+
+            for label, url in (
+                ('default', '/'),
+                ('sort_title_desc', '/?sort=title&dir=desc'),
+                ('sort_year', '/?sort=year'),
+                ('year_range', '/?year_from=1900&year_to=1950'),
+                ('search_title', '/?q=shadow+river&type=title'),
+                ('search_substring', '/?q=stor&type=substring'),
+                ('search_prefix', '/?q=christie&type=prefix'),
+            ):
+                yield f"library_home.{label}{tag}", measure_request(client, url, options['repeat'])
+            yield f"my_books{tag}", measure_request(client, '/my-books/', options['repeat'])
+
+
+@suite('memory')
+def memory_suite(options):
+    for n in options['view_sizes']:
+        load_dataset(n)
+        tag = f"[n={n}]"
+        yield f"model_instances{tag}", measure_memory(lambda: list(Book.objects.all()), n)
+        yield f"book_records{tag}", measure_memory(load_records, n)
+
+        def rebuild():
+            index = CatalogIndex()
+            index.rebuild()
+            return index
+        yield f"catalog_index{tag}", measure_memory(rebuild, n)
+
+
+#CATALOG SNAPSHOT
+SNAPSHOT_CALLS = (
+    ('title_page', {'sort': 'title'}),
+    ('year_desc', {'sort': 'year', 'dir': 'desc'}),
+    ('year_range', {'year_from': '1900', 'year_to': '1950'}),
+    ('search_title', {'q': 'shadow river', 'type': 'title'}),
+    ('search_prefix', {'q': 'christie', 'type': 'prefix'}),
+    ('search_substring', {'q': 'stor', 'type': 'substring'}),
+    ('search_fuzzy', {'q': 'shadw rivr', 'type': 'fuzzy'}),
+)
+
+
+@suite('snapshot')
+def snapshot_suite(options):
+    """
+    Per-process CatalogIndex vs the mmapped snapshot: what starting a worker
+    costs, and the listing / search calls library_home makes. tracemalloc
+    doesn't see mapped pages, so the snapshot's peak_kb is only its private
+    memory; the file itself is shared by every worker.
+    """
+    from .listing import catalog_page
+    from .snapshot import SnapshotCatalog, build
+
+    for n in options['view_sizes']:
+        load_dataset(n)
+        tag = f"[n={n}]"
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.snapshot')
+            result = measure(lambda: build(path), options['repeat'])
+            result['file_bytes'] = os.path.getsize(path)
+            yield f"build{tag}", result
+
+            def rebuild():
+                index = CatalogIndex()
+                index.rebuild()
+                return index
+            indexes = {'index': rebuild(), 'snapshot': SnapshotCatalog(path)}
+            yield f"startup.index{tag}", measure(rebuild, options['repeat'])
+            yield f"startup.snapshot{tag}", measure(lambda: SnapshotCatalog(path), options['repeat'])
+
+            for label, params in SNAPSHOT_CALLS:
+                for name, index in indexes.items():
+                    yield f"{label}.{name}{tag}", measure(lambda: catalog_page(index, params), options['repeat'])
+
+
+#SESSIONS
+@suite('sessions')
+def sessions_suite(options):
+    """Queries and time per request under each SESSION_PROFILES entry."""
+    n = options['view_sizes'][0]
+    users = load_dataset(n, 'random', borrowings=min(n // 10, 500))
+    for name, profile in settings.SESSION_PROFILES.items():
+        with override_settings(SESSION_ENGINE=profile['engine'], AUTHENTICATION_BACKENDS=profile['backends']):
+            # A new client per profile: the session middleware picks its
+            # engine when the client's handler loads it.
+            client = Client()
+            client.force_login(users[0])
+            for label, url in (('library_home', '/'), ('my_books', '/my-books/')):
+                client.get(url)  # warm the session / user caches
+                yield f"{name}.{label}[n={n}]", measure_request(client, url, options['repeat'])
+
+
+#RESPONSES
+def header_bytes(response):
+    """Rough size of the status line and headers as sent over HTTP/1.1."""
+    lines = [f"HTTP/1.1 {response.status_code} {response.reason_phrase}"]
+    lines += [f"{name}: {value}" for name, value in response.items()]
+    lines += [f"Set-Cookie: {cookie.OutputString()}" for cookie in response.cookies.values()]
+    return sum(len(line) + 2 for line in lines) + 2
+
+
+def measure_wire(client, url, repeat=3, **headers):
+    """
+    Bytes on the wire and median time to first byte (`seconds`) of GET url.
+    The test client hands back whole responses, so for a page that isn't
+    streamed the time to first byte is the time to build all of it.
+    """
+    response = client.get(url, **headers)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        client.get(url, **headers)
+        times.append(time.perf_counter() - start)
+    return {
+        'seconds': statistics.median(times),
+        'status': response.status_code,
+        'encoding': response.get('Content-Encoding', 'identity'),
+        'body_bytes': len(response.content),
+        'wire_bytes': len(response.content) + header_bytes(response),
+    }
+
+
+def profile_middleware(name):
+    """settings.MIDDLEWARE as it would be under RESPONSE_PROFILES[name]."""
+    profiles = settings.RESPONSE_PROFILES
+    extra = {path for profile in profiles.values() for path in profile['middleware']}
+    base = [path for path in settings.MIDDLEWARE if path not in extra]
+    return base[:1] + profiles[name]['middleware'] + base[1:]
+
+
+@suite('response')
+def response_suite(options):
+    """The catalog page under each response profile: per encoding, and revalidated with its ETag."""
+    from django.contrib.staticfiles import finders
+
+    from .compression import brotli
+
+    n = options['view_sizes'][0]
+    users = load_dataset(n, 'random', borrowings=min(n // 10, 500))
+    encodings = [('identity', 'identity'), ('gzip', 'gzip, deflate')]
+    if brotli is not None:
+        encodings.append(('br', 'gzip, deflate, br'))
+
+    for name in settings.RESPONSE_PROFILES:
+        with override_settings(MIDDLEWARE=profile_middleware(name)):
+            client = Client()
+            client.force_login(users[0])
+            client.get('/')  # warm the catalog index and page caches
+            for label, accept in encodings:
+                yield f"{name}.{label}[n={n}]", measure_wire(client, '/', options['repeat'], HTTP_ACCEPT_ENCODING=accept)
+            etag = client.get('/', HTTP_ACCEPT_ENCODING=accept)['ETag']
+            yield f"{name}.revalidated[n={n}]", measure_wire(
+                client, '/', options['repeat'], HTTP_ACCEPT_ENCODING=accept, HTTP_IF_NONE_MATCH=etag,
+            )
+
+    # What the inline styles turned into: fetched once, then cached.
+    for path in ('library_app/dashboard.css',):
+        with open(finders.find(path), 'rb') as f:
+            data = f.read()
+        sizes = {'bytes': len(data), 'gzip_bytes': len(gzip.compress(data, compresslevel=9, mtime=0))}
+        if brotli is not None:
+            sizes['br_bytes'] = len(brotli.compress(data, quality=11))
+        yield f"static.{path}", sizes
+
+
+#WSGI VS ASGI
+def urlconf_with(module):
+    """The project URLconf with the catalog/borrow flows taken from module."""
+    from .urls import flow_patterns
+    root = import_module(settings.ROOT_URLCONF)
+    # A module object, since the URL resolver cache needs a hashable urlconf.
+    urlconf = ModuleType(f'bench_urls_{module.__name__.rsplit(".", 1)[-1]}')
+    urlconf.urlpatterns = flow_patterns(module) + list(root.urlpatterns)
+    return urlconf
+
+
+def load_summary(latencies, elapsed, errors):
+    latencies.sort()
+    return {
+        'seconds': elapsed,
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+        'errors': errors,
+    }
+
+
+def wsgi_load(user, url, concurrency, total):
+    """total GETs of url from `concurrency` threads, each with its own client, through the sync views."""
+    clients = []
+    for _ in range(concurrency):
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+
+    def worker(client, count):
+        latencies, errors = [], 0
+        for _ in range(count):
+            start = time.perf_counter()
+            if client.get(url).status_code != 200:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+        return latencies, errors
+
+    share = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+    with override_settings(ROOT_URLCONF=urlconf_with(views)):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(worker, clients, share))
+        elapsed = time.perf_counter() - start
+    return load_summary([t for lat, _ in results for t in lat], elapsed, sum(e for _, e in results))
+
+
+def asgi_load(user, url, concurrency, total):
+    """total GETs of url with at most `concurrency` in flight on one event loop, through the async views."""
+    async def run():
+        client = AsyncClient()
+        await client.aforce_login(user)
+        gate = asyncio.Semaphore(concurrency)
+        latencies, errors = [], 0
+
+        async def one():
+            nonlocal errors
+            async with gate:
+                start = time.perf_counter()
+                response = await client.get(url)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        return load_summary(latencies, time.perf_counter() - start, errors)
+
+    with override_settings(ROOT_URLCONF=urlconf_with(async_views)):
+        return asyncio.run(run())
+
+
+@suite('asgi')
+def asgi_suite(options):
+    n = options['view_sizes'][0]
+    users = load_dataset(n, 'random', borrowings=min(n // 10, 500))
+    for concurrency in options['concurrency']:
+        total = max(concurrency * 2, 200)
+        for label, url in (('library_home', '/'), ('my_books', '/my-books/')):
+            tag = f"[c={concurrency},n={n}]"
+            yield f"sync.{label}{tag}", wsgi_load(users[0], url, concurrency, total)
+            yield f"async.{label}{tag}", asgi_load(users[0], url, concurrency, total)
+
+
+#COMPARISON
+def compare(baseline, current, threshold):
+    """Names whose time grew by more than threshold (a fraction), with old/new seconds."""
+    regressions = []
+    for name, result in current.items():
+        before = baseline.get(name)
+        if not before or 'seconds' not in before or 'seconds' not in result:
+            continue
+        if result['seconds'] > before['seconds'] * (1 + threshold):
+            regressions.append((name, before['seconds'], result['seconds']))
+    return regressions
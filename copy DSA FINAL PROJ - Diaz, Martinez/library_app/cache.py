@@ -0,0 +1,129 @@
+"""
+Two-level cache for the catalog listing, on Django's cache framework.
+
+- Result pages (ids + cursors) are keyed by the catalog version, so any Book
+  change moves every lookup onto fresh keys and the old ones age out of the
+  size-bounded LRU.
+- Rendered book cards are keyed by the book's content and stock state
+  (available / quantity), so a borrow or return only misses that one card.
+
+Hit/miss counters live in the cache too and are shown on the admin
+cache stats page.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from .listing import catalog_page
+from .pagination import Page
+from .perf import rendering
+
+RESULT_PARAMS = ('q', 'type', 'sort', 'dir', 'year_from', 'year_to', 'after', 'before')
+RESULT_TIMEOUT = 600
+CARD_TIMEOUT = 3600
+STAT_KINDS = ('results', 'cards')
+
+
+def digest(text):
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+#STATS
+def count(kind, hits=0, misses=0):
+    for outcome, n in (('hits', hits), ('misses', misses)):
+        if not n:
+            continue
+        key = f"stats:{kind}:{outcome}"
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key, n)
+        except ValueError:
+            # Evicted between add and incr; losing one sample is fine.
+            cache.set(key, n, timeout=None)
+
+
+def cache_report():
+    report = []
+    for kind in STAT_KINDS:
+        hits = cache.get(f"stats:{kind}:hits", 0)
+        misses = cache.get(f"stats:{kind}:misses", 0)
+        total = hits + misses
+        report.append({
+            'kind': kind,
+            'hits': hits,
+            'misses': misses,
+            'ratio': f"{hits / total:.1%}" if total else "-",
+        })
+    return report
+
+
+#RESULT PAGES
+def results_key(version, params):
+    raw = '&'.join(f"{name}={params.get(name, '')}" for name in RESULT_PARAMS)
+    return f"catalog:{version}:{digest(raw)}"
+
+
+def is_live(params):
+    # The popular listing is reordered by every borrow, so it isn't keyed by
+    # the catalog version; it's one indexed BookStats query anyway.
+    return params.get('sort') == 'popular' and not params.get('q')
+
+
+def cached_catalog_page(index, params):
+    if is_live(params):
+        return catalog_page(index, params)
+    result = cached_results(index, params)
+    if result is None:
+        result = catalog_page(index, params)
+        store_results(index, params, result)
+    return result
+
+
+def cached_results(index, params):
+    """The cached (page, message, sort_by) for params, or None."""
+    cached = cache.get(results_key(index.version, params))
+    if cached is not None:
+        ids, next_cursor, prev_cursor, message, sort_by = cached
+        books = [index.by_id[book_id] for book_id in ids if book_id in index.by_id]
+        if len(books) == len(ids):
+            count('results', hits=1)
+            return Page(books, next_cursor, prev_cursor), message, sort_by
+    count('results', misses=1)
+    return None
+
+
+def store_results(index, params, result):
+    page, message, sort_by = result
+    cache.set(results_key(index.version, params), (
+        [book.id for book in page.items], page.next_cursor, page.prev_cursor, message, sort_by,
+    ), RESULT_TIMEOUT)
+
+
+#BOOK CARD FRAGMENTS
+def card_key(book, is_staff, can_read):
+    stock_version = f"{book.available}/{book.quantity}"
+    content = f"{book.title}|{book.author}|{book.year}|{book.pdf_stub}|{int(is_staff)}{int(can_read)}"
+    return f"card:{book.id}:{stock_version}:{digest(content)}"
+
+
+def render_cards(books, is_staff, readable=()):
+    """readable: ids of the books whose PDF link this user gets."""
+    can_read = [book.id in readable for book in books]
+    keys = [card_key(book, is_staff, read) for book, read in zip(books, can_read)]
+    found = cache.get_many(keys)
+    count('cards', hits=len(found), misses=len(keys) - len(found))
+
+    template = get_template('library_app/_book_card.html')
+    fresh = {}
+    cards = []
+    with rendering():
+        for key, book, read in zip(keys, books, can_read):
+            html = found.get(key)
+            if html is None:
+                html = fresh[key] = template.render({'book': book, 'is_staff': is_staff, 'can_read': read})
+            cards.append(mark_safe(html))
+    if fresh:
+        cache.set_many(fresh, CARD_TIMEOUT)
+    return cards
@@ -0,0 +1,349 @@
+"""
+Long-lived, per-process catalog index.
+
+Holds the id hash map, the title ordering and the year AVL tree so views
+don't reload and re-sort the whole Book table on every request. The index
+stores BookRecords read with values_list(), not Book instances. The index is
+patched incrementally from the Book post_save / post_delete signals and
+compares its version with CatalogState.version so other worker processes
+notice when it went stale and rebuild it.
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .algo import build_id_hash_map, AVLTree, PrefixIndex, NgramIndex, FuzzyIndex
+from .perf import timed
+from .models import Book, CatalogState
+
+
+#READ MODEL
+RECORD_FIELDS = ('id', 'title', 'author', 'year', 'quantity', 'available', 'pdf_stub')
+
+
+class BookRecord:
+    """
+    What the catalog listing needs of a Book, and nothing else: no _state,
+    no FieldFile, no per-instance __dict__. pdf_stub is the stored file name
+    ('' if none). Has the same attribute names as Book, so algo.py and the
+    templates work with either.
+    """
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, id, title, author, year, quantity, available, pdf_stub):
+        self.id = id
+        self.title = title
+        self.author = author
+        self.year = year
+        self.quantity = quantity
+        self.available = available
+        self.pdf_stub = pdf_stub or ''
+
+    @classmethod
+    def from_book(cls, book):
+        return cls(book.id, book.title, book.author, book.year, book.quantity, book.available, book.pdf_stub.name)
+
+    @property
+    def available_stock(self):
+        return self.available
+
+    def with_available(self, available):
+        """A copy with fresh stock; records in the index are shared between requests."""
+        return BookRecord(self.id, self.title, self.author, self.year, self.quantity, available, self.pdf_stub)
+
+    def __repr__(self):
+        return f"<BookRecord {self.id}: {self.title}>"
+
+
+def load_records():
+    return [BookRecord(*row) for row in Book.objects.values_list(*RECORD_FIELDS).iterator(chunk_size=5000)]
+
+
+def title_key(book):
+    return (book.title.lower(), book.id)
+
+
+def year_key(book):
+    return (book.year, book.id)
+
+
+def normalize(text):
+    return text.lower().strip()
+
+
+#VERSION COUNTER
+def current_version():
+    version = CatalogState.objects.filter(pk=1).values_list('version', flat=True).first()
+    return version or 0
+
+
+def current_versions():
+    """(catalog version, loan version) in one query."""
+    versions = CatalogState.objects.filter(pk=1).values_list('version', 'loan_version').first()
+    return versions or (0, 0)
+
+
+def bump_loan_version():
+    # Call inside the borrow/return transaction.
+    if not CatalogState.objects.filter(pk=1).update(loan_version=F('loan_version') + 1):
+        CatalogState.objects.get_or_create(pk=1, defaults={'version': time.time_ns() // 1000, 'loan_version': 1})
+
+
+def bump_version():
+    with transaction.atomic():
+        updated = CatalogState.objects.filter(pk=1).update(version=F('version') + 1)
+        if not updated:
+            # State row was wiped (e.g. a flushed database): restart above any
+            # version a running process could still be holding.
+            CatalogState.objects.get_or_create(pk=1, defaults={'version': time.time_ns() // 1000})
+        return current_version()
+
+
+#SORTED ARRAY
+class SortedIndex:
+    """Books kept in key order, with a parallel list of keys for bisect."""
+
+    def __init__(self, key_func, books=()):
+        self.key_func = key_func
+        pairs = sorted(((key_func(book), book) for book in books), key=lambda pair: pair[0])
+        self.keys = [pair[0] for pair in pairs]
+        self.items = [pair[1] for pair in pairs]
+
+    def __len__(self):
+        return len(self.items)
+
+    def rank_left(self, key):
+        return bisect_left(self.keys, key)
+
+    def rank_right(self, key):
+        return bisect_right(self.keys, key)
+
+    def slice(self, start, end):
+        return self.items[start:end]
+
+    def add(self, book):
+        key = self.key_func(book)
+        pos = bisect_left(self.keys, key)
+        self.keys.insert(pos, key)
+        self.items.insert(pos, book)
+
+    def remove(self, book):
+        key = self.key_func(book)
+        pos = bisect_left(self.keys, key)
+        if pos < len(self.keys) and self.keys[pos] == key:
+            del self.keys[pos]
+            del self.items[pos]
+
+
+#CATALOG INDEX
+# What rebuild() replaces wholesale.
+SWAPPED = (
+    'by_id', 'by_title', 'by_year',
+    'title_prefix', 'author_prefix', 'word_prefix', 'ngrams', 'fuzzy',
+)
+
+
+class CatalogIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.build_lock = threading.Lock()
+        self.fuzzy_lock = threading.Lock()
+        self.version = None
+        self.by_id = {}
+        self.by_title = SortedIndex(title_key)
+        self.by_year = AVLTree(year_key)
+        self._reset_search()
+
+    def _reset_search(self):
+        self.title_prefix = PrefixIndex()
+        self.author_prefix = PrefixIndex()
+        self.word_prefix = PrefixIndex()
+        self.ngrams = NgramIndex()
+        self.fuzzy = FuzzyIndex()
+
+    def _build_search(self, books):
+        # Prefix and n-gram indexes are built in bulk; _index_text is for
+        # patching in single books.
+        texts = [(book.id, normalize(book.title), normalize(book.author)) for book in books]
+        self._reset_search()
+        self.title_prefix = PrefixIndex((title, book_id) for book_id, title, _ in texts)
+        self.author_prefix = PrefixIndex((author, book_id) for book_id, _, author in texts)
+        self.word_prefix = PrefixIndex(
+            (word, book_id) for book_id, title, author in texts for word in set(title.split()) | set(author.split())
+        )
+        self.ngrams = NgramIndex(items=texts)
+        for book_id, title, author in texts:
+            self.fuzzy.add(book_id, title, author)
+
+    def _index_text(self, book):
+        title, author = normalize(book.title), normalize(book.author)
+        self.title_prefix.add(title, book.id)
+        self.author_prefix.add(author, book.id)
+        for word in set(title.split()) | set(author.split()):
+            self.word_prefix.add(word, book.id)
+        self.ngrams.add(book.id, title, author)
+        self.fuzzy.add(book.id, title, author)
+
+    def _unindex_text(self, book):
+        title, author = normalize(book.title), normalize(book.author)
+        self.title_prefix.remove(title, book.id)
+        self.author_prefix.remove(author, book.id)
+        for word in set(title.split()) | set(author.split()):
+            self.word_prefix.remove(word, book.id)
+        self.ngrams.remove(book.id)
+        self.fuzzy.remove(book.id)
+
+    @timed
+    def rebuild(self, version=None):
+        if version is None:
+            version = current_version()
+        # One build at a time; threads that queued behind it for the same
+        # version find it done and return instead of building again.
+        with self.build_lock:
+            if version == self.version:
+                return
+            # Build into a private index so searches keep using the old
+            # structures until the swap, and apply_save can still take self.lock.
+            fresh = CatalogIndex()
+            books = load_records()
+            fresh.by_id = build_id_hash_map(books)
+            fresh.by_title = SortedIndex(title_key, books)
+            fresh.by_year = AVLTree(year_key, books)
+            fresh._build_search(books)
+            with self.lock:
+                for name in SWAPPED:
+                    setattr(self, name, getattr(fresh, name))
+                self.version = version
+
+    def ensure_current(self, version=None):
+        if version is None:
+            version = current_version()
+        if version != self.version:
+            self.rebuild(version)
+        return self
+
+    def _discard(self, book_id):
+        old = self.by_id.pop(book_id, None)
+        if old is not None:
+            self.by_title.remove(old)
+            self.by_year.remove(old)
+            self._unindex_text(old)
+
+    @timed
+    def apply_save(self, book, version):
+        book = BookRecord.from_book(book)
+        with self.lock:
+            # Only patch in place if we saw every change before this one,
+            # otherwise leave it stale and let ensure_current() rebuild.
+            if self.version != version - 1:
+                return
+            self._discard(book.id)
+            self.by_id[book.id] = book
+            self.by_title.add(book)
+            self.by_year.add(book)
+            self._index_text(book)
+            self.version = version
+
+    @timed
+    def apply_delete(self, book_id, version):
+        with self.lock:
+            if self.version != version - 1:
+                return
+            self._discard(book_id)
+            self.version = version
+
+
+    def year_bounds(self, year_from=None, year_to=None):
+        """Positions [lo, hi) in by_year of books published between the two years, inclusive."""
+        lo = 0 if year_from is None else self.by_year.rank_left((year_from,))
+        hi = len(self.by_year) if year_to is None else self.by_year.rank_left((year_to + 1,))
+        return lo, max(lo, hi)
+
+    #SEARCH
+    # ranked_* return (rank key, book) pairs with unique keys, so results can
+    # be keyset-paginated; search_* return just the best `limit` books.
+    @timed
+    def ranked_prefix(self, query, limit=None):
+        # Title starts with it, then author, then any word of either.
+        query = normalize(query)
+        ranked = []
+        if not query:
+            return ranked
+        seen = set()
+        with self.lock:
+            for tier, prefix_index in enumerate((self.title_prefix, self.author_prefix, self.word_prefix)):
+                for text, book_id in prefix_index.matches(query, limit):
+                    if book_id not in seen:
+                        seen.add(book_id)
+                        ranked.append(((tier, text, book_id), self.by_id[book_id]))
+                        if limit is not None and len(ranked) >= limit:
+                            return ranked
+        return ranked
+
+    @timed
+    def ranked_substring(self, query):
+        # Title hits before author hits, earlier and shorter first.
+        with self.lock:
+            return [(entry, self.by_id[entry[-1]]) for entry in self.ngrams.ranked(normalize(query))]
+
+    def _prepare_fuzzy(self):
+        # The BK-tree is built on the first fuzzy search after a rebuild, not
+        # by rebuild() itself, and outside self.lock so other searches and
+        # apply_save don't wait for it.
+        fuzzy = self.fuzzy
+        if fuzzy.tree is not None:
+            return
+        with self.fuzzy_lock:
+            with self.lock:
+                if fuzzy.tree is not None:
+                    return
+                words = set(fuzzy.postings)
+            tree = FuzzyIndex.build_tree(words)
+            with self.lock:
+                if fuzzy.tree is None:
+                    fuzzy.install(tree, words)
+
+    @timed
+    def ranked_fuzzy(self, query):
+        # Books matching every word of the query first, then fewest typos,
+        # then by title.
+        self._prepare_fuzzy()
+        with self.lock:
+            ranked = []
+            for missing, distance, book_id in self.fuzzy.ranked(normalize(query)):
+                book = self.by_id[book_id]
+                ranked.append(((missing, distance, book.title.lower(), book_id), book))
+            return ranked
+
+    def search_prefix(self, query, limit=None):
+        return [book for _, book in self.ranked_prefix(query, limit)]
+
+    @timed
+    def search_substring(self, query, limit=None):
+        with self.lock:
+            return [self.by_id[book_id] for book_id in self.ngrams.search(normalize(query), limit)]
+
+    @timed
+    def search_fuzzy(self, query, limit=None):
+        self._prepare_fuzzy()
+        with self.lock:
+            return [self.by_id[book_id] for book_id in self.fuzzy.search(normalize(query), limit)]
+
+
+catalog = CatalogIndex()
+
+
+def get_catalog(version=None):
+    """The shared snapshot when CATALOG_SNAPSHOT is on and it's current, else this process's index."""
+    if version is None:
+        version = current_version()
+    if getattr(settings, 'CATALOG_SNAPSHOT', 'off') != 'off':
+        from .snapshot import get_snapshot
+        snapshot = get_snapshot(version)
+        if snapshot is not None:
+            return snapshot
+    return catalog.ensure_current(version)
@@ -0,0 +1,179 @@
+"""
+Sorting for catalogs too big for one merge_sort call.
+
+parallel_sort  splits the items into chunks, sorts each chunk's keys with
+               algo.merge_order in a process pool and k-way merges the
+               sorted chunks with heapq.merge. Uses every core; the items
+               still all fit in memory.
+external_sort  reads any iterable in runs of run_size items, sorts each run,
+               spills it to a temp file and streams the merged result, so
+               only about one run is in memory at a time.
+
+Both take merge_sort's key / reverse / locale_aware arguments and give the
+same stable order. external_sort pickles the items to disk, so use
+BookRecords or plain objects rather than model instances.
+"""
+import heapq
+import operator
+import os
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from .algo import merge_order, merge_sort, parse_sort_spec, sort_value
+
+# Below this, starting processes costs more than it saves.
+PARALLEL_THRESHOLD = 50000
+RUN_SIZE = 100000
+# Items per pickle.dump in a spilled run.
+SPILL_BATCH = 1000
+# Most runs merged at once; more than that are merged in several passes.
+MERGE_FAN_IN = 64
+
+
+class Descending:
+    """Inverts the order of a key component, for mixed-direction merges."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def merge_key(key='title', reverse=False, locale_aware=False):
+    """(key function, reverse) for heapq.merge matching merge_sort's order."""
+    spec = parse_sort_spec(key, reverse)
+    getters = [(operator.attrgetter(field), descending) for field, descending in spec]
+    if all(descending == spec[0][1] for _, descending in spec):
+        def key_func(item):
+            return tuple(sort_value(get(item), locale_aware) for get, _ in getters)
+        return key_func, spec[0][1]
+
+    def key_func(item):
+        return tuple(
+            Descending(sort_value(get(item), locale_aware)) if descending else sort_value(get(item), locale_aware)
+            for get, descending in getters
+        )
+    return key_func, False
+
+
+def merge_runs(runs, key='title', reverse=False, locale_aware=False):
+    """Stable k-way merge of already sorted iterables; ties keep run order."""
+    key_func, merge_reverse = merge_key(key, reverse, locale_aware)
+    return heapq.merge(*runs, key=key_func, reverse=merge_reverse)
+
+
+#PARALLEL
+def _sort_chunk(columns, directions):
+    """Stable order of one chunk's rows, given its key columns (most significant first)."""
+    n = len(columns[0])
+    if all(descending == directions[0] for descending in directions):
+        return merge_order(list(zip(*columns)), directions[0])
+    # Mixed directions: stable passes from the least significant key up, as merge_sort does.
+    order = list(range(n))
+    for column, descending in reversed(list(zip(columns, directions))):
+        order = [order[i] for i in merge_order([column[i] for i in order], descending)]
+    return order
+
+
+def parallel_sort(items, key='title', reverse=False, locale_aware=False, workers=None, min_size=PARALLEL_THRESHOLD):
+    items = list(items)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(items) < min_size:
+        return merge_sort(items, key, reverse, locale_aware)
+
+    # Only the key columns go to the workers and only row numbers come back:
+    # pickling lists of str / int is far cheaper than pickling the items.
+    spec = parse_sort_spec(key, reverse)
+    columns = [
+        [sort_value(value, locale_aware) for value in map(operator.attrgetter(field), items)]
+        for field, _ in spec
+    ]
+    directions = [descending for _, descending in spec]
+    size = -(-len(items) // workers)
+    starts = range(0, len(items), size)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        orders = pool.map(
+            _sort_chunk,
+            [[column[start:start + size] for column in columns] for start in starts],
+            [directions] * len(starts),
+        )
+        runs = [[start + i for i in order] for start, order in zip(starts, orders)]
+
+    key_func, merge_reverse = merge_key(key, reverse, locale_aware)
+    merged = heapq.merge(*runs, key=lambda i: key_func(items[i]), reverse=merge_reverse)
+    return [items[i] for i in merged]
+
+
+#EXTERNAL MEMORY
+def spill(items, directory=None):
+    """Write items to an anonymous temp file; returns it rewound."""
+    f = tempfile.TemporaryFile(dir=directory)
+    for start in range(0, len(items), SPILL_BATCH):
+        pickle.dump(items[start:start + SPILL_BATCH], f, protocol=pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+
+def read_run(f):
+    while True:
+        try:
+            batch = pickle.load(f)
+        except EOFError:
+            return
+        yield from batch
+
+
+def spill_stream(items, directory=None):
+    """Like spill(), for an iterator too long to hold as a list."""
+    f = tempfile.TemporaryFile(dir=directory)
+    while True:
+        batch = list(islice(items, SPILL_BATCH))
+        if not batch:
+            break
+        pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+
+def external_sort(items, key='title', reverse=False, locale_aware=False, run_size=RUN_SIZE, directory=None):
+    """
+    Generator over items in order. Temp files live in `directory` (default:
+    the system temp dir) and are removed when the generator finishes or is
+    closed.
+    """
+    items = iter(items)
+    files = []
+    try:
+        while True:
+            run = list(islice(items, run_size))
+            if not run:
+                break
+            run = merge_sort(run, key, reverse, locale_aware)
+            if not files and len(run) < run_size:
+                # Everything fit in one run: nothing to spill.
+                yield from run
+                return
+            files.append(spill(run, directory))
+            del run
+
+        # Merge neighbouring groups level by level, so ties keep input order.
+        while len(files) > MERGE_FAN_IN:
+            merged = []
+            for start in range(0, len(files), MERGE_FAN_IN):
+                group = files[start:start + MERGE_FAN_IN]
+                merged.append(spill_stream(merge_runs([read_run(f) for f in group], key, reverse, locale_aware), directory))
+                for f in group:
+                    f.close()
+            files = merged
+
+        yield from merge_runs([read_run(f) for f in files], key, reverse, locale_aware)
+    finally:
+        for f in files:
+            f.close()
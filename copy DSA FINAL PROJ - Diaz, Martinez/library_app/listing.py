@@ -0,0 +1,122 @@
+"""
+Builds one page of the catalog listing from the catalog index for the
+library_home search / sort / year-range parameters.
+"""
+from .algo import binary_search
+from .analytics import popular_page
+from .pagination import Page, decode_cursor, page_sorted, page_ranked
+from .perf import timed
+
+PER_PAGE = 20
+
+# Timed here rather than in algo.py, which stays free of Django.
+find_title = timed(binary_search)
+
+
+def parse_year(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@timed
+def sorted_page(ordering, after, before, reverse=False, lo=0, hi=None, per_page=PER_PAGE):
+    try:
+        return page_sorted(ordering, per_page, after, before, reverse, lo, hi)
+    except TypeError:
+        # Cursor from a different sort mode; start over.
+        return page_sorted(ordering, per_page, reverse=reverse, lo=lo, hi=hi)
+
+
+@timed
+def ranked_page(pairs, after, before, per_page=PER_PAGE):
+    try:
+        return page_ranked(pairs, per_page, after, before)
+    except TypeError:
+        return page_ranked(pairs, per_page)
+
+
+def catalog_page(index, params, per_page=PER_PAGE):
+    """Returns (page, message, sort_by) for a QueryDict-like params."""
+    query = params.get('q')
+    search_type = params.get('type')
+
+    sort_by = params.get('sort')
+    direction = params.get('dir', 'asc')
+
+    year_from = parse_year(params.get('year_from'))
+    year_to = parse_year(params.get('year_to'))
+
+    after = decode_cursor(params.get('after'))
+    before = decode_cursor(params.get('before'))
+
+    page = Page([])
+    message = ""
+
+    if query:
+        if search_type == 'id':
+            try:
+                target_id = int(query)
+                if target_id in index.by_id:
+                    page = Page([index.by_id[target_id]])
+                else:
+                    message = "Book ID not found."
+            except ValueError:
+                message = "Invalid ID."
+        elif search_type == 'title':
+            result = find_title(index.by_title.items, query)
+            if result:
+                page = Page([result])
+            else:
+                page = ranked_page(index.ranked_substring(query), after, before, per_page)
+                if not page.items:
+                    page = ranked_page(index.ranked_fuzzy(query), after, before, per_page)
+                    if page.items:
+                        message = "No exact match. Closest titles:"
+                    else:
+                        message = "No match found."
+        elif search_type == 'prefix':
+            page = ranked_page(index.ranked_prefix(query), after, before, per_page)
+            if not page.items:
+                message = "No title or author starts with that."
+        elif search_type == 'substring':
+            page = ranked_page(index.ranked_substring(query), after, before, per_page)
+            if not page.items:
+                message = "No title or author contains that."
+        elif search_type == 'fuzzy':
+            page = ranked_page(index.ranked_fuzzy(query), after, before, per_page)
+            if not page.items:
+                message = "Nothing close to that."
+
+    else:
+        is_reverse = (direction == 'desc')
+        if sort_by == 'year' or year_from is not None or year_to is not None:
+            sort_by = 'year'
+            lo, hi = index.year_bounds(year_from, year_to)
+            page = sorted_page(index.by_year, after, before, is_reverse, lo, hi, per_page)
+            if is_reverse:
+                message = "Sorted by Year: Newest First"
+            else:
+                message = "Sorted by Year: Oldest First"
+            if year_from is not None or year_to is not None:
+                message += f" (published {year_from or '...'} to {year_to or '...'})"
+
+        elif sort_by == 'popular':
+            try:
+                page = popular_page(index, after, before, per_page)
+            except (TypeError, ValueError):
+                page = popular_page(index, per_page=per_page)
+            message = "Most Borrowed First" if page.items else "Nothing has been borrowed yet."
+
+        elif sort_by == 'title':
+            page = sorted_page(index.by_title, after, before, is_reverse, per_page=per_page)
+            if is_reverse:
+                message = "Sorted Alphabetically: Z-A"
+            else:
+                message = "Sorted Alphabetically: A-Z"
+
+        else:
+            page = sorted_page(index.by_title, after, before, per_page=per_page)
+
+    return page, message, sort_by
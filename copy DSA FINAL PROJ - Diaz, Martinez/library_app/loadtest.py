@@ -0,0 +1,301 @@
+"""
+Load generator for the borrow/return flows.
+
+Run through `python manage.py loadtest`. Each worker thread logs in as one
+of the generated users and picks actions from a weighted mix (browse,
+search, sort, borrow, return, my_books) until the time or request budget
+runs out. Requests go either through Django's in-process test client or
+over HTTP to a running server; both only need the standard library.
+
+Afterwards check_invariants() looks at the database: no book may have more
+active loans than copies, Book.available must match quantity minus loans,
+and nobody may be left waiting for a book that has copies on the shelf.
+"""
+import http.cookiejar
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count, F, Q
+
+from .models import Book, Borrowing, Reservation
+from .perf import percentile
+from .stock import return_copy
+
+ACTIONS = ('browse', 'search', 'sort', 'borrow', 'return', 'my_books')
+DEFAULT_MIX = 'browse=35,search=20,sort=10,borrow=15,return=10,my_books=10'
+SEARCH_TERMS = ('shadow', 'river', 'christie', 'garden', 'stor', 'wintr', 'dragon', 'le guin')
+SEARCH_TYPES = ('title', 'prefix', 'substring', 'fuzzy')
+USER_PREFIX = 'loadtest'
+PASSWORD = 'loadtest-password'
+
+
+def parse_mix(text):
+    """'browse=35,borrow=15' -> {'browse': 35, 'borrow': 15}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ACTIONS:
+            raise ValueError(f"unknown action {name!r} (choose from {', '.join(ACTIONS)})")
+        mix[name] = int(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("the mix needs at least one action with a positive weight")
+    return mix
+
+
+def create_users(n):
+    """n load test users sharing one password (hashed once, not n times)."""
+    password = make_password(PASSWORD)
+    existing = set(User.objects.filter(username__startswith=USER_PREFIX).values_list('username', flat=True))
+    User.objects.bulk_create([
+        User(username=f"{USER_PREFIX}{i}", password=password)
+        for i in range(n) if f"{USER_PREFIX}{i}" not in existing
+    ])
+    return list(User.objects.filter(username__in=[f"{USER_PREFIX}{i}" for i in range(n)]).order_by('id'))
+
+
+def remove_users(users):
+    """Give back their copies first, then delete the users (and their waitlist places)."""
+    for loan in Borrowing.objects.filter(user__in=users):
+        return_copy(loan)
+    User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+
+#SESSIONS
+class ClientSession:
+    """In-process, through django.test.Client."""
+
+    def __init__(self, user):
+        from django.test import Client
+        self.client = Client()
+        self.client.force_login(user)
+
+    def get(self, path):
+        response = self.client.get(path)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, body
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPSession:
+    """Over HTTP against a running server, logged in through the login form."""
+
+    def __init__(self, user, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect)
+        self.login(user.username)
+
+    def login(self, username):
+        self.get('/accounts/login/')
+        token = next((c.value for c in self.cookies if c.name == 'csrftoken'), '')
+        data = urllib.parse.urlencode({
+            'username': username, 'password': PASSWORD, 'csrfmiddlewaretoken': token,
+        }).encode()
+        request = urllib.request.Request(
+            self.base_url + '/accounts/login/', data=data, headers={'Referer': self.base_url + '/accounts/login/'},
+        )
+        status, _ = self._open(request)
+        if status != 302:
+            raise RuntimeError(f"login as {username} failed with HTTP {status}")
+
+    def get(self, path):
+        return self._open(urllib.request.Request(self.base_url + path))
+
+    def _open(self, request):
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+#WORKERS
+class Recorder:
+    """Latencies and errors per action, shared by all workers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_samples = []
+
+    def add(self, action, seconds, ok, detail=''):
+        with self.lock:
+            self.latencies[action].append(seconds)
+            if not ok:
+                self.errors[action] += 1
+                if len(self.error_samples) < 10:
+                    self.error_samples.append(f"{action}: {detail}")
+
+
+class Worker(threading.Thread):
+    # Redirects are the normal answer to borrow / return.
+    OK_STATUS = (200, 302, 304)
+
+    def __init__(self, session_factory, user, mix, book_ids, recorder, deadline, budget, seed):
+        super().__init__(daemon=True)
+        self.session_factory = session_factory
+        self.user = user
+        self.actions = list(mix)
+        self.weights = [mix[name] for name in self.actions]
+        self.book_ids = book_ids
+        self.recorder = recorder
+        self.deadline = deadline
+        self.budget = budget
+        self.rnd = random.Random(seed)
+
+    def run(self):
+        try:
+            start = time.perf_counter()
+            try:
+                session = self.session_factory(self.user)
+            except Exception as e:
+                self.recorder.add('login', time.perf_counter() - start, False, f"{self.user.username}: {e!r}")
+                return
+            while time.monotonic() < self.deadline and self.budget.take():
+                action = self.rnd.choices(self.actions, self.weights)[0]
+                try:
+                    self.step(session, action)
+                except Exception as e:
+                    # step() records its own request failures; anything else
+                    # still counts against the run instead of ending the worker.
+                    self.recorder.add(action, 0.0, False, repr(e))
+        finally:
+            connection.close()
+
+    def step(self, session, action):
+        path = '/api/my-borrowings/?fields=id&limit=5' if action == 'return' else self.path_for(action)
+        start = time.perf_counter()
+        try:
+            if action == 'return':
+                # Find a loan to give back; that lookup can fail like any request.
+                status, body = session.get(path)
+                if status != 200:
+                    self.recorder.add(action, time.perf_counter() - start, False, f"{path}: HTTP {status}")
+                    return
+                loans = json.loads(body).get('results', [])
+                if loans:
+                    path = f"/return-book/{self.rnd.choice(loans)['id']}/"
+                else:
+                    action, path = 'borrow', self.borrow_path()
+                start = time.perf_counter()
+            status, _ = session.get(path)
+        except Exception as e:
+            # Every failure is a data point here, not a reason to stop.
+            self.recorder.add(action, time.perf_counter() - start, False, f"{path}: {e!r}")
+            return
+        ok = status in self.OK_STATUS
+        self.recorder.add(action, time.perf_counter() - start, ok, f"{path}: HTTP {status}")
+
+    def borrow_path(self):
+        return f"/borrow/{self.rnd.choice(self.book_ids)}/"
+
+    def path_for(self, action):
+        rnd = self.rnd
+        if action == 'browse':
+            return '/'
+        if action == 'search':
+            query = urllib.parse.urlencode({'q': rnd.choice(SEARCH_TERMS), 'type': rnd.choice(SEARCH_TYPES)})
+            return f"/?{query}"
+        if action == 'sort':
+            return f"/?sort={rnd.choice(('title', 'year'))}&dir={rnd.choice(('asc', 'desc'))}"
+        if action == 'borrow':
+            return self.borrow_path()
+        return '/my-books/'
+
+
+class Budget:
+    """Shared request counter; unlimited when total is None."""
+
+    def __init__(self, total):
+        self.left = total
+        self.lock = threading.Lock()
+
+    def take(self):
+        if self.left is None:
+            return True
+        with self.lock:
+            if self.left <= 0:
+                return False
+            self.left -= 1
+            return True
+
+
+def run_load(session_factory, users, mix, book_ids, threads, duration, total_requests=None, seed=0):
+    recorder = Recorder()
+    budget = Budget(total_requests)
+    deadline = time.monotonic() + duration
+    workers = [
+        Worker(session_factory, users[i % len(users)], mix, book_ids, recorder, deadline, budget, seed + i)
+        for i in range(threads)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return summarize(recorder, time.perf_counter() - start)
+
+
+def summarize(recorder, elapsed):
+    report = {'seconds': round(elapsed, 3), 'actions': {}, 'error_samples': recorder.error_samples}
+    every = []
+    # Plus 'login' when a worker couldn't start its session.
+    for action in ACTIONS + tuple(sorted(set(recorder.latencies) - set(ACTIONS))):
+        samples = sorted(recorder.latencies.get(action, ()))
+        if not samples:
+            continue
+        every.extend(samples)
+        report['actions'][action] = {
+            'requests': len(samples),
+            'errors': recorder.errors[action],
+            'error_rate': round(recorder.errors[action] / len(samples), 4),
+            'p50_ms': round(percentile(samples, 50) * 1000, 2),
+            'p95_ms': round(percentile(samples, 95) * 1000, 2),
+            'p99_ms': round(percentile(samples, 99) * 1000, 2),
+        }
+    errors = sum(recorder.errors.values())
+    every.sort()
+    report['requests'] = len(every)
+    report['errors'] = errors
+    report['error_rate'] = round(errors / len(every), 4) if every else 0.0
+    report['throughput_rps'] = round(len(every) / elapsed, 1) if elapsed else 0.0
+    if every:
+        report['p50_ms'] = round(percentile(every, 50) * 1000, 2)
+        report['p95_ms'] = round(percentile(every, 95) * 1000, 2)
+        report['p99_ms'] = round(percentile(every, 99) * 1000, 2)
+    return report
+
+
+#INVARIANTS
+def check_invariants():
+    """List of human-readable violations; empty means the stock is consistent."""
+    problems = []
+    books = Book.objects.annotate(loans=Count('borrowing', distinct=True))
+    for book in books.filter(loans__gt=F('quantity')):
+        problems.append(f"book {book.id}: {book.loans} active loans but only {book.quantity} copies")
+    for book in books.exclude(available=F('quantity') - F('loans')):
+        problems.append(
+            f"book {book.id}: available={book.available}, expected {book.quantity - book.loans} "
+            f"(quantity {book.quantity} - {book.loans} loans)"
+        )
+    for book in Book.objects.filter(Q(available__lt=0)):
+        problems.append(f"book {book.id}: negative stock ({book.available})")
+    stuck = Reservation.objects.filter(book__available__gt=0).values_list('book_id', flat=True).distinct()
+    for book_id in stuck:
+        problems.append(f"book {book_id}: copies on the shelf while users are still waitlisted")
+    return problems
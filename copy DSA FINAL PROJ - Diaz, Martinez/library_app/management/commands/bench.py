@@ -0,0 +1,66 @@
+import json
+import platform
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from library_app.benchmarks import SUITES, compare
+
+
+class Command(BaseCommand):
+    help = "Run the algo/view benchmarks on a throwaway test database and write the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--suite', nargs='+', choices=sorted(SUITES), default=['algo', 'views'])
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000],
+                            help="Catalog sizes for the algo suite (up to 1000000).")
+        parser.add_argument('--view-sizes', nargs='+', type=int, default=[1000, 10000],
+                            help="Catalog sizes loaded into the database for view suites.")
+        parser.add_argument('--concurrency', nargs='+', type=int, default=[50, 300],
+                            help="Concurrent connections for the asgi suite.")
+        parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4],
+                            help="Process counts for the large_sort suite.")
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--output', default='bench_results.json')
+        parser.add_argument('--compare', metavar='BASELINE_JSON',
+                            help="Fail if any timing is slower than in this earlier run.")
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help="Allowed slowdown before --compare flags a regression (0.10 = 10%%).")
+
+    def handle(self, *args, **options):
+        results = {}
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            for name in options['suite']:
+                for label, result in SUITES[name](options):
+                    key = f"{name}.{label}"
+                    results[key] = result
+                    extra = ''.join(f" {k}={v}" for k, v in result.items() if k != 'seconds')
+                    seconds = f"{result['seconds'] * 1000:10.2f} ms" if 'seconds' in result else ' ' * 13
+                    self.stdout.write(f"{key:<70} {seconds}{extra}")
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as f:
+            json.dump({
+                'meta': {'python': sys.version.split()[0], 'platform': platform.platform(), 'options': {
+                    k: options[k] for k in ('suite', 'sizes', 'view_sizes', 'concurrency', 'workers', 'repeat')
+                }},
+                'results': results,
+            }, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['results']
+            regressions = compare(baseline, results, options['threshold'])
+            for name, before, after in regressions:
+                self.stdout.write(self.style.ERROR(
+                    f"REGRESSION {name}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms"
+                ))
+            if regressions:
+                raise CommandError(f"{len(regressions)} benchmark(s) regressed by more than {options['threshold']:.0%}")
+            self.stdout.write(self.style.SUCCESS("No regressions."))
@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from library_app.catalog_index import current_version
+from library_app.snapshot import build, file_version
+
+
+class Command(BaseCommand):
+    help = "Write the memory-mapped catalog snapshot workers read (see CATALOG_SNAPSHOT in settings)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help="Where to write it (default: CATALOG_SNAPSHOT_PATH).")
+        parser.add_argument('--interval', type=int, metavar='SECONDS',
+                            help="Check every SECONDS and rebuild whenever the catalog changed, until interrupted.")
+
+    def handle(self, *args, **options):
+        path = str(options['path'] or settings.CATALOG_SNAPSHOT_PATH)
+        if options['interval'] is not None and options['interval'] < 1:
+            raise CommandError("--interval must be at least 1")
+
+        while True:
+            if not options['interval'] or file_version(path) != current_version():
+                start = time.perf_counter()
+                try:
+                    version, size = build(path)
+                except OSError as e:
+                    # On Windows, replacing the file fails while a worker has it mapped.
+                    if not options['interval']:
+                        raise CommandError(f"Couldn't write {path}: {e}")
+                    self.stderr.write(f"Couldn't write {path}: {e}; trying again in {options['interval']}s.")
+                else:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"Wrote {path}: catalog version {version}, {size} bytes in {time.perf_counter() - start:.2f}s."
+                    ))
+            if not options['interval']:
+                break
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                break
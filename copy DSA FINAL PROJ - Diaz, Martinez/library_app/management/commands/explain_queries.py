@@ -0,0 +1,99 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from django.urls import reverse
+
+from library_app.benchmarks import load_dataset
+from library_app.models import Book, Borrowing
+
+SKIP_PREFIXES = ('SAVEPOINT', 'RELEASE', 'ROLLBACK', 'BEGIN', 'COMMIT', 'PRAGMA')
+
+
+def view_requests(user):
+    """(label, url) for each page/API request worth checking, in a realistic order."""
+    book = Book.objects.order_by('id').first()
+    # read_book only reaches its loan check for a book with a PDF; the file
+    # itself doesn't need to exist.
+    Book.objects.filter(pk=book.pk).update(pdf_stub='books/explain.pdf')
+    yield 'library_home', reverse('library_home')
+    yield 'library_home sort=year', reverse('library_home') + '?sort=year&dir=desc'
+    yield 'library_home year range', reverse('library_home') + '?year_from=1900&year_to=1950'
+    yield 'library_home sort=popular', reverse('library_home') + '?sort=popular'
+    yield 'library_home search title', reverse('library_home') + '?q=shadow&type=title'
+    yield 'borrow_book', reverse('borrow_book', args=[book.id])
+    yield 'my_books', reverse('my_books')
+    yield 'read_book', reverse('read_book', args=[book.id])
+    loan = Borrowing.objects.filter(user=user, book=book).first()
+    if loan:
+        yield 'return_book', reverse('return_book', args=[loan.id])
+    yield 'api_book_list', reverse('api_book_list') + '?sort=title&fields=id,title,available'
+    yield 'api_my_borrowings', reverse('api_my_borrowings')
+
+
+class Command(BaseCommand):
+    help = "Run each view on a throwaway test database and print EXPLAIN QUERY PLAN for every query it makes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=2000, help="Catalog size to load before explaining.")
+        parser.add_argument('--view', nargs='+', help="Only these labels (e.g. my_books api_book_list).")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("explain_queries reads SQLite's EXPLAIN QUERY PLAN output.")
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        scans = 0
+        try:
+            users = load_dataset(options['books'], 'random', borrowings=min(options['books'] // 10, 500))
+            # Give the planner real statistics, as a long-lived database would have.
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            client = Client()
+            client.force_login(users[0])
+
+            for label, url in view_requests(users[0]):
+                if options['view'] and label not in options['view']:
+                    continue
+                cache.clear()
+                connection.queries_log.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    status = client.get(url).status_code
+                self.stdout.write(self.style.MIGRATE_HEADING(f"{label}  GET {url}  -> {status}, {len(queries)} queries"))
+                for query in queries:
+                    scans += self.explain(query['sql'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        if scans:
+            self.stdout.write(self.style.WARNING(f"{scans} full table scan(s); check they are expected."))
+        else:
+            self.stdout.write(self.style.SUCCESS("No full table scans."))
+
+    def explain(self, sql):
+        """Print the plan for one statement; returns how many full table scans it has."""
+        if sql.lstrip().upper().startswith(SKIP_PREFIXES):
+            return 0
+        self.stdout.write(f"  {sql}")
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = cursor.fetchall()
+
+        depth = {0: 0}
+        scans = 0
+        for node_id, parent, _, detail in plan:
+            depth[node_id] = depth.get(parent, 0) + 1
+            line = f"  {'  ' * depth[node_id]}{detail}"
+            # "SCAN x USING (COVERING) INDEX" walks an index in order; a bare
+            # "SCAN x" reads the whole table.
+            if detail.startswith('SCAN') and 'INDEX' not in detail:
+                scans += 1
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
+        return scans
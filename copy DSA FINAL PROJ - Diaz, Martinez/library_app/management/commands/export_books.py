@@ -0,0 +1,106 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Lower
+
+from library_app.catalog_index import RECORD_FIELDS, BookRecord
+from library_app.large_sort import RUN_SIZE, external_sort, parallel_sort
+from library_app.models import Book
+
+FIELDS = ('id', 'title', 'author', 'year', 'quantity', 'available', 'pdf_stub')
+ORDERINGS = {
+    'title': [Lower('title'), 'id'],
+    'author': [Lower('author'), Lower('title'), 'id'],
+    'year': ['year', 'id'],
+    'id': ['id'],
+}
+# The same orders as merge_sort keys, for sorting outside the database.
+SORT_KEYS = {
+    'title': ['title', 'id'],
+    'author': ['author', 'title', 'id'],
+    'year': ['year', 'id'],
+    'id': ['id'],
+}
+
+
+def iter_books(sort='title', direction='asc', chunk_size=2000):
+    """Yields one dict per book in the requested order, holding only chunk_size rows at a time."""
+    ordering = ORDERINGS[sort]
+    if direction == 'desc':
+        ordering = [
+            field.desc() if hasattr(field, 'desc') else f'-{field}'
+            for field in ordering
+        ]
+    rows = Book.objects.order_by(*ordering).values_list(*FIELDS).iterator(chunk_size=chunk_size)
+    for row in rows:
+        yield dict(zip(FIELDS, row))
+
+
+def iter_sorted_in_python(sort='title', direction='asc', sorter='external', run_size=RUN_SIZE, workers=None, chunk_size=2000):
+    """
+    Like iter_books, but reads the table in storage order and sorts here:
+    'external' spills sorted runs to temp files (bounded memory), 'parallel'
+    sorts in memory on a process pool. Keeps the sort off the database
+    server for very large catalogs.
+    """
+    records = (
+        BookRecord(*row)
+        for row in Book.objects.order_by().values_list(*RECORD_FIELDS).iterator(chunk_size=chunk_size)
+    )
+    reverse = direction == 'desc'
+    if sorter == 'external':
+        ordered = external_sort(records, SORT_KEYS[sort], reverse, run_size=run_size)
+    else:
+        ordered = parallel_sort(records, SORT_KEYS[sort], reverse, workers=workers)
+    for record in ordered:
+        yield {field: getattr(record, field) for field in FIELDS}
+
+
+class Command(BaseCommand):
+    help = "Stream the catalog to CSV or JSONL in a chosen order."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--output', default='-', help="File to write, or - for stdout.")
+        parser.add_argument('--sort', choices=sorted(ORDERINGS), default='title')
+        parser.add_argument('--dir', choices=['asc', 'desc'], default='asc')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--sorter', choices=['database', 'external', 'parallel'], default='database',
+                            help="Where to sort: ORDER BY in the database, or here with large_sort.")
+        parser.add_argument('--run-size', type=int, default=RUN_SIZE,
+                            help="Books per sorted run spilled to disk by --sorter external.")
+        parser.add_argument('--workers', type=int, help="Processes for --sorter parallel (default: all cores).")
+
+    def handle(self, *args, **options):
+        path = options['output']
+        try:
+            out = self.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(e)
+
+        if options['sorter'] == 'database':
+            rows = iter_books(options['sort'], options['dir'], options['chunk_size'])
+        else:
+            rows = iter_sorted_in_python(
+                options['sort'], options['dir'], options['sorter'],
+                options['run_size'], options['workers'], options['chunk_size'],
+            )
+        count = 0
+        try:
+            if options['format'] == 'csv':
+                writer = csv.DictWriter(out, fieldnames=FIELDS, lineterminator='\n')
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+            else:
+                for row in rows:
+                    out.write(json.dumps(row) + '\n')
+                    count += 1
+        finally:
+            if out is not self.stdout:
+                out.close()
+
+        if path != '-':
+            self.stderr.write(f"Exported {count} book(s) to {path}")
@@ -0,0 +1,109 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from library_app.benchmarks import load_dataset
+from library_app.loadtest import (
+    DEFAULT_MIX, ClientSession, HTTPSession, check_invariants, create_users, parse_mix, remove_users, run_load,
+)
+from library_app.models import Book
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate concurrent borrowers with a weighted mix of requests, report throughput, latency "
+        "percentiles and error rates, then check that stock stayed consistent."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Base URL of a running server (e.g. http://127.0.0.1:8000). "
+                                          "Without it, requests go through the in-process test client "
+                                          "against a throwaway database.")
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--threads', type=int, default=20)
+        parser.add_argument('--duration', type=float, default=30, help="Seconds to run.")
+        parser.add_argument('--requests', type=int, help="Stop after this many requests in total.")
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Action weights (default {DEFAULT_MIX}).")
+        parser.add_argument('--books', type=int, default=1000, help="Catalog size for the in-process run.")
+        parser.add_argument('--hot-books', type=int, default=20,
+                            help="Borrows pick from this many books, so users fight over copies.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep-users', action='store_true', help="Don't delete the load test users afterwards.")
+        parser.add_argument('--output', help="Also write the report as JSON here.")
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(e)
+        if options['threads'] < 1 or options['users'] < 1:
+            raise CommandError("--threads and --users must be at least 1")
+
+        if options['url']:
+            report, problems = self.run(options, mix, partial(HTTPSession, base_url=options['url']))
+        else:
+            # A file-backed test database: an in-memory one can't take
+            # concurrent writers, which is exactly what we want to exercise.
+            workdir = tempfile.mkdtemp(prefix='loadtest-')
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(workdir, 'loadtest.sqlite3')
+            setup_test_environment()
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                load_dataset(options['books'], 'random', seed=options['seed'])
+                report, problems = self.run(options, mix, ClientSession)
+            finally:
+                teardown_databases(old_config, verbosity=0)
+                teardown_test_environment()
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        self.print_report(report, problems)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'options': {k: options[k] for k in ('url', 'users', 'threads', 'duration', 'requests', 'mix')},
+                           'report': report, 'invariant_violations': problems}, f, indent=2)
+        if problems:
+            raise CommandError(f"{len(problems)} stock invariant violation(s)")
+
+    def run(self, options, mix, session_factory):
+        users = create_users(options['users'])
+        ids = list(Book.objects.values_list('id', flat=True))
+        if not ids:
+            raise CommandError("The catalog is empty; nothing to borrow.")
+        book_ids = random.Random(options['seed']).sample(ids, min(options['hot_books'], len(ids)))
+        try:
+            report = run_load(
+                session_factory, users, mix, book_ids, options['threads'],
+                options['duration'], options['requests'], options['seed'],
+            )
+            problems = check_invariants()
+        finally:
+            if not options['keep_users']:
+                remove_users(users)
+        return report, problems
+
+    def print_report(self, report, problems):
+        self.stdout.write(f"{'action':<10} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for action, row in report['actions'].items():
+            self.stdout.write(
+                f"{action:<10} {row['requests']:>9} {row['errors']:>7} "
+                f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}"
+            )
+        self.stdout.write(
+            f"{report['requests']} requests in {report['seconds']} s: {report['throughput_rps']} req/s, "
+            f"error rate {report['error_rate']:.2%}, p50 {report.get('p50_ms')} ms, "
+            f"p95 {report.get('p95_ms')} ms, p99 {report.get('p99_ms')} ms"
+        )
+        for sample in report['error_samples']:
+            self.stdout.write(self.style.WARNING(f"  {sample}"))
+        if problems:
+            for problem in problems:
+                self.stdout.write(self.style.ERROR(problem))
+        else:
+            self.stdout.write(self.style.SUCCESS("Stock invariants hold."))
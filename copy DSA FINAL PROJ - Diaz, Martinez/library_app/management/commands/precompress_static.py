@@ -0,0 +1,70 @@
+import gzip
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from library_app.compression import MIN_LENGTH, brotli
+
+# Run after collectstatic. With LIBRARY_RESPONSE_PROFILE=production the
+# collected names carry a content hash (dashboard.3f2a9c1b6d4e.css), so the web
+# server can send them pre-compressed and cache them for good, e.g. nginx:
+#
+#   location /static/ {
+#       alias /path/to/staticfiles/;
+#       gzip_static on;          # serves dashboard.<hash>.css.gz when accepted
+#       brotli_static on;        # needs ngx_brotli
+#       expires max;
+#       add_header Cache-Control "public, immutable";
+#   }
+EXTENSIONS = ('.css', '.js', '.svg', '.html', '.txt', '.json', '.map', '.xml')
+
+
+def compress_file(path, force=False):
+    """Write path.gz (and path.br) next to path; returns the variants written."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < MIN_LENGTH:
+        return []
+    variants = [('.gz', lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', lambda: brotli.compress(data, quality=11)))
+
+    written = []
+    mtime = os.stat(path).st_mtime
+    for suffix, compress in variants:
+        target = path + suffix
+        if not force and os.path.exists(target) and os.stat(target).st_mtime >= mtime:
+            continue
+        compressed = compress()
+        if len(compressed) >= len(data):
+            continue
+        with open(target, 'wb') as f:
+            f.write(compressed)
+        written.append((target, len(data), len(compressed)))
+    return written
+
+
+class Command(BaseCommand):
+    help = "Write .gz (and .br, if brotli is installed) copies of the collected static files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Recompress files that already have copies.")
+
+    def handle(self, *args, **options):
+        root = settings.STATIC_ROOT
+        if not root or not os.path.isdir(root):
+            raise CommandError(f"STATIC_ROOT ({root}) doesn't exist; run collectstatic first.")
+        if brotli is None:
+            self.stdout.write("brotli isn't installed; writing gzip copies only.")
+
+        before = after = count = 0
+        for directory, _, names in os.walk(root):
+            for name in names:
+                if name.endswith(EXTENSIONS):
+                    for target, size, compressed in compress_file(os.path.join(directory, name), options['force']):
+                        self.stdout.write(f"{os.path.relpath(target, root)}: {size} -> {compressed} bytes")
+                        before += size
+                        after += compressed
+                        count += 1
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} compressed file(s), {before} -> {after} bytes."))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from library_app.analytics import roll_up
+from library_app.catalog_index import bump_loan_version
+from library_app.models import Book, Reservation
+from library_app.stock import expected_available, serve_waitlist
+
+
+class Command(BaseCommand):
+    help = "Recompute Book.available from the active Borrowing rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report books whose counter drifted.")
+
+    def handle(self, *args, **options):
+        expected = expected_available()
+
+        with transaction.atomic():
+            drifted = Book.objects.annotate(expected=expected).exclude(available=F('expected'))
+            for book in drifted.only('id', 'title', 'available'):
+                self.stdout.write(f"{book.id}: {book.title} available={book.available} expected={book.expected}")
+            fixed = 0
+            if not options['dry_run']:
+                fixed = drifted.update(available=expected)
+                if fixed:
+                    bump_loan_version()
+
+        if not options['dry_run']:
+            # Copies that turned up on the shelf go to the waitlist first.
+            waiting = Reservation.objects.filter(book__available__gt=0).values_list('book_id', flat=True).distinct()
+            for book_id in list(waiting):
+                served = serve_waitlist(book_id)
+                self.stdout.write(f"{book_id}: lent {served} copy(ies) to waitlisted users")
+
+        if options['dry_run']:
+            self.stdout.write("Dry run, nothing changed.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Reconciled {fixed} book(s)."))
+            self.stdout.write(f"Rolled up {roll_up()} loan event(s).")
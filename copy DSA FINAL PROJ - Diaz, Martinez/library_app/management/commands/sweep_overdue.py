@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library_app.analytics import roll_up
+from library_app.stock import sweep_overdue
+
+
+class Command(BaseCommand):
+    help = ("Mark (or auto-return) loans past their due time and roll up the loan stats. "
+            "Run it from cron, or keep it running with --interval.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--auto-return', action='store_true',
+                            help="Return overdue loans and restock their books instead of only marking them.")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=int, metavar='SECONDS',
+                            help="Sweep again every SECONDS until interrupted.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        verb = "Returned" if options['auto_return'] else "Marked overdue"
+
+        while True:
+            changed = sweep_overdue(options['auto_return'], options['batch_size'])
+            roll_up()
+            if changed or not options['interval']:
+                self.stdout.write(self.style.SUCCESS(f"{verb}: {changed} loan(s)."))
+            if not options['interval']:
+                break
+            try:
+                time.sleep(options['interval'])
+            except KeyboardInterrupt:
+                break
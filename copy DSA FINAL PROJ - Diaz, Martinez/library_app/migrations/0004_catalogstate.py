@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:38
+
+from django.db import migrations, models
+
+
+def create_state_row(apps, schema_editor):
+    CatalogState = apps.get_model('library_app', 'CatalogState')
+    CatalogState.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0003_book_quantity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_state_row, migrations.RunPython.noop),
+    ]
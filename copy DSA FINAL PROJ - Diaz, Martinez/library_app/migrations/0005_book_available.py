@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:40
+
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def fill_available(apps, schema_editor):
+    Book = apps.get_model('library_app', 'Book')
+    for book in Book.objects.annotate(active=Count('borrowing')):
+        Book.objects.filter(pk=book.pk).update(available=F('quantity') - book.active)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0004_catalogstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available',
+            field=models.IntegerField(default=3),
+        ),
+        migrations.RunPython(fill_available, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0005_book_available'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogstate',
+            name='loan_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
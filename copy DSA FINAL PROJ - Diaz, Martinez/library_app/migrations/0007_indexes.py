@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:53
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0006_catalogstate_loan_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title', 'author', 'year'], name='book_title_author_year'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(django.db.models.functions.text.Lower('title'), name='book_title_lower'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(django.db.models.functions.text.Lower('author'), django.db.models.functions.text.Lower('title'), name='book_author_lower'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['year'], name='book_year'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowing',
+            index=models.Index(fields=['user', 'borrowed_at'], name='borrowing_user_borrowed'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowing',
+            index=models.Index(fields=['book', 'borrowed_at'], name='borrowing_book_borrowed'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:01
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+BORROW_SECONDS = 24 * 3600
+
+
+def mark_existing_overdue(apps, schema_editor):
+    Borrowing = apps.get_model('library_app', 'Borrowing')
+    cutoff = timezone.now() - timedelta(seconds=BORROW_SECONDS)
+    Borrowing.objects.filter(borrowed_at__lte=cutoff).update(status='overdue')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0007_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='borrowing',
+            name='status',
+            field=models.CharField(choices=[('active', 'Active'), ('overdue', 'Overdue')], default='active', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='borrowing',
+            index=models.Index(fields=['status', 'borrowed_at'], name='borrowing_status_borrowed'),
+        ),
+        migrations.RunPython(mark_existing_overdue, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0009_reservation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookStats',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='library_app.book')),
+                ('borrow_count', models.PositiveIntegerField(default=0)),
+                ('return_count', models.PositiveIntegerField(default=0)),
+                ('loan_seconds', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['borrow_count', 'book'], name='bookstats_popular')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LoanCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('all', 'All time')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('borrows', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('loan_seconds', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('period', 'start'), name='one_counter_per_period')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LoanEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('borrow', 'Borrow'), ('return', 'Return')], max_length=6)),
+                ('at', models.DateTimeField()),
+                ('loan_seconds', models.PositiveIntegerField(blank=True, null=True)),
+                ('book', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='library_app.book')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['at'], name='loanevent_at')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:07
+
+from django.db import migrations, models
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+
+def raise_short_quantities(apps, schema_editor):
+    # Books whose quantity was lowered below their active loans: those copies
+    # are still out there, so count them rather than go negative.
+    Book = apps.get_model('library_app', 'Book')
+    for book in Book.objects.filter(available__lt=0).annotate(active=Count('borrowing')):
+        Book.objects.filter(pk=book.pk).update(quantity=Greatest(F('quantity'), book.active))
+        Book.objects.filter(pk=book.pk).update(available=F('quantity') - book.active)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0010_loan_analytics'),
+    ]
+
+    operations = [
+        migrations.RunPython(raise_short_quantities, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.CheckConstraint(condition=models.Q(('available__gte', 0)), name='book_available_not_negative'),
+        ),
+    ]
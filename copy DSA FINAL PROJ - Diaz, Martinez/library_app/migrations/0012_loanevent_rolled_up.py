@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0011_book_available_not_negative'),
+    ]
+
+    operations = [
+        # Events recorded so far were already counted when they happened.
+        migrations.AddField(
+            model_name='loanevent',
+            name='rolled_up',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='loanevent',
+            name='rolled_up',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='loanevent',
+            index=models.Index(condition=models.Q(('rolled_up', False)), fields=['id'], name='loanevent_pending'),
+        ),
+    ]
@@ -1,6 +1,10 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User
 from django.utils import timezone
+from datetime import timedelta
 
 
 BORROW_DURATION_HOURS = 24
@@ -13,31 +17,209 @@ class Book(models.Model):
     pdf_stub = models.FileField(upload_to='books/', blank=True, null=True)
     
     quantity = models.IntegerField(default=3) 
+    # Copies not currently borrowed. Only ever changed with conditional F()
+    # updates (see stock.py); reconcile_stock recomputes it from Borrowing.
+    # save() refuses an edited value: change quantity instead.
+    available = models.IntegerField(default=3)
+
+    class Meta:
+        constraints = [
+            # quantity can't drop below the copies out on loan.
+            models.CheckConstraint(condition=Q(available__gte=0), name='book_available_not_negative'),
+        ]
+        indexes = [
+            # import_books duplicate check: title IN (...) then author/year.
+            models.Index(fields=['title', 'author', 'year'], name='book_title_author_year'),
+            # export_books --sort title/author and year.
+            models.Index(Lower('title'), name='book_title_lower'),
+            models.Index(Lower('author'), Lower('title'), name='book_author_lower'),
+            models.Index(fields=['year'], name='book_year'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        book = super().from_db(db, field_names, values)
+        book._loaded_available = book.__dict__.get('available')
+        return book
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._loaded_available = self.__dict__.get('available')
+
+    def clean(self):
+        super().clean()
+        if not self._state.adding:
+            loans = Borrowing.objects.filter(book_id=self.pk).count()
+            if self.quantity < loans:
+                raise ValidationError({'quantity': f"{loans} copies are on loan, so there must be at least {loans}."})
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.available = self.quantity
+            super().save(*args, **kwargs)
+            self._loaded_available = self.available
+            return
+        if kwargs.get('update_fields') is not None:
+            return super().save(*args, **kwargs)
+        loaded = getattr(self, '_loaded_available', None)
+        if loaded is not None and self.__dict__.get('available', loaded) != loaded:
+            raise ValueError(
+                "Book.available is kept in step with the loans; change quantity, or run reconcile_stock."
+            )
+
+        # Shift the counter by the quantity delta in SQL and never write our
+        # possibly stale copy of it back over concurrent borrows.
+        with transaction.atomic():
+            Book.objects.filter(pk=self.pk).update(available=F('available') + self.quantity - F('quantity'))
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name != 'available'
+            ]
+            super().save(*args, **kwargs)
+            self.available = self._loaded_available = (
+                Book.objects.filter(pk=self.pk).values_list('available', flat=True).get()
+            )
 
     @property
     def available_stock(self):
-        active_borrows = self.borrowing_set.count()
-        return self.quantity - active_borrows
+        return self.available
 
 class Borrowing(models.Model):
+    ACTIVE = 'active'
+    OVERDUE = 'overdue'
+    STATUS_CHOICES = [(ACTIVE, 'Active'), (OVERDUE, 'Overdue')]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     borrowed_at = models.DateTimeField(auto_now_add=True)
-    
+    # Set to OVERDUE by the sweep_overdue command once the loan period is up.
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE)
+
+    class Meta:
+        indexes = [
+            # my_books, the loans API (newest first) and read_book's
+            # active-loan check all filter on user and borrowed_at.
+            models.Index(fields=['user', 'borrowed_at'], name='borrowing_user_borrowed'),
+            # read_book / reconcile_stock look up loans of one book.
+            models.Index(fields=['book', 'borrowed_at'], name='borrowing_book_borrowed'),
+            # sweep_overdue: status = ... AND borrowed_at <= cutoff.
+            models.Index(fields=['status', 'borrowed_at'], name='borrowing_status_borrowed'),
+        ]
+
     @property
     def is_overdue(self):
-        now = timezone.now()
-        diff = now - self.borrowed_at
-        return diff.total_seconds() > BORROW_SECONDS 
-    
+        # The clock check too: the sweeper may not have marked it yet.
+        return self.status == self.OVERDUE or self.due_at <= timezone.now()
+
+    @property
+    def due_at(self):
+        return self.borrowed_at + timedelta(seconds=BORROW_SECONDS)
+
     @property
     def remaining_time(self):
-        now = timezone.now()
-        diff = now - self.borrowed_at
-        remaining = BORROW_SECONDS - diff.total_seconds()
-        
-        return int(remaining / 60) if remaining > 0 else 0
\ No newline at end of file
+        remaining = (self.due_at - timezone.now()).total_seconds()
+        return int(remaining / 60) if remaining > 0 else 0
+
+
+class Reservation(models.Model):
+    # Waitlist entry for an out-of-stock book. The (book, priority,
+    # requested_at) index is the queue: the next waiter is one index seek.
+    # Lower priority numbers are served first; staff can move someone up.
+    NORMAL = 100
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    priority = models.PositiveSmallIntegerField(default=NORMAL)
+    requested_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book'], name='one_reservation_per_book'),
+        ]
+        indexes = [
+            models.Index(fields=['book', 'priority', 'requested_at', 'id'], name='reservation_queue'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} waiting for {self.book}"
+
+
+#ANALYTICS
+class LoanEvent(models.Model):
+    # Append-only ledger of borrows and returns (Borrowing rows are deleted
+    # on return). Kept when the book or user goes away.
+    BORROW = 'borrow'
+    RETURN = 'return'
+    KIND_CHOICES = [(BORROW, 'Borrow'), (RETURN, 'Return')]
+
+    kind = models.CharField(max_length=6, choices=KIND_CHOICES)
+    book = models.ForeignKey(Book, on_delete=models.SET_NULL, null=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    at = models.DateTimeField()
+    # How long the loan lasted; returns only.
+    loan_seconds = models.PositiveIntegerField(null=True, blank=True)
+    # Set once analytics.roll_up has added it to BookStats / LoanCounter.
+    rolled_up = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['at'], name='loanevent_at'),
+            # The few events roll_up hasn't counted yet.
+            models.Index(fields=['id'], condition=Q(rolled_up=False), name='loanevent_pending'),
+        ]
+
+
+class BookStats(models.Model):
+    # Running totals per book, rolled up from the LoanEvents (see analytics.py).
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    borrow_count = models.PositiveIntegerField(default=0)
+    return_count = models.PositiveIntegerField(default=0)
+    loan_seconds = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # The "popular" listing walks this backwards.
+            models.Index(fields=['borrow_count', 'book'], name='bookstats_popular'),
+        ]
+
+    @property
+    def average_loan_seconds(self):
+        return self.loan_seconds / self.return_count if self.return_count else None
+
+
+class LoanCounter(models.Model):
+    # Borrow/return totals per hour and per day (local time), plus one
+    # all-time row, so the dashboard reads a bounded number of rows.
+    HOUR = 'hour'
+    DAY = 'day'
+    ALL = 'all'
+    PERIOD_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day'), (ALL, 'All time')]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    borrows = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    loan_seconds = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'start'], name='one_counter_per_period'),
+        ]
+
+    @property
+    def average_loan_seconds(self):
+        return self.loan_seconds / self.returns if self.returns else None
+
+
+class CatalogState(models.Model):
+    # Single row (pk=1). version is bumped on every Book change so each worker
+    # process can tell when its in-memory catalog index is stale; loan_version
+    # on every borrow/return, so stock-dependent responses can be revalidated.
+    version = models.PositiveBigIntegerField(default=0)
+    loan_version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Catalog v{self.version}"
\ No newline at end of file
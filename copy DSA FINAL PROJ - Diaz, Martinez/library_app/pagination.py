@@ -0,0 +1,103 @@
+"""
+Keyset (cursor) pagination.
+
+A cursor is the sort key of the last (or first) row of the current page, so
+fetching any page is a bisect into the ordering rather than an OFFSET walk.
+"""
+import base64
+import binascii
+import json
+import operator
+
+from .algo import top_k
+
+
+class Page:
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def encode_cursor(key):
+    raw = json.dumps(list(key), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        key = json.loads(raw)
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(key, list) or not all(isinstance(part, (str, int)) for part in key):
+        return None
+    return tuple(key)
+
+
+#SORTED INDEX PAGES
+def page_sorted(index, per_page, after=None, before=None, reverse=False, lo=0, hi=None):
+    """
+    One page of an ordered index (anything with rank_left / rank_right /
+    slice / key_func / len), limited to positions [lo, hi). `after` and
+    `before` are keys in the order being walked, so with reverse=True
+    "after" means smaller keys.
+    """
+    if hi is None:
+        hi = len(index)
+    if not reverse:
+        if after is not None:
+            start = max(lo, index.rank_right(after))
+            end = min(hi, start + per_page)
+        elif before is not None:
+            end = min(hi, index.rank_left(before))
+            start = max(lo, end - per_page)
+        else:
+            start, end = lo, min(hi, lo + per_page)
+        items = index.slice(start, end)
+        has_prev, has_next = start > lo, end < hi
+    else:
+        if after is not None:
+            end = min(hi, index.rank_left(after))
+            start = max(lo, end - per_page)
+        elif before is not None:
+            start = max(lo, index.rank_right(before))
+            end = min(hi, start + per_page)
+        else:
+            start, end = max(lo, hi - per_page), hi
+        items = index.slice(start, end)[::-1]
+        has_prev, has_next = end < hi, start > lo
+
+    if not items:
+        return Page(items)
+    return Page(
+        items,
+        encode_cursor(index.key_func(items[-1])) if has_next else None,
+        encode_cursor(index.key_func(items[0])) if has_prev else None,
+    )
+
+
+#RANKED RESULT PAGES
+def page_ranked(pairs, per_page, after=None, before=None):
+    """One page of unsorted (key, item) pairs, best key first, using top-k selection."""
+    first = operator.itemgetter(0)
+    if before is not None:
+        window = top_k([pair for pair in pairs if pair[0] < before], per_page + 1, key=first, reverse=True)
+        has_prev, has_next = len(window) > per_page, True
+        window = window[:per_page][::-1]
+    else:
+        if after is not None:
+            pairs = [pair for pair in pairs if pair[0] > after]
+        window = top_k(pairs, per_page + 1, key=first)
+        has_prev, has_next = after is not None, len(window) > per_page
+        window = window[:per_page]
+
+    if not window:
+        return Page([])
+    return Page(
+        [item for _, item in window],
+        encode_cursor(window[-1][0]) if has_next else None,
+        encode_cursor(window[0][0]) if has_prev else None,
+    )
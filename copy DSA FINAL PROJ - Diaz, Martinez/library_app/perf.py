@@ -0,0 +1,226 @@
+"""
+Per-request performance instrumentation.
+
+PerfMiddleware records, for each request: wall time, SQL query count and
+time, time spent in the catalog index and listing calls wrapped with @timed
+(broken down by function), and template render time (blocks under
+rendering()). The numbers go
+out as a Server-Timing header (visible in the browser's network panel) and
+as one JSON log line on the 'library_app.perf' logger.
+
+Request durations are also kept as a rolling window per view, in memory in
+each worker process, for the staff perf stats page. With PERF_PROFILE_RATE > 0 a sample of
+requests runs under cProfile, and the ones slower than
+PERF_PROFILE_THRESHOLD_MS are dumped to PERF_PROFILE_DIR
+(open them with `python -m pstats` or snakeviz).
+
+The hooks cost one context variable lookup when no request is being
+measured. algo.py doesn't use them, so it stays free of Django.
+"""
+import cProfile
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger('library_app.perf')
+
+_current = ContextVar('perf_timings', default=None)
+
+PERCENTILES = (50, 95, 99)
+
+
+class Timings:
+    __slots__ = ('sql_count', 'sql_time', 'algo', 'algo_time', 'render_time', 'depth')
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.algo = {}
+        self.algo_time = 0.0
+        self.render_time = 0.0
+        self.depth = 0
+
+
+#HOOKS
+def timed(func):
+    """Adds the call's duration to the current request's algo breakdown."""
+    name = func.__qualname__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        timings = _current.get()
+        if timings is None:
+            return func(*args, **kwargs)
+        timings.depth += 1
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            timings.depth -= 1
+            timings.algo[name] = timings.algo.get(name, 0.0) + elapsed
+            # Only the outermost call counts towards the total, so
+            # search_prefix -> ranked_prefix isn't counted twice.
+            if timings.depth == 0:
+                timings.algo_time += elapsed
+    return wrapper
+
+
+@contextmanager
+def rendering():
+    """Counts the time spent in the block as template render time."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.render_time += time.perf_counter() - start
+
+
+def sql_timer(execute, sql, params, many, context):
+    """Database execute wrapper, installed on every connection (see signals.py)."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.sql_count += 1
+        timings.sql_time += time.perf_counter() - start
+
+
+#MIDDLEWARE
+class PerfMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = Timings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        profiler = None
+        if random.random() < getattr(settings, 'PERF_PROFILE_RATE', 0):
+            profiler = cProfile.Profile()
+        try:
+            if profiler:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - start
+        if profiler:
+            dump_profile(profiler, request, elapsed)
+        return finish(request, response, timings, elapsed)
+
+    async def __acall__(self, request):
+        # No profiler here: cProfile would also catch every other coroutine
+        # running on the loop.
+        timings = Timings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return finish(request, response, timings, time.perf_counter() - start)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+def ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+def finish(request, response, timings, elapsed):
+    parts = [
+        f'total;dur={ms(elapsed)}',
+        f'sql;dur={ms(timings.sql_time)};desc="{timings.sql_count} queries"',
+        f'algo;dur={ms(timings.algo_time)}',
+        f'render;dur={ms(timings.render_time)}',
+    ]
+    parts += [f'algo.{name};dur={ms(seconds)}' for name, seconds in timings.algo.items()]
+    response['Server-Timing'] = ', '.join(parts)
+
+    name = view_name(request)
+    logger.info(json.dumps({
+        'view': name,
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'total_ms': ms(elapsed),
+        'sql_count': timings.sql_count,
+        'sql_ms': ms(timings.sql_time),
+        'algo_ms': ms(timings.algo_time),
+        'algo': {k: ms(v) for k, v in timings.algo.items()},
+        'render_ms': ms(timings.render_time),
+    }))
+    record(name, elapsed)
+    return response
+
+
+def dump_profile(profiler, request, elapsed):
+    if elapsed * 1000 < getattr(settings, 'PERF_PROFILE_THRESHOLD_MS', 500):
+        return
+    directory = getattr(settings, 'PERF_PROFILE_DIR', None)
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{view_name(request).replace(':', '_')}-{int(elapsed * 1000)}ms.prof"
+    profiler.dump_stats(os.path.join(directory, filename))
+    logger.warning("slow request %s %s (%.0f ms), profile saved as %s", request.method, request.path, elapsed * 1000, filename)
+
+
+#ROLLING PERCENTILES
+# view name -> deque of its last PERF_WINDOW durations, for this process.
+_samples = {}
+
+
+def record(name, elapsed):
+    samples = _samples.get(name)
+    if samples is None:
+        samples = _samples.setdefault(name, deque(maxlen=getattr(settings, 'PERF_WINDOW', 1000)))
+    samples.append(elapsed)
+
+
+def percentile(sorted_samples, p):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, -(-len(sorted_samples) * p // 100))
+    return sorted_samples[int(rank) - 1]
+
+
+def perf_report():
+    report = []
+    for name in sorted(_samples):
+        samples = sorted(_samples[name])
+        if not samples:
+            continue
+        row = {'view': name, 'count': len(samples), 'max': round(samples[-1] * 1000, 1)}
+        for p in PERCENTILES:
+            row[f'p{p}'] = round(percentile(samples, p) * 1000, 1)
+        report.append(row)
+    return report
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from .backends import forget_user
+from .models import Book, Reservation
+from .catalog_index import catalog, bump_version
+from .perf import sql_timer
+from .stock import serve_waitlist
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, created, **kwargs):
+    version = bump_version()
+    transaction.on_commit(lambda: catalog.apply_save(instance, version))
+    if not created and Reservation.objects.filter(book=instance).exists():
+        # More copies (or a reconciled count) may let waiters in.
+        transaction.on_commit(lambda: serve_waitlist(instance.pk))
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    version = bump_version()
+    book_id = instance.id
+    transaction.on_commit(lambda: catalog.apply_delete(book_id, version))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Includes the last_login update on every login.
+    forget_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_access_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        forget_user(instance.pk)
+    else:
+        # group.user_set.add(...) and the like; pk_set is None for clear().
+        for user_id in pk_set or ():
+            forget_user(user_id)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    # Per-connection SQLite tuning from settings.SQLITE_PRAGMAS. journal_mode
+    # is stored in the database file, the rest only last for this connection.
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    # Feeds the per-request SQL count/time; a no-op outside PerfMiddleware.
+    connection.execute_wrappers.append(sql_timer)
@@ -0,0 +1,513 @@
+"""
+Read-only catalog snapshot that every worker process memory-maps.
+
+One binary file at CATALOG_SNAPSHOT_PATH holds the whole catalog:
+
+    ids, years, quantity, available   fixed-width columns, one row per book in id order
+    string table    title, author and pdf_stub of every row, as offsets into one UTF-8 blob
+    orderings       row numbers in listing order by title and by year, and in
+                    normalized title / author order for prefix search
+    words           every distinct title / author word, sorted, with the rows using it
+    trigrams        every 3-character piece of the normalized texts, sorted, with its rows
+
+Workers mmap it read-only, so the OS keeps a single copy of those pages for
+all of them, and starting up costs an open() instead of loading and sorting
+every Book. SnapshotCatalog answers the calls listing.py makes of a
+CatalogIndex by bisecting the mapped arrays and decoding only the rows a
+page shows. The one thing built in memory is the BK-tree for fuzzy search,
+from the word table, the first time a process needs it.
+
+The file is written under a temporary name in the same directory and moved
+into place with os.replace, so a reader sees the old snapshot or the new
+one, never a mix. See CATALOG_SNAPSHOT in settings for when it's rebuilt.
+Windows won't replace a file some process has mapped; there a failed
+rebuild is logged and requests use the in-memory CatalogIndex instead.
+"""
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+from .algo import BKTree, ngrams, typo_budget
+from .catalog_index import RECORD_FIELDS, BookRecord, current_version, normalize, title_key, year_key
+from .models import Book
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+logger = logging.getLogger('library_app.snapshot')
+
+MAGIC = b'LIBSNAP\x00'
+FORMAT = 1
+# magic, format, 1 if the arrays are little-endian, book count, catalog version
+HEADER = struct.Struct('<8sBB2xIq')
+# (name, array typecode); 'B' sections are raw bytes.
+SECTIONS = (
+    ('ids', 'q'), ('years', 'i'), ('quantity', 'i'), ('available', 'i'),
+    ('string_offsets', 'Q'), ('strings', 'B'),
+    ('title_order', 'I'), ('year_order', 'I'), ('title_search_order', 'I'), ('author_search_order', 'I'),
+    ('word_offsets', 'Q'), ('words', 'B'), ('word_row_offsets', 'Q'), ('word_rows', 'I'),
+    ('gram_offsets', 'Q'), ('grams', 'B'), ('gram_row_offsets', 'Q'), ('gram_rows', 'I'),
+)
+# (offset, size in bytes) of every section, right after the header.
+TABLE = struct.Struct('<' + 'QQ' * len(SECTIONS))
+# Per row in the string table.
+TITLE, AUTHOR, PDF_STUB = range(3)
+GRAM_SIZE = 3
+
+
+#WRITING
+def string_table(strings):
+    offsets = array('Q', [0])
+    blob = bytearray()
+    for text in strings:
+        blob += text.encode()
+        offsets.append(len(blob))
+    return offsets, blob
+
+
+def postings_table(keys, postings):
+    offsets = array('Q', [0])
+    rows = array('I')
+    for key in keys:
+        rows.extend(postings[key])
+        offsets.append(len(rows))
+    return offsets, rows
+
+
+def write_snapshot(path, version, records):
+    """Write records (BookRecords in id order) as the snapshot of catalog `version`. Returns the file size."""
+    rows = range(len(records))
+    titles = [normalize(book.title) for book in records]
+    authors = [normalize(book.author) for book in records]
+
+    words, grams = defaultdict(list), defaultdict(list)
+    for row in rows:
+        for word in set(titles[row].split()) | set(authors[row].split()):
+            words[word].append(row)
+        for gram in ngrams(titles[row], GRAM_SIZE) | ngrams(authors[row], GRAM_SIZE):
+            grams[gram].append(row)
+    word_keys, gram_keys = sorted(words), sorted(grams)
+
+    string_offsets, strings = string_table(
+        text for book in records for text in (book.title, book.author, book.pdf_stub)
+    )
+    word_offsets, word_blob = string_table(word_keys)
+    word_row_offsets, word_rows = postings_table(word_keys, words)
+    gram_offsets, gram_blob = string_table(gram_keys)
+    gram_row_offsets, gram_rows = postings_table(gram_keys, grams)
+    data = {
+        'ids': array('q', (book.id for book in records)),
+        'years': array('i', (book.year for book in records)),
+        'quantity': array('i', (book.quantity for book in records)),
+        'available': array('i', (book.available for book in records)),
+        'string_offsets': string_offsets,
+        'strings': strings,
+        'title_order': array('I', sorted(rows, key=lambda row: title_key(records[row]))),
+        'year_order': array('I', sorted(rows, key=lambda row: year_key(records[row]))),
+        'title_search_order': array('I', sorted(rows, key=lambda row: (titles[row], records[row].id))),
+        'author_search_order': array('I', sorted(rows, key=lambda row: (authors[row], records[row].id))),
+        'word_offsets': word_offsets,
+        'words': word_blob,
+        'word_row_offsets': word_row_offsets,
+        'word_rows': word_rows,
+        'gram_offsets': gram_offsets,
+        'grams': gram_blob,
+        'gram_row_offsets': gram_row_offsets,
+        'gram_rows': gram_rows,
+    }
+
+    # Every section starts 8-byte aligned.
+    layout = []
+    position = HEADER.size + TABLE.size
+    for name, _ in SECTIONS:
+        position += -position % 8
+        size = len(data[name]) * (data[name].itemsize if isinstance(data[name], array) else 1)
+        layout.append((position, size))
+        position += size
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.catalog-snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT, sys.byteorder == 'little', len(records), version))
+            f.write(TABLE.pack(*(n for pair in layout for n in pair)))
+            for (name, _), (offset, _) in zip(SECTIONS, layout):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(data[name])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return position
+
+
+def build(path=None):
+    """Snapshot the Book table; returns (catalog version, file size)."""
+    path = path or settings.CATALOG_SNAPSHOT_PATH
+    # Version first: a change that lands while the rows are read makes the
+    # file look stale (and get rebuilt), never wrongly current.
+    version = current_version()
+    rows = Book.objects.order_by('id').values_list(*RECORD_FIELDS).iterator(chunk_size=5000)
+    return version, write_snapshot(path, version, [BookRecord(*row) for row in rows])
+
+
+#READING
+class SnapshotCatalog:
+    """A mapped snapshot, with the read side of CatalogIndex's interface."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.file_id = (stat.st_ino, stat.st_mtime_ns)
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, file_format, little, self.count, self.version = HEADER.unpack_from(self.mm)
+        if magic != MAGIC or file_format != FORMAT or little != (sys.byteorder == 'little'):
+            raise ValueError(f"{path} is not a catalog snapshot this version can read")
+        table = TABLE.unpack_from(self.mm, HEADER.size)
+        view = memoryview(self.mm)
+        for i, (name, code) in enumerate(SECTIONS):
+            offset, size = table[2 * i], table[2 * i + 1]
+            section = view[offset:offset + size]
+            setattr(self, name, section if code == 'B' else section.cast(code))
+
+        self.lock = threading.Lock()
+        self._fuzzy_tree = None
+        self.by_id = SnapshotIds(self)
+        self.by_title = SnapshotOrdering(self, self.title_order, title_key, self.title_row_key)
+        self.by_year = SnapshotOrdering(self, self.year_order, year_key, self.year_row_key)
+
+    def text(self, row, field):
+        i = row * 3 + field
+        return str(self.strings[self.string_offsets[i]:self.string_offsets[i + 1]], 'utf-8')
+
+    def record(self, row):
+        return BookRecord(
+            self.ids[row], self.text(row, TITLE), self.text(row, AUTHOR), self.years[row],
+            self.quantity[row], self.available[row], self.text(row, PDF_STUB),
+        )
+
+    def title_row_key(self, row):
+        return (self.text(row, TITLE).lower(), self.ids[row])
+
+    def year_row_key(self, row):
+        return (self.years[row], self.ids[row])
+
+    def year_bounds(self, year_from=None, year_to=None):
+        """Positions [lo, hi) in by_year of books published between the two years, inclusive."""
+        lo = 0 if year_from is None else self.by_year.rank_left((year_from,))
+        hi = len(self.by_year) if year_to is None else self.by_year.rank_left((year_to + 1,))
+        return lo, max(lo, hi)
+
+    #SORTED STRING TABLES (words, trigrams)
+    def word(self, i):
+        return str(self.words[self.word_offsets[i]:self.word_offsets[i + 1]], 'utf-8')
+
+    def gram(self, i):
+        return str(self.grams[self.gram_offsets[i]:self.gram_offsets[i + 1]], 'utf-8')
+
+    def word_rows_at(self, i):
+        return self.word_rows[self.word_row_offsets[i]:self.word_row_offsets[i + 1]]
+
+    def gram_rows_for(self, gram):
+        i = bisect_left(range(len(self.gram_offsets) - 1), gram, key=self.gram)
+        if i == len(self.gram_offsets) - 1 or self.gram(i) != gram:
+            return None
+        return self.gram_rows[self.gram_row_offsets[i]:self.gram_row_offsets[i + 1]]
+
+    def word_rows_for(self, word):
+        i = bisect_left(range(len(self.word_offsets) - 1), word, key=self.word)
+        if i == len(self.word_offsets) - 1 or self.word(i) != word:
+            return ()
+        return self.word_rows_at(i)
+
+    #SEARCH (same results and rank keys as CatalogIndex)
+    def prefix_matches(self, tier, query):
+        """(text, row) of every entry starting with query, in key order."""
+        if tier == 2:
+            for i in range(bisect_left(range(len(self.word_offsets) - 1), query, key=self.word), len(self.word_offsets) - 1):
+                word = self.word(i)
+                if not word.startswith(query):
+                    return
+                for row in self.word_rows_at(i):
+                    yield word, row
+            return
+        order, field = ((self.title_search_order, TITLE), (self.author_search_order, AUTHOR))[tier]
+        start = bisect_left(order, (query,), key=lambda row: (normalize(self.text(row, field)), self.ids[row]))
+        for row in order[start:]:
+            text = normalize(self.text(row, field))
+            if not text.startswith(query):
+                return
+            yield text, row
+
+    def ranked_prefix(self, query, limit=None):
+        query = normalize(query)
+        ranked = []
+        if not query:
+            return ranked
+        seen = set()
+        for tier in range(3):
+            for text, row in self.prefix_matches(tier, query):
+                if row not in seen:
+                    seen.add(row)
+                    book = self.record(row)
+                    ranked.append(((tier, text, book.id), book))
+                    if limit is not None and len(ranked) >= limit:
+                        return ranked
+        return ranked
+
+    def ranked_substring(self, query):
+        query = normalize(query)
+        if not query:
+            return []
+        if len(query) < GRAM_SIZE:
+            # Shorter than a trigram: check every row.
+            candidates = range(self.count)
+        else:
+            postings = [self.gram_rows_for(gram) for gram in ngrams(query, GRAM_SIZE)]
+            if not all(postings):
+                return []
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for rows in postings[1:]:
+                candidates.intersection_update(rows)
+                if not candidates:
+                    return []
+
+        ranked = []
+        for row in candidates:
+            for field in (TITLE, AUTHOR):
+                text = normalize(self.text(row, field))
+                pos = text.find(query)
+                if pos != -1:
+                    book = self.record(row)
+                    ranked.append(((field, pos, len(text), book.id), book))
+                    break
+        return ranked
+
+    def fuzzy_tree(self):
+        with self.lock:
+            if self._fuzzy_tree is None:
+                tree = BKTree()
+                for i in range(len(self.word_offsets) - 1):
+                    tree.add(self.word(i))
+                self._fuzzy_tree = tree
+            return self._fuzzy_tree
+
+    def ranked_fuzzy(self, query):
+        terms = normalize(query).split()
+        tree = self.fuzzy_tree()
+        closest = {}
+        for position, term in enumerate(terms):
+            for distance, word in tree.search(term, typo_budget(term)):
+                for row in self.word_rows_for(word):
+                    best = closest.setdefault(row, [None] * len(terms))
+                    if best[position] is None or distance < best[position]:
+                        best[position] = distance
+
+        ranked = []
+        for row, best in closest.items():
+            matched = [d for d in best if d is not None]
+            book = self.record(row)
+            ranked.append(((len(terms) - len(matched), sum(matched), book.title.lower(), book.id), book))
+        return ranked
+
+
+class SnapshotIds:
+    """by_id: id -> BookRecord, by bisecting the sorted id column."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def row(self, book_id):
+        ids = self.snapshot.ids
+        if not isinstance(book_id, int):
+            return None
+        i = bisect_left(ids, book_id)
+        return i if i < len(ids) and ids[i] == book_id else None
+
+    def __contains__(self, book_id):
+        return self.row(book_id) is not None
+
+    def __getitem__(self, book_id):
+        row = self.row(book_id)
+        if row is None:
+            raise KeyError(book_id)
+        return self.snapshot.record(row)
+
+    def get(self, book_id, default=None):
+        row = self.row(book_id)
+        return default if row is None else self.snapshot.record(row)
+
+    def __len__(self):
+        return self.snapshot.count
+
+
+class SnapshotRecords:
+    """Lazy sequence of the records in one ordering (for algo.binary_search)."""
+
+    def __init__(self, snapshot, order):
+        self.snapshot = snapshot
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        return self.snapshot.record(self.order[i])
+
+
+class SnapshotOrdering:
+    """by_title / by_year: what pagination.page_sorted needs of an ordered index."""
+
+    def __init__(self, snapshot, order, key_func, row_key):
+        self.snapshot = snapshot
+        self.order = order
+        self.key_func = key_func
+        self.row_key = row_key
+        self.items = SnapshotRecords(snapshot, order)
+
+    def __len__(self):
+        return len(self.order)
+
+    def rank_left(self, key):
+        return bisect_left(self.order, key, key=self.row_key)
+
+    def rank_right(self, key):
+        return bisect_right(self.order, key, key=self.row_key)
+
+    def slice(self, start, end):
+        return [self.snapshot.record(row) for row in self.order[start:end]]
+
+
+#PER-PROCESS HANDLE
+_lock = threading.Lock()
+_current = None
+# Catalog version whose rebuild failed here; not retried until it changes.
+_failed_version = None
+# The thread running an 'auto' mode rebuild, if any.
+_rebuilder = None
+
+
+def loaded(version):
+    """The already mapped snapshot if it is of catalog `version`; never touches the disk."""
+    snapshot = _current
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    return None
+
+
+def file_version(path):
+    try:
+        with open(path, 'rb') as f:
+            magic, file_format, _, _, version = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return None
+    return version if magic == MAGIC and file_format == FORMAT else None
+
+
+@contextmanager
+def rebuild_lock(path):
+    """Held by one process at a time: flock on POSIX, msvcrt.locking on Windows."""
+    with open(f"{path}.lock", 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+        elif msvcrt is not None:
+            # Locks the file's first byte. LK_LOCK gives up after about 10
+            # seconds, so keep trying like flock would.
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            yield
+
+
+def rebuild_if_stale(path, version):
+    """Rebuild the file unless it's at least `version`; one process at a time."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with rebuild_lock(path):
+        # Someone else may have rebuilt it while we waited for the lock.
+        current = file_version(path)
+        if current is None or current < version:
+            build(path)
+
+
+def start_rebuild(path, version):
+    """Rebuild the file on a background thread, unless this process already is."""
+    global _rebuilder
+    if _rebuilder is not None and _rebuilder.is_alive():
+        return
+    _rebuilder = threading.Thread(target=rebuild_in_background, args=(path, version), name='catalog-snapshot', daemon=True)
+    _rebuilder.start()
+
+
+def rebuild_in_background(path, version):
+    global _failed_version
+    try:
+        rebuild_if_stale(path, version)
+    except OSError:
+        # e.g. PermissionError from os.replace on Windows while other
+        # workers have the old file mapped.
+        logger.warning("couldn't rebuild catalog snapshot %s for version %s", path, version, exc_info=True)
+        _failed_version = version
+    finally:
+        # No request cycle closes this thread's connection.
+        connection.close()
+
+
+def get_snapshot(version):
+    """
+    The snapshot of catalog `version`, or None while there isn't one (the
+    caller then uses its in-memory CatalogIndex). Remaps the file when it
+    was replaced. In 'auto' mode a missing or stale file is rebuilt on a
+    background thread, and the old snapshot keeps being served until the
+    new one is in place.
+    """
+    global _current
+    snapshot = loaded(version)
+    if snapshot is not None:
+        return snapshot
+    path = str(settings.CATALOG_SNAPSHOT_PATH)
+    with _lock:
+        try:
+            stat = os.stat(path)
+            if _current is None or _current.file_id != (stat.st_ino, stat.st_mtime_ns):
+                _current = SnapshotCatalog(path)
+        except (OSError, ValueError, struct.error):
+            _current = None
+        if _current is not None and _current.version == version:
+            return _current
+        if getattr(settings, 'CATALOG_SNAPSHOT', 'off') != 'auto' or _failed_version == version:
+            return None
+        start_rebuild(path, version)
+        return _current
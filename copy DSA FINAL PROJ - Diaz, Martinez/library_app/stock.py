@@ -0,0 +1,210 @@
+"""
+Stock bookkeeping for borrows, returns and the reservation waitlist.
+
+Book.available is only changed here, with conditional F() updates, so two
+concurrent borrows of the last copy can never both succeed. A returned
+copy goes straight to the first person on the book's waitlist (if any)
+without ever showing up as available. Every loan that starts or ends is
+also recorded in the analytics ledger, in the same transaction.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .analytics import record_borrows, record_returns
+from .catalog_index import bump_loan_version
+from .models import Book, Borrowing, Reservation, BORROW_SECONDS
+
+
+def borrow_copy(user, book):
+    """
+    Take one copy of book for user and drop them from its waitlist. Returns
+    the Borrowing, or None if out of stock.
+    """
+    with transaction.atomic():
+        taken = Book.objects.filter(pk=book.pk, available__gt=0).update(available=F('available') - 1)
+        if not taken:
+            return None
+        bump_loan_version()
+        record_borrows([(user.pk, book.pk)])
+        # Got it directly, so they no longer need their place in the queue.
+        Reservation.objects.filter(user=user, book=book).delete()
+        return Borrowing.objects.create(user=user, book=book)
+
+
+def return_copy(borrowing):
+    """Delete the borrowing and pass its copy on (or put it back). False if it was already returned."""
+    with transaction.atomic():
+        deleted, _ = Borrowing.objects.filter(pk=borrowing.pk).delete()
+        if not deleted:
+            return False
+        record_returns([(borrowing.user_id, borrowing.book_id, borrowing.borrowed_at)])
+        if hand_over(borrowing.book_id, 1):
+            Book.objects.filter(pk=borrowing.book_id).update(available=F('available') + 1)
+        bump_loan_version()
+        return True
+
+
+def borrow_or_reserve(user, book):
+    """Borrow a copy, or join the waitlist if none is left. Returns ('borrowed' | 'waiting', object, created)."""
+    loan = borrow_copy(user, book)
+    if loan is not None:
+        return 'borrowed', loan, True
+    reservation, created = reserve(user, book)
+    if reservation is None:
+        # A copy came back while we were queueing and was handed to us.
+        return 'borrowed', None, True
+    return 'waiting', reservation, created
+
+
+#WAITLIST
+def next_waiter(book_id):
+    # One seek on the reservation_queue index.
+    return (
+        Reservation.objects.filter(book_id=book_id)
+        .order_by('priority', 'requested_at', 'id')
+        .select_for_update()
+        .first()
+    )
+
+
+def hand_over(book_id, copies):
+    """
+    Lend up to `copies` just-returned copies of a book to the head of its
+    waitlist. Returns how many are left for the shelf. Call inside a transaction.
+    """
+    served = []
+    while copies:
+        waiter = next_waiter(book_id)
+        if waiter is None:
+            break
+        waiter.delete()
+        Borrowing.objects.create(user_id=waiter.user_id, book_id=book_id)
+        served.append((waiter.user_id, book_id))
+        copies -= 1
+    record_borrows(served)
+    return copies
+
+
+def serve_waitlist(book_id):
+    """Lend copies sitting on the shelf to waiters, e.g. after the quantity went up. Returns how many."""
+    served = 0
+    with transaction.atomic():
+        while Book.objects.filter(pk=book_id, available__gt=0).update(available=F('available') - 1):
+            if hand_over(book_id, 1):
+                # Nobody (left) waiting: put the copy back.
+                Book.objects.filter(pk=book_id).update(available=F('available') + 1)
+                break
+            served += 1
+        if served:
+            bump_loan_version()
+    return served
+
+
+def reserve(user, book, priority=Reservation.NORMAL):
+    """
+    Put user on book's waitlist. Returns (reservation, created), or
+    (None, False) if a copy freed up in the meantime and was lent to them.
+    """
+    try:
+        with transaction.atomic():
+            reservation = Reservation.objects.create(user=user, book=book, priority=priority)
+            bump_loan_version()
+    except IntegrityError:
+        return Reservation.objects.get(user=user, book=book), False
+    # A return between the failed borrow and the insert above found nobody
+    # waiting and shelved its copy; don't let it sit there.
+    serve_waitlist(book.pk)
+    if not Reservation.objects.filter(pk=reservation.pk).exists():
+        return None, False
+    return reservation, True
+
+
+def cancel_reservation(reservation):
+    with transaction.atomic():
+        deleted, _ = Reservation.objects.filter(pk=reservation.pk).delete()
+        if deleted:
+            bump_loan_version()
+        return bool(deleted)
+
+
+def queue_position(reservation):
+    """1-based place in the book's waitlist: one indexed COUNT of the entries ahead."""
+    ahead = Reservation.objects.filter(book_id=reservation.book_id).filter(
+        Q(priority__lt=reservation.priority)
+        | Q(priority=reservation.priority, requested_at__lt=reservation.requested_at)
+        | Q(priority=reservation.priority, requested_at=reservation.requested_at, id__lt=reservation.id)
+    ).count()
+    return ahead + 1
+
+
+def expected_available():
+    """Book.available recomputed from the active loans, as an expression for annotate() / update()."""
+    active = (
+        Borrowing.objects.filter(book=OuterRef('pk'))
+        .order_by().values('book').annotate(n=Count('pk')).values('n')
+    )
+    return F('quantity') - Coalesce(Subquery(active), Value(0))
+
+
+def restock(copies_by_book):
+    """Put back {book_id: copies} with one UPDATE."""
+    copies_by_book = {book_id: n for book_id, n in copies_by_book.items() if n}
+    if not copies_by_book:
+        return
+    extra = Case(
+        *[When(pk=book_id, then=Value(n)) for book_id, n in copies_by_book.items()],
+        default=Value(0), output_field=IntegerField(),
+    )
+    Book.objects.filter(pk__in=copies_by_book).update(available=F('available') + extra)
+
+
+def return_loans(loans, batch_size=500, now=None):
+    """
+    Return every loan in the queryset `loans`, batch_size at a time: one
+    DELETE, the waitlist hand-overs and one restock UPDATE per batch, each
+    batch its own transaction so the write lock is never held for long.
+    Returns how many loans were returned.
+    """
+    loans = loans.order_by()
+    returned = 0
+    while True:
+        with transaction.atomic():
+            batch = list(loans.select_for_update().values_list('id', 'user_id', 'book_id', 'borrowed_at')[:batch_size])
+            if not batch:
+                return returned
+            Borrowing.objects.filter(pk__in=[loan[0] for loan in batch]).delete()
+            record_returns([loan[1:] for loan in batch], now)
+            copies = Counter(book_id for _, _, book_id, _ in batch)
+            restock({book_id: hand_over(book_id, n) for book_id, n in copies.items()})
+            bump_loan_version()
+        returned += len(batch)
+
+
+def sweep_overdue(auto_return=False, batch_size=500, now=None):
+    """
+    Mark loans past their due time OVERDUE, or with auto_return return them
+    (active or already marked) through return_loans. Works in batches,
+    one transaction each, so it never holds the write lock for long.
+    Returns how many loans it changed.
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=BORROW_SECONDS)
+    statuses = [Borrowing.ACTIVE, Borrowing.OVERDUE] if auto_return else [Borrowing.ACTIVE]
+    # Served by the (status, borrowed_at) index.
+    expired = Borrowing.objects.filter(status__in=statuses, borrowed_at__lte=cutoff).order_by()
+    if auto_return:
+        return return_loans(expired, batch_size, now)
+
+    changed = 0
+    while True:
+        with transaction.atomic():
+            ids = list(expired.select_for_update().values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return changed
+            Borrowing.objects.filter(pk__in=ids).update(status=Borrowing.OVERDUE)
+            bump_loan_version()
+        changed += len(ids)
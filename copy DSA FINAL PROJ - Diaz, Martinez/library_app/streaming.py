@@ -0,0 +1,121 @@
+"""
+File delivery with byte ranges and conditional GET.
+
+Both full and partial responses are FileResponses over a real file
+descriptor, so servers that provide wsgi.file_wrapper (gunicorn, uWSGI)
+hand them to sendfile() and the bytes never pass through Python. Elsewhere
+Django falls back to reading FileResponse.block_size chunks. With
+PDF_SENDFILE_MODE set, the front proxy does all of it instead.
+"""
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileRange:
+    """
+    Read-only view of `length` bytes of f starting at `start`. It has no
+    tell()/seek(), so FileResponse leaves Content-Length to us, and
+    sendfile() uses that length starting from the current file offset.
+    """
+
+    def __init__(self, f, start, length):
+        f.seek(start)
+        self.file = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single 'bytes=' range, None to ignore it, or 'invalid'."""
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Malformed or multi-range: serve the whole file instead.
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes.
+        length = int(last)
+        if length == 0:
+            return 'invalid'
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return 'invalid'
+    return start, end
+
+
+def serve_file(request, path, content_type='application/octet-stream', accel_name=None):
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = int(stat.st_mtime)
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    mode = getattr(settings, 'PDF_SENDFILE_MODE', None)
+    if mode:
+        # The proxy serves the bytes (and handles Range) after our checks.
+        response = HttpResponse(content_type=content_type)
+        if mode == 'x-accel':
+            prefix = getattr(settings, 'PDF_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+            response['X-Accel-Redirect'] = prefix + (accel_name or os.path.basename(path))
+        else:
+            response['X-Sendfile'] = path
+    else:
+        byte_range = None
+        range_header = request.META.get('HTTP_RANGE')
+        if range_header and if_range_matches(request, etag, last_modified):
+            byte_range = parse_range(range_header, stat.st_size)
+
+        if byte_range == 'invalid':
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+        f = open(path, 'rb')
+        if byte_range is None:
+            response = FileResponse(f, content_type=content_type)
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            response = FileResponse(FileRange(f, start, length), status=206, content_type=content_type)
+            response['Content-Length'] = length
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    return response
+
+
+def if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
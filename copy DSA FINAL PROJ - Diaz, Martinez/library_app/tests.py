@@ -1,3 +1,1151 @@
-from django.test import TestCase
+import json
+import os
+import random
+import shutil
+import tempfile
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.http import FileResponse, HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import algo, async_views, catalog_index, compression, large_sort
+from .algo import AVLTree, NgramIndex, merge_sort, top_k
+from .analytics import loan_dashboard, roll_up
+from .backends import user_cache, user_key
+from .benchmarks import urlconf_with
+from . import snapshot
+from .catalog_index import BookRecord, CatalogIndex, catalog, current_version, get_catalog, year_key
+from .models import BORROW_SECONDS, Book, BookStats, Borrowing, LoanCounter, LoanEvent, Reservation
+from .listing import catalog_page
+from .pagination import encode_cursor
+from .streaming import parse_range
+from .stock import (
+    borrow_copy, borrow_or_reserve, queue_position, reserve, return_copy, return_loans, sweep_overdue,
+)
+
+
+def stock(book):
+    return Book.objects.values_list('available', flat=True).get(pk=book.pk)
+
+
+def forget_catalog():
+    # CatalogState.version restarts at 0 in every test, so the shared index
+    # may hold another test's books under the version this one will use.
+    catalog.version = None
+
+
+#STOCK
+class StockTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pass12345')
+        self.book = Book.objects.create(title='Dune', author='Frank Herbert', year=1965, quantity=1)
+
+    def test_new_book_starts_fully_available(self):
+        self.assertEqual(stock(self.book), 1)
+
+    def test_borrow_takes_a_copy(self):
+        loan = borrow_copy(self.user, self.book)
+        self.assertIsNotNone(loan)
+        self.assertEqual(stock(self.book), 0)
+
+    def test_borrow_out_of_stock(self):
+        other = User.objects.create_user('other', password='pass12345')
+        borrow_copy(other, self.book)
+        self.assertIsNone(borrow_copy(self.user, self.book))
+        self.assertEqual(stock(self.book), 0)
+        self.assertEqual(Borrowing.objects.filter(user=self.user).count(), 0)
+
+    def test_return_restores_available(self):
+        loan = borrow_copy(self.user, self.book)
+        self.assertTrue(return_copy(loan))
+        self.assertEqual(stock(self.book), 1)
+        self.assertFalse(Borrowing.objects.exists())
+
+    def test_return_twice_only_counts_once(self):
+        loan = borrow_copy(self.user, self.book)
+        return_copy(loan)
+        self.assertFalse(return_copy(loan))
+        self.assertEqual(stock(self.book), 1)
+
+    def test_borrow_and_return_views(self):
+        self.client.login(username='reader', password='pass12345')
+        self.client.get(reverse('borrow_book', args=[self.book.id]))
+        loan = Borrowing.objects.get(user=self.user)
+        self.assertEqual(stock(self.book), 0)
+        self.client.get(reverse('return_book', args=[loan.id]))
+        self.assertEqual(stock(self.book), 1)
+
+
+#WAITLIST
+class WaitlistTests(TestCase):
+    def setUp(self):
+        self.holder = User.objects.create_user('holder', password='pass12345')
+        self.book = Book.objects.create(title='Dune', author='Frank Herbert', year=1965, quantity=1)
+        self.loan = borrow_copy(self.holder, self.book)
+        self.first = User.objects.create_user('first', password='pass12345')
+        self.second = User.objects.create_user('second', password='pass12345')
+
+    def test_out_of_stock_borrow_joins_waitlist(self):
+        outcome, reservation, created = borrow_or_reserve(self.first, self.book)
+        self.assertEqual((outcome, created), ('waiting', True))
+        self.assertEqual(reservation.user, self.first)
+
+    def test_queue_order_is_priority_then_request_time(self):
+        early, _ = reserve(self.first, self.book)
+        late, _ = reserve(self.second, self.book)
+        self.assertEqual((queue_position(early), queue_position(late)), (1, 2))
+
+        staff = User.objects.create_user('staff', password='pass12345')
+        urgent, _ = reserve(staff, self.book, priority=1)
+        early.refresh_from_db()
+        late.refresh_from_db()
+        self.assertEqual([queue_position(r) for r in (urgent, early, late)], [1, 2, 3])
+
+    def test_return_hands_copy_to_next_waiter(self):
+        reserve(self.second, self.book)
+        reserve(self.first, self.book, priority=1)
+        return_copy(self.loan)
+        self.assertTrue(Borrowing.objects.filter(user=self.first, book=self.book).exists())
+        self.assertEqual(list(Reservation.objects.values_list('user__username', flat=True)), ['second'])
+        self.assertEqual(stock(self.book), 0)
+
+    def test_return_with_nobody_waiting_shelves_copy(self):
+        return_copy(self.loan)
+        self.assertEqual(stock(self.book), 1)
+
+    def test_restock_serves_waitlist(self):
+        reserve(self.first, self.book)
+        reserve(self.second, self.book)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.quantity = 2
+            self.book.save()
+        self.assertTrue(Borrowing.objects.filter(user=self.first, book=self.book).exists())
+        self.assertFalse(Borrowing.objects.filter(user=self.second).exists())
+        self.assertEqual(stock(self.book), 0)
+
+    def test_reserving_twice_returns_existing_entry(self):
+        reservation, created = reserve(self.first, self.book)
+        again, created_again = reserve(self.first, self.book)
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(again.pk, reservation.pk)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_unique_constraint_backs_reserve(self):
+        reserve(self.first, self.book)
+        with self.assertRaises(IntegrityError):
+            Reservation.objects.create(user=self.first, book=self.book)
+
+    def test_reserve_gets_copy_that_freed_up(self):
+        # A return shelved a copy between the failed borrow and the reserve.
+        Book.objects.filter(pk=self.book.pk).update(available=1)
+        self.assertEqual(reserve(self.first, self.book), (None, False))
+        self.assertTrue(Borrowing.objects.filter(user=self.first, book=self.book).exists())
+
+    def test_borrowing_directly_leaves_waitlist(self):
+        reserve(self.first, self.book)
+        Book.objects.filter(pk=self.book.pk).update(available=1)
+        self.assertIsNotNone(borrow_copy(self.first, self.book))
+        self.assertFalse(Reservation.objects.exists())
+
+        # So the next return doesn't give them a second copy.
+        return_copy(self.loan)
+        self.assertEqual(Borrowing.objects.filter(user=self.first).count(), 1)
+        self.assertEqual(stock(self.book), 1)
+
+
+#CATALOG INDEX
+class CatalogIndexTests(TestCase):
+    def setUp(self):
+        self.books = [
+            Book.objects.create(title=title, author=author, year=year, quantity=1)
+            for title, author, year in [
+                ('Dune', 'Frank Herbert', 1965), ('Emma', 'Jane Austen', 1815),
+                ('Ulysses', 'James Joyce', 1922), ('Beloved', 'Toni Morrison', 1987),
+            ]
+        ]
+        forget_catalog()
+        catalog.rebuild()
+
+    def snapshot(self, index):
+        return {
+            'ids': sorted(index.by_id),
+            'records': sorted((b.id, b.title, b.author, b.year) for b in index.by_id.values()),
+            'titles': [b.id for b in index.by_title.slice(0, len(index.by_title))],
+            'years': [b.id for b in index.by_year],
+            'prefix': [b.id for b in index.search_prefix('j')],
+            'substring': [b.id for b in index.search_substring('ove')],
+            'fuzzy': [b.id for b in index.search_fuzzy('belovd')],
+            'bounds': index.year_bounds(1900, 1970),
+        }
+
+    def test_patches_match_full_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            dune = self.books[0]
+            dune.title, dune.year = 'Jonathan Strange', 1990
+            dune.save()
+            Book.objects.create(title='Love Medicine', author='Louise Erdrich', year=1984, quantity=2)
+            self.books[1].delete()
+        with mock.patch.object(catalog_index, 'load_records') as load:
+            index = get_catalog()
+        load.assert_not_called()
+        self.assertEqual(index.version, current_version())
+
+        fresh = CatalogIndex()
+        fresh.rebuild()
+        self.assertEqual(self.snapshot(index), self.snapshot(fresh))
+        self.assertEqual(len(self.snapshot(index)['substring']), 2)
+
+    def test_missed_change_rebuilds(self):
+        # A save this process never saw (another worker's) leaves it stale.
+        with self.captureOnCommitCallbacks(execute=False):
+            Book.objects.create(title='Middlemarch', author='George Eliot', year=1871, quantity=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[2].delete()
+        self.assertNotEqual(catalog.version, current_version())
+        index = get_catalog()
+        self.assertEqual(index.version, current_version())
+        self.assertEqual([b.title for b in index.search_prefix('middle')], ['Middlemarch'])
+        self.assertNotIn(self.books[2].pk, index.by_id)
+
+
+#KEYSET PAGINATION
+class CatalogPagingTests(TestCase):
+    MODES = [
+        {'sort': 'title'},
+        {'sort': 'title', 'dir': 'desc'},
+        {'sort': 'year'},
+        {'sort': 'year', 'dir': 'desc'},
+        {'year_from': '1991', 'year_to': '1992'},
+        {'sort': 'popular'},
+        {'q': 'wr', 'type': 'prefix'},
+        {'q': 'tor', 'type': 'substring'},
+        {'q': 'storu', 'type': 'fuzzy'},
+    ]
+
+    def setUp(self):
+        # Repeated titles, years and borrow counts, so pages split inside ties.
+        for i in range(25):
+            book = Book.objects.create(title=f'Story {i % 7}', author=f'Writer {i}', year=1990 + i % 4, quantity=1)
+            BookStats.objects.create(book=book, borrow_count=i % 5 + 1)
+        forget_catalog()
+        self.index = get_catalog()
+
+    def walk(self, params, first, direction):
+        """Pages from `first` on, following next_cursor (after) or prev_cursor (before)."""
+        pages = [first]
+        while True:
+            cursor = pages[-1].next_cursor if direction == 'after' else pages[-1].prev_cursor
+            if not cursor:
+                return pages
+            page, _, _ = catalog_page(self.index, {**params, direction: cursor}, per_page=4)
+            pages.append(page)
+
+    def test_forward_and_back_in_every_mode(self):
+        for params in self.MODES:
+            with self.subTest(**params):
+                everything, _, _ = catalog_page(self.index, params, per_page=100)
+                first, _, _ = catalog_page(self.index, params, per_page=4)
+                self.assertIsNone(first.prev_cursor)
+                pages = self.walk(params, first, 'after')
+                forward = [[b.id for b in page.items] for page in pages]
+                self.assertGreater(len(forward), 2)
+                self.assertEqual(sum(forward, []), [b.id for b in everything.items])
+
+                backward = [[b.id for b in page.items] for page in self.walk(params, pages[-1], 'before')]
+                self.assertEqual(backward, forward[::-1])
+
+    def test_cursor_from_another_mode_starts_over(self):
+        by_year, _, _ = catalog_page(self.index, {'sort': 'year'}, per_page=4)
+        first, _, _ = catalog_page(self.index, {'sort': 'title'}, per_page=4)
+        page, _, _ = catalog_page(self.index, {'sort': 'title', 'after': by_year.next_cursor}, per_page=4)
+        self.assertEqual(page.items, first.items)
+
+
+#LISTING CACHE
+class ListingCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        forget_catalog()
+        self.user = User.objects.create_user('reader', password='pass12345')
+        self.client.login(username='reader', password='pass12345')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book = Book.objects.create(title='Dune', author='Frank Herbert', year=1965, quantity=1)
+            Book.objects.create(title='Emma', author='Jane Austen', year=1815, quantity=1)
+
+    def stats(self, kind):
+        return cache.get(f'stats:{kind}:hits', 0), cache.get(f'stats:{kind}:misses', 0)
+
+    def test_results_cached_until_a_book_changes(self):
+        self.client.get('/?sort=title')
+        self.client.get('/?sort=title')
+        self.assertEqual(self.stats('results'), (1, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.title = 'Children of Dune'
+            self.book.save()
+        response = self.client.get('/?sort=title')
+        self.assertEqual(self.stats('results'), (1, 2))
+        self.assertContains(response, 'Children of Dune')
+        self.assertNotContains(response, '<strong>Dune</strong>')
+
+    def test_cards_follow_stock(self):
+        self.assertContains(self.client.get('/'), 'Stock: 1 / 1 Available', count=2)
+        self.assertEqual(self.stats('cards'), (0, 2))
+        borrow_copy(self.user, self.book)
+        response = self.client.get('/')
+        self.assertContains(response, 'Stock: 0 / 1 Available', count=1)
+        # Only the borrowed book's card was rendered again.
+        self.assertEqual(self.stats('cards'), (1, 3))
+
+
+#YEAR INDEX
+def record(id, title, year=2000, author='A'):
+    return BookRecord(id, title, author, year, 1, 1, '')
+
+
+class AVLTreeTests(TestCase):
+    def setUp(self):
+        rng = random.Random(5)
+        self.books = {i: record(i, f'Book {i}', rng.randrange(1900, 2000)) for i in range(400)}
+        self.tree = AVLTree(year_key, list(self.books.values())[:200])
+        for i in rng.sample(range(400), 400):
+            # Churn: add the second half and drop a random third, interleaved.
+            if i >= 200:
+                self.tree.add(self.books[i])
+            elif i % 3 == 0:
+                self.tree.remove(self.books[i])
+                del self.books[i]
+        self.expected = sorted(self.books.values(), key=year_key)
+
+    def height(self, node):
+        if node is None:
+            return 0
+        left, right = self.height(node.left), self.height(node.right)
+        self.assertLessEqual(abs(left - right), 1)
+        return max(left, right) + 1
+
+    def test_order_and_balance(self):
+        self.assertEqual(len(self.tree), len(self.expected))
+        self.assertEqual(list(self.tree), self.expected)
+        self.assertEqual(list(self.tree.descending()), self.expected[::-1])
+        self.assertLessEqual(self.height(self.tree.root), 1.45 * len(self.expected).bit_length())
+
+    def test_rank_and_kth(self):
+        for k in (0, 1, len(self.expected) // 2, len(self.expected) - 1, -1):
+            self.assertIs(self.tree.kth(k), self.expected[k])
+        with self.assertRaises(IndexError):
+            self.tree.kth(len(self.expected))
+        keys = [year_key(book) for book in self.expected]
+        for key in (keys[0], keys[57], (1950, -1), (1950, 10 ** 9), (1800, 0), (2100, 0)):
+            self.assertEqual(self.tree.rank_left(key), sum(k < key for k in keys))
+            self.assertEqual(self.tree.rank_right(key), sum(k <= key for k in keys))
+
+    def test_range(self):
+        got = self.tree.range((1940, -1), (1960, -1))
+        self.assertEqual(got, [book for book in self.expected if 1940 <= book.year < 1960])
+        self.assertEqual(self.tree.range((1960, -1), (1940, -1)), [])
+        self.assertEqual(self.tree.slice(10, 15), self.expected[10:15])
+
+    def test_sorted_input_and_replace(self):
+        tree = AVLTree(year_key)
+        for i in range(1000):
+            tree.add(record(i, 'x', 1900 + i))
+        self.assertLessEqual(self.height(tree.root), 15)
+        tree.add(record(5, 'replaced', 1905))
+        self.assertEqual(len(tree), 1000)
+        self.assertEqual(tree.kth(5).title, 'replaced')
+        tree.remove(record(10 ** 6, 'missing', 1905))
+        self.assertEqual(len(tree), 1000)
+
+
+#SORTING
+class MergeSortTests(TestCase):
+    def setUp(self):
+        rng = random.Random(6)
+        authors = ['Austen', 'austen', 'Borges', 'Calvino']
+        self.books = [
+            record(i, rng.choice(['Emma', 'emma', 'Dune', 'Ulysses']), rng.randrange(1990, 1995), rng.choice(authors))
+            for i in range(300)
+        ]
+
+    def expected(self, spec):
+        # Reference: Python's stable sort, least significant key first.
+        books = list(self.books)
+        for field, descending in reversed(spec):
+            books.sort(key=lambda b: algo.sort_value(getattr(b, field)), reverse=descending)
+        return books
+
+    def check(self, backend):
+        cases = [
+            ('title', [('title', False)]),
+            (['author', ('year', True)], [('author', False), ('year', True)]),
+            ([('year', True), 'title'], [('year', True), ('title', False)]),
+            (['title', 'author'], [('title', False), ('author', False)]),
+        ]
+        for key, spec in cases:
+            with self.subTest(key=key, backend=backend):
+                got = merge_sort(self.books, key, backend=backend)
+                # Identity, not just order of keys: ties must keep input order.
+                self.assertEqual([b.id for b in got], [b.id for b in self.expected(spec)])
+        reversed_spec = [('author', True), ('year', False)]
+        got = merge_sort(self.books, ['author', ('year', True)], reverse=True, backend=backend)
+        self.assertEqual([b.id for b in got], [b.id for b in self.expected(reversed_spec)])
+
+    def test_python_backend(self):
+        self.check('python')
+
+    @skipIf(algo.np is None, "numpy not installed")
+    def test_numpy_backend(self):
+        self.check('numpy')
+
+    def test_top_k_matches_sort(self):
+        by_year = sorted(self.books, key=lambda b: b.year)
+        self.assertEqual([b.year for b in top_k(self.books, 7, key='year')], [b.year for b in by_year[:7]])
+        self.assertEqual([b.year for b in top_k(self.books, 7, key='year', reverse=True)], [b.year for b in by_year[::-1][:7]])
+        titles = [b.title for b in top_k(self.books, 300, key='title')]
+        self.assertEqual(titles, sorted((b.title for b in self.books), key=str.lower))
+        self.assertEqual(top_k(self.books, 0), [])
+        self.assertEqual(top_k([3, 1, 2], 2, key=None), [1, 2])
+
+
+#LARGE SORTS
+class LargeSortTests(TestCase):
+    def setUp(self):
+        rng = random.Random(22)
+        self.books = [record(i, rng.choice(['Emma', 'Dune', 'Ulysses', 'Beloved']), rng.randrange(1990, 1996)) for i in range(500)]
+        self.key = ['title', ('year', True)]
+        self.expected = [b.id for b in merge_sort(self.books, self.key)]
+
+    def test_parallel_sort_matches_merge_sort(self):
+        got = large_sort.parallel_sort(self.books, self.key, workers=3, min_size=0)
+        self.assertEqual([b.id for b in got], self.expected)
+        got = large_sort.parallel_sort(self.books, 'year', reverse=True, workers=2, min_size=0)
+        self.assertEqual([b.id for b in got], [b.id for b in merge_sort(self.books, 'year', reverse=True)])
+
+    def spilled_sort(self, **kwargs):
+        files = []
+
+        def spill(items, directory=None):
+            f = spill_run(items, directory)
+            files.append(f)
+            return f
+
+        spill_run = large_sort.spill
+        with mock.patch.object(large_sort, 'spill', spill):
+            got = [b.id for b in large_sort.external_sort(iter(self.books), self.key, run_size=60, **kwargs)]
+        return got, files
+
+    def test_external_sort_spills_runs(self):
+        got, files = self.spilled_sort()
+        self.assertEqual(got, self.expected)
+        self.assertEqual(len(files), 9)
+        self.assertTrue(all(f.closed for f in files))
+
+    def test_external_sort_merges_in_passes(self):
+        with mock.patch.object(large_sort, 'MERGE_FAN_IN', 3):
+            got, files = self.spilled_sort()
+        self.assertEqual(got, self.expected)
+        self.assertTrue(all(f.closed for f in files))
+
+    def test_external_sort_single_run_stays_in_memory(self):
+        with mock.patch.object(large_sort, 'spill') as spill:
+            got = list(large_sort.external_sort(self.books[:50], 'title', run_size=60))
+        spill.assert_not_called()
+        self.assertEqual([b.id for b in got], [b.id for b in merge_sort(self.books[:50], 'title')])
+
+
+#SUBSTRING SEARCH
+class NgramIndexTests(TestCase):
+    def setUp(self):
+        self.index = NgramIndex(items=[(1, 'dune', 'frank herbert'), (2, 'emma', 'jane austen'), (3, 'ulysses', 'james joyce')])
+
+    def test_trigram_query(self):
+        self.assertEqual(sorted(self.index.ranked('erbe')), [(1, 7, 13, 1)])
+
+    def test_short_queries_scan_texts(self):
+        self.assertEqual(self.index.search('ja'), [2, 3])
+        self.assertEqual(self.index.search('m'), [2, 3])
+        self.assertEqual(self.index.search('q'), [])
+
+    def test_add_and_remove(self):
+        self.index.add(4, 'dunes', 'someone')
+        self.index.remove(1)
+        self.assertEqual(self.index.search('dun'), [4])
+        self.assertNotIn('fra', self.index.postings)
+        self.index.add(1, 'dune', 'frank herbert')
+        self.assertEqual(list(self.index.postings['dun']), [1, 4])
+
+
+#FUZZY SEARCH
+class FuzzySearchTests(TestCase):
+    def setUp(self):
+        Book.objects.create(title='Dune', author='Frank Herbert', year=1965, quantity=1)
+        Book.objects.create(title='Emma', author='Jane Austen', year=1815, quantity=1)
+        self.index = CatalogIndex()
+        self.index.rebuild()
+
+    def test_tree_built_on_first_fuzzy_search(self):
+        self.assertIsNone(self.index.fuzzy.tree)
+        self.assertEqual([book.title for book in self.index.search_fuzzy('dunne')], ['Dune'])
+        self.assertIsNotNone(self.index.fuzzy.tree)
+
+    def test_removed_words_stop_matching(self):
+        self.index.search_fuzzy('emma')
+        book = Book.objects.get(title='Emma')
+        self.index.fuzzy.remove(book.id)
+        self.assertEqual(self.index.search_fuzzy('emma'), [])
+
+
+#QUANTITY EDITS
+class QuantityTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pass12345')
+        self.book = Book.objects.create(title='Emma', author='Jane Austen', year=1815, quantity=3)
+        borrow_copy(self.user, self.book)
+
+    def test_raising_quantity_adds_copies(self):
+        self.book.quantity = 5
+        self.book.save()
+        self.assertEqual(stock(self.book), 4)
+        self.assertEqual(self.book.available, 4)
+
+    def test_lowering_quantity_removes_copies(self):
+        self.book.quantity = 2
+        self.book.save()
+        self.assertEqual(stock(self.book), 1)
+
+    def test_stale_instance_keeps_concurrent_borrows(self):
+        # Loaded before someone else borrowed: saving it mustn't undo that loan.
+        stale = Book.objects.get(pk=self.book.pk)
+        borrow_copy(User.objects.create_user('other', password='pass12345'), self.book)
+        stale.title = 'Emma (annotated)'
+        stale.save()
+        self.assertEqual(stock(self.book), 1)
+        self.assertEqual(stale.available, 1)
+
+    def test_quantity_below_active_loans_rejected(self):
+        borrow_copy(User.objects.create_user('other', password='pass12345'), self.book)
+        self.book.refresh_from_db()
+        self.book.quantity = 1
+        with self.assertRaises(ValidationError) as caught:
+            self.book.full_clean()
+        self.assertIn('quantity', caught.exception.message_dict)
+        with self.assertRaises(IntegrityError):
+            self.book.save()
+        self.assertEqual(Book.objects.get(pk=self.book.pk).quantity, 3)
+
+    def test_quantity_down_to_active_loans_allowed(self):
+        self.book.quantity = 1
+        self.book.full_clean()
+        self.book.save()
+        self.assertEqual(stock(self.book), 0)
+
+    def test_editing_available_directly_raises(self):
+        book = Book.objects.get(pk=self.book.pk)
+        book.available = 3
+        with self.assertRaises(ValueError):
+            book.save()
+        self.assertEqual(stock(self.book), 2)
+
+    def test_update_fields_save_leaves_available_alone(self):
+        self.book.quantity = 10
+        self.book.save(update_fields=['quantity'])
+        self.assertEqual(stock(self.book), 2)
+
+
+#OVERDUE
+class OverdueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pass12345')
+        self.book = Book.objects.create(title='Dune', author='Frank Herbert', year=1965, quantity=2)
+        self.other = Book.objects.create(title='Emma', author='Jane Austen', year=1815, quantity=1)
+        self.late = borrow_copy(self.user, self.book)
+        self.fresh = borrow_copy(self.user, self.other)
+        self.expire(self.late)
+
+    def expire(self, loan):
+        expired = timezone.now() - timedelta(seconds=BORROW_SECONDS + 60)
+        Borrowing.objects.filter(pk=loan.pk).update(borrowed_at=expired)
+        loan.refresh_from_db()
+
+    def test_expired_loan_is_overdue_before_the_sweep(self):
+        self.assertEqual(self.late.status, Borrowing.ACTIVE)
+        self.assertTrue(self.late.is_overdue)
+        self.assertFalse(self.fresh.is_overdue)
+
+    def test_my_books_shows_expired_loan_as_overdue(self):
+        self.client.force_login(self.user)
+        content = self.client.get(reverse('my_books')).content.decode()
+        self.assertIn('OVERDUE', content)
+        self.assertEqual(content.count('Time Remaining'), 1)
+
+    def test_sweep_marks_only_expired_loans(self):
+        self.assertEqual(sweep_overdue(), 1)
+        self.assertEqual(Borrowing.objects.get(pk=self.late.pk).status, Borrowing.OVERDUE)
+        self.assertEqual(Borrowing.objects.get(pk=self.fresh.pk).status, Borrowing.ACTIVE)
+        self.assertEqual(sweep_overdue(), 0)
+
+    def test_sweep_auto_return_restocks(self):
+        self.assertEqual(sweep_overdue(auto_return=True), 1)
+        self.assertFalse(Borrowing.objects.filter(pk=self.late.pk).exists())
+        self.assertEqual(stock(self.book), 2)
+        self.assertEqual(stock(self.other), 0)
+
+    def test_sweep_in_batches(self):
+        for name in ('a', 'b', 'c'):
+            self.expire(Borrowing.objects.create(user=User.objects.create_user(name), book=self.book))
+        self.assertEqual(sweep_overdue(batch_size=2), 4)
+        self.assertEqual(Borrowing.objects.filter(status=Borrowing.OVERDUE).count(), 4)
+
+    def test_return_loans_records_returns_and_hands_over(self):
+        waiter = User.objects.create_user('waiter', password='pass12345')
+        reserve(waiter, self.other)
+        loans = Borrowing.objects.filter(pk__in=[self.late.pk, self.fresh.pk])
+        self.assertEqual(return_loans(loans, batch_size=1), 2)
+        self.assertEqual(list(Borrowing.objects.values_list('user__username', 'book__title')), [('waiter', 'Emma')])
+        self.assertEqual(stock(self.book), 2)
+        self.assertEqual(stock(self.other), 0)
+        self.assertEqual(LoanEvent.objects.filter(kind=LoanEvent.RETURN).count(), 2)
+        roll_up()
+        self.assertEqual(BookStats.objects.get(book=self.book).return_count, 1)
+
+    def test_command_once(self):
+        out = StringIO()
+        call_command('sweep_overdue', stdout=out)
+        self.assertIn('Marked overdue: 1 loan(s).', out.getvalue())
+
+    def test_command_interval_sweeps_until_interrupted(self):
+        out = StringIO()
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 1:
+                self.expire(self.fresh)
+            else:
+                raise KeyboardInterrupt
+
+        with mock.patch('library_app.management.commands.sweep_overdue.time.sleep', sleep):
+            call_command('sweep_overdue', '--interval', '30', '--auto-return', stdout=out)
+        self.assertEqual(sleeps, [30, 30])
+        self.assertEqual(out.getvalue().count('Returned: 1 loan(s).'), 2)
+        self.assertFalse(Borrowing.objects.exists())
+
+    def test_command_rejects_bad_batch_size(self):
+        with self.assertRaises(CommandError):
+            call_command('sweep_overdue', '--batch-size', '0')
+
+
+#LOAN STATS
+class LoanStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pass12345')
+        self.book = Book.objects.create(title='Dune', author='Frank Herbert', year=1965, quantity=2)
+
+    def test_borrow_only_writes_an_event(self):
+        with CaptureQueriesContext(connection) as queries:
+            borrow_copy(self.user, self.book)
+        self.assertFalse(any('library_app_bookstats' in q['sql'] or 'library_app_loancounter' in q['sql']
+                             for q in queries.captured_queries))
+        self.assertFalse(LoanEvent.objects.get().rolled_up)
+        self.assertFalse(BookStats.objects.exists())
+
+    def test_roll_up_counts_each_event_once(self):
+        loans = [borrow_copy(self.user, self.book), borrow_copy(User.objects.create_user('other'), self.book)]
+        return_copy(loans[0])
+        self.assertEqual(roll_up(batch_size=2), 3)
+        self.assertEqual(roll_up(), 0)
+        stats = BookStats.objects.get(book=self.book)
+        self.assertEqual((stats.borrow_count, stats.return_count), (2, 1))
+        for period in (LoanCounter.HOUR, LoanCounter.DAY, LoanCounter.ALL):
+            counter = LoanCounter.objects.get(period=period)
+            self.assertEqual((counter.borrows, counter.returns), (2, 1))
+        self.assertFalse(LoanEvent.objects.filter(rolled_up=False).exists())
+
+    def test_reports_roll_up_first(self):
+        borrow_copy(self.user, self.book)
+        dashboard = loan_dashboard()
+        self.assertEqual(dashboard['totals'].borrows, 1)
+        self.assertEqual([s.book_id for s in dashboard['popular']], [self.book.pk])
+
+    def test_commands_roll_up(self):
+        borrow_copy(self.user, self.book)
+        call_command('sweep_overdue', stdout=StringIO())
+        self.assertEqual(BookStats.objects.get(book=self.book).borrow_count, 1)
+        borrow_copy(User.objects.create_user('other'), self.book)
+        out = StringIO()
+        call_command('reconcile_stock', stdout=out)
+        self.assertIn('Rolled up 1 loan event(s).', out.getvalue())
+
+
+#RECONCILE
+class ReconcileStockTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pass12345')
+        self.book = Book.objects.create(title='Ulysses', author='James Joyce', year=1922, quantity=3)
+        self.other = Book.objects.create(title='Beloved', author='Toni Morrison', year=1987, quantity=2)
+        borrow_copy(self.user, self.book)
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_stock', *args, stdout=out)
+        return out.getvalue()
+
+    def test_fixes_drifted_counter(self):
+        Book.objects.filter(pk=self.book.pk).update(available=0)
+        output = self.reconcile()
+        self.assertEqual(stock(self.book), 2)
+        self.assertEqual(stock(self.other), 2)
+        self.assertIn('Reconciled 1 book(s).', output)
+
+    def test_dry_run_changes_nothing(self):
+        Book.objects.filter(pk=self.book.pk).update(available=0)
+        output = self.reconcile('--dry-run')
+        self.assertEqual(stock(self.book), 0)
+        self.assertIn('expected=2', output)
+
+    def test_nothing_to_fix(self):
+        self.assertIn('Reconciled 0 book(s).', self.reconcile())
+        self.assertEqual(stock(self.book), 2)
+
+
+#ADMIN
+class BookAdminTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_superuser('staff', password='pass12345')
+        self.reader = User.objects.create_user('reader', password='pass12345')
+        self.waiter = User.objects.create_user('waiter', password='pass12345')
+        self.book = Book.objects.create(title='Dune', author='Frank Herbert', year=1965, quantity=1)
+        self.kept = Book.objects.create(title='Emma', author='Jane Austen', year=1815, quantity=1)
+        borrow_copy(self.reader, self.book)
+        borrow_copy(self.reader, self.kept)
+        reserve(self.waiter, self.book)
+
+    def test_bulk_delete_returns_loans_first(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            admin.site._registry[Book].delete_queryset(None, Book.objects.filter(pk=self.book.pk))
+        self.assertFalse(Book.objects.filter(pk=self.book.pk).exists())
+        self.assertEqual(list(Borrowing.objects.values_list('book_id', flat=True)), [self.kept.pk])
+        self.assertFalse(Reservation.objects.exists())
+        self.assertFalse(BookStats.objects.filter(book_id=self.book.pk).exists())
+        returns = LoanEvent.objects.filter(kind=LoanEvent.RETURN)
+        self.assertEqual(returns.count(), 1)
+        self.assertIsNone(returns.get().book_id)
+        self.assertEqual(LoanEvent.objects.filter(kind=LoanEvent.BORROW, user=self.waiter).count(), 0)
+
+    def test_available_is_read_only(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('admin:library_app_book_change', args=[self.book.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('name="available"', response.content.decode())
+
+
+#PDF DELIVERY
+class ParseRangeTests(TestCase):
+    def test_ranges(self):
+        cases = [
+            ('bytes=0-99', (0, 99)),
+            ('bytes=100-', (100, 1023)),
+            ('bytes=1000-5000', (1000, 1023)),
+            ('bytes=-100', (924, 1023)),
+            ('bytes=-5000', (0, 1023)),
+            ('bytes=-0', 'invalid'),
+            ('bytes=1024-', 'invalid'),
+            ('bytes=50-10', 'invalid'),
+            ('bytes=-', None),
+            ('bytes=0-1,5-6', None),
+            ('items=0-1', None),
+        ]
+        for header, expected in cases:
+            with self.subTest(header=header):
+                self.assertEqual(parse_range(header, 1024), expected)
+
+
+class ReadBookTests(TestCase):
+    CONTENT = bytes(range(256)) * 4
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        media_settings = self.settings(MEDIA_ROOT=media, PDF_SENDFILE_MODE=None)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        os.mkdir(os.path.join(media, 'books'))
+        with open(os.path.join(media, 'books', 'dune.pdf'), 'wb') as f:
+            f.write(self.CONTENT)
+
+        self.user = User.objects.create_user('reader', password='pass12345')
+        self.book = Book.objects.create(title='Dune', author='Frank Herbert', year=1965, quantity=1, pdf_stub='books/dune.pdf')
+        self.client.login(username='reader', password='pass12345')
+        self.url = reverse('read_book', args=[self.book.id])
+
+    def test_needs_an_active_loan(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        borrow_copy(self.user, self.book)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+
+    def test_listing_links_the_pdf_for_borrowers(self):
+        cache.clear()
+        forget_catalog()
+        self.assertNotContains(self.client.get('/'), self.url)
+        borrow_copy(self.user, self.book)
+        self.assertContains(self.client.get('/'), self.url)
+        # Not once the loan has run out, even before the sweeper marks it.
+        Borrowing.objects.update(borrowed_at=timezone.now() - timedelta(seconds=BORROW_SECONDS + 1))
+        self.assertNotContains(self.client.get('/'), self.url)
+
+        User.objects.create_user('staff', password='pass12345', is_staff=True)
+        self.client.login(username='staff', password='pass12345')
+        self.assertContains(self.client.get('/'), self.url)
+
+    def test_partial_and_conditional_requests(self):
+        borrow_copy(self.user, self.book)
+        full = self.client.get(self.url)
+        full.close()
+        etag = full['ETag']
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-100')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 924-1023/1024')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[-100:])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE=etag)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[10:20])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+        # A stale validator gets the whole (changed) file, not a slice of it.
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+#IMPORT / EXPORT
+class ImportExportTests(TestCase):
+    BOOKS = [
+        ('Dune', 'Frank Herbert', 1965, 2), ('emma', 'Jane Austen', 1815, 1),
+        ('Emma', 'Jane Austen', 1815, 3), ('Ulysses', 'James Joyce', 1922, 0),
+        ('Beloved', 'Toni Morrison', 1987, 4),
+    ]
+
+    def setUp(self):
+        for title, author, year, quantity in self.BOOKS:
+            Book.objects.create(title=title, author=author, year=year, quantity=quantity)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.directory = directory
+
+    def catalog(self):
+        return sorted(Book.objects.values_list('title', 'author', 'year', 'quantity', 'available'))
+
+    def run_import(self, path, *args):
+        out, err = StringIO(), StringIO()
+        call_command('import_books', path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_round_trip(self):
+        for fmt in ('csv', 'jsonl'):
+            with self.subTest(fmt=fmt):
+                before = self.catalog()
+                path = os.path.join(self.directory, f'books.{fmt}')
+                call_command('export_books', '--format', fmt, '--output', path, stderr=StringIO())
+                Book.objects.all().delete()
+                out, _ = self.run_import(path, '--batch-size', '2')
+                self.assertIn('Imported 5 book(s).', out)
+                self.assertEqual(self.catalog(), before)
+
+                out, _ = self.run_import(path)
+                self.assertIn('duplicates 5', out)
+                self.assertEqual(self.catalog(), before)
+
+    def test_duplicates_and_invalid_rows(self):
+        path = os.path.join(self.directory, 'new.jsonl')
+        with open(path, 'w') as f:
+            for row in [
+                {'title': 'Dune', 'author': 'Frank Herbert', 'year': 1965},
+                {'title': 'Middlemarch', 'author': 'George Eliot', 'year': 1871},
+                {'title': 'Kindred', 'author': 'Octavia Butler', 'year': 1979, 'quantity': 2},
+                {'title': 'Middlemarch', 'author': 'George Eliot', 'year': '1871'},
+                {'title': 'No Year', 'author': 'Anon'},
+                {'title': 'Negative', 'author': 'Anon', 'year': 2000, 'quantity': -1},
+            ]:
+                f.write(json.dumps(row) + '\n')
+            f.write('not json\n')
+        out, err = self.run_import(path, '--batch-size', '2')
+        self.assertIn('read 7, imported 2, duplicates 2, invalid 3', out)
+        self.assertIn('row 7: invalid JSON', err)
+        self.assertEqual(Book.objects.get(title='Kindred').available, 2)
+        self.assertEqual(Book.objects.get(title='Middlemarch').quantity, 3)
+
+    def test_dry_run_counts_like_a_real_import(self):
+        path = os.path.join(self.directory, 'twice.csv')
+        with open(path, 'w') as f:
+            f.write('title,author,year\n' + 'Kindred,Octavia Butler,1979\nDune,Frank Herbert,1965\n' * 3)
+        dry, _ = self.run_import(path, '--batch-size', '2', '--dry-run')
+        self.assertIn('Would import 1 book(s).', dry)
+        self.assertFalse(Book.objects.filter(title='Kindred').exists())
+        real, _ = self.run_import(path, '--batch-size', '2')
+        self.assertIn('Imported 1 book(s).', real)
+        self.assertEqual(dry.splitlines()[-2], real.splitlines()[-2])
+
+    def test_python_sorters_match_database_order(self):
+        Book.objects.create(title='dune', author='Someone Else', year=2001, quantity=1)
+        exports = {}
+        for sorter in ('database', 'external', 'parallel'):
+            for sort in ('title', 'author', 'year'):
+                out = StringIO()
+                call_command('export_books', '--format', 'jsonl', '--sort', sort, '--dir', 'desc',
+                             '--sorter', sorter, '--run-size', '2', '--workers', '1', stdout=out)
+                exports[sorter, sort] = [json.loads(line)['id'] for line in out.getvalue().splitlines()]
+        for sorter in ('external', 'parallel'):
+            for sort in ('title', 'author', 'year'):
+                self.assertEqual(exports[sorter, sort], exports['database', sort], (sorter, sort))
+
+
+#COMPRESSION
+class CompressionTests(TestCase):
+    BODY = b'<p>' + b'The spice must flow. ' * 50 + b'</p>'
+
+    def process(self, response, accept='gzip, deflate, br'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept)
+        return compression.CompressionMiddleware(lambda request: response)(request)
+
+    def test_text_types_are_gzipped(self):
+        for content_type in ('text/html; charset=utf-8', 'application/json', 'Image/SVG+XML', 'text/csv'):
+            with self.subTest(content_type=content_type), mock.patch.object(compression, 'brotli', None):
+                response = self.process(HttpResponse(self.BODY, content_type=content_type))
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_binary_and_small_responses_are_left_alone(self):
+        for content_type in ('application/pdf', 'image/png', 'application/octet-stream', 'application/jsonx'):
+            with self.subTest(content_type=content_type):
+                response = self.process(HttpResponse(self.BODY, content_type=content_type))
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertEqual(response.content, self.BODY)
+        response = self.process(HttpResponse(b'<p>short</p>', content_type='text/html'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        pdf = FileResponse(StringIO('%PDF' + 'x' * 1000), content_type='application/pdf')
+        response = self.process(pdf)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIs(response, pdf)
+
+    def test_brotli_when_installed_and_accepted(self):
+        fake = mock.Mock()
+        fake.compress.return_value = b'tiny'
+        with mock.patch.object(compression, 'brotli', fake):
+            response = HttpResponse(self.BODY, content_type='text/html')
+            response['ETag'] = '"abc"'
+            response = self.process(response)
+            self.assertEqual((response['Content-Encoding'], response.content, response['ETag']), ('br', b'tiny', 'W/"abc"'))
+            self.assertEqual(response['Content-Length'], '4')
+            # Not accepted: gzip as usual.
+            response = self.process(HttpResponse(self.BODY, content_type='text/html'), accept='gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+
+
+#API
+class BorrowingsApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pass12345')
+        for title in ('Dune', 'Emma', 'Ulysses'):
+            borrow_copy(self.user, Book.objects.create(title=title, author='Someone', year=1900, quantity=1))
+        self.client.force_login(self.user)
+
+    def page(self, **params):
+        response = self.client.get(reverse('api_my_borrowings'), {'limit': 2, **params})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_pages_through_loans(self):
+        first = self.page()
+        self.assertEqual(len(first['results']), 2)
+        self.assertIsNone(first['prev'])
+        second = self.page(after=first['next'])
+        self.assertEqual(len(second['results']), 1)
+        self.assertIsNone(second['next'])
+        self.assertEqual(self.page(before=second['prev'])['results'], first['results'])
+
+    def test_malformed_cursor_gives_first_page(self):
+        first = self.page()
+        for cursor in ([1, 2, 3], ['not a date', 1], [5]):
+            page = self.page(after=encode_cursor(cursor))
+            self.assertEqual(page['results'], first['results'])
+            self.assertIsNone(page['prev'])
+
+
+#PERF
+class PerfTests(TestCase):
+    def setUp(self):
+        Book.objects.create(title='Dune', author='Frank Herbert', year=1965, quantity=1)
+        self.user = User.objects.create_user('staff', password='pass12345', is_staff=True)
+        self.client.force_login(self.user)
+
+    def test_server_timing_breaks_down_index_calls(self):
+        timing = self.client.get(reverse('library_home'), {'q': 'dun', 'type': 'prefix'})['Server-Timing']
+        self.assertIn('algo.CatalogIndex.ranked_prefix', timing)
+        self.assertIn('algo.ranked_page', timing)
+
+    def test_stats_page_lists_views(self):
+        self.client.get(reverse('my_books'))
+        self.assertContains(self.client.get(reverse('perf_stats')), 'my_books')
+
+
+#MIGRATIONS
+class BackfillAvailableTests(TestCase):
+    def test_fill_available_counts_active_loans(self):
+        user = User.objects.create_user('reader', password='pass12345')
+        book = Book.objects.create(title='Ulysses', author='James Joyce', year=1922, quantity=3)
+        untouched = Book.objects.create(title='Beloved', author='Toni Morrison', year=1987, quantity=2)
+        Borrowing.objects.create(user=user, book=book)
+        Borrowing.objects.create(user=user, book=book)
+        Book.objects.update(available=3)
+
+        migration = import_module('library_app.migrations.0005_book_available')
+        migration.fill_available(apps, None)
+        self.assertEqual(stock(book), 1)
+        self.assertEqual(stock(untouched), 2)
+
+
+#CACHED USERS
+@override_settings(
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+    AUTHENTICATION_BACKENDS=['library_app.backends.CachedModelBackend'],
+)
+class CachedUserTests(TestCase):
+    def setUp(self):
+        user_cache().clear()
+        self.user = User.objects.create_user('reader', password='pass12345')
+        self.client.login(username='reader', password='pass12345')
+        self.client.get(reverse('my_books'))
+
+    def test_user_served_from_cache(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('my_books')).status_code, 200)
+        self.assertFalse([q for q in queries.captured_queries if 'auth_user' in q['sql']])
+
+    def test_password_hash_not_cached(self):
+        fields, values, _ = user_cache().get(user_key(self.user.pk))
+        self.assertNotIn('password', fields)
+        self.assertNotIn(self.user.password, values)
+
+    def test_deactivation_logs_out(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('my_books')).status_code, 302)
+
+    def test_password_change_ends_cached_sessions(self):
+        self.user.set_password('new-pass-678')
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('my_books')).status_code, 302)
+
+
+#CATALOG SNAPSHOT
+class SnapshotFallbackTests(TransactionTestCase):
+    # Committed rows, so the background rebuild's own connection sees them.
+    def setUp(self):
+        cache.clear()
+        Book.objects.create(title='Dune', author='Frank Herbert', year=1965, quantity=1)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'catalog.snapshot')
+        self.addCleanup(setattr, snapshot, '_current', None)
+        self.addCleanup(setattr, snapshot, '_failed_version', None)
+        self.addCleanup(setattr, snapshot, '_rebuilder', None)
+        auto = self.settings(CATALOG_SNAPSHOT='auto', CATALOG_SNAPSHOT_PATH=self.path)
+        auto.enable()
+        self.addCleanup(auto.disable)
+
+    def test_auto_mode_builds_snapshot_in_background(self):
+        # Nothing to serve yet: this process's own index meanwhile.
+        self.assertIsInstance(get_catalog(), CatalogIndex)
+        snapshot._rebuilder.join()
+        index = get_catalog()
+        self.assertIsInstance(index, snapshot.SnapshotCatalog)
+        self.assertEqual(index.version, current_version())
+
+    def test_stale_snapshot_served_while_rebuilding(self):
+        snapshot.build(self.path)
+        old = get_catalog()
+        self.assertIsInstance(old, snapshot.SnapshotCatalog)
+        Book.objects.create(title='Emma', author='Jane Austen', year=1815, quantity=1)
+
+        with mock.patch.object(snapshot, 'start_rebuild') as start_rebuild:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertIs(get_catalog(), old)
+            # Just the version check: the Book table is read by the rebuild.
+            self.assertEqual(len(queries), 1)
+            start_rebuild.assert_called_once_with(self.path, current_version())
+
+            self.client.force_login(User.objects.create_user('reader'))
+            response = self.client.get('/')
+            self.assertContains(response, 'Dune')
+            self.assertFalse(response.has_header('ETag'))
+
+        snapshot.start_rebuild(self.path, current_version())
+        snapshot._rebuilder.join()
+        fresh = get_catalog()
+        self.assertEqual(fresh.version, current_version())
+        self.assertEqual(len(fresh.by_id), 2)
+        self.assertTrue(self.client.get('/').has_header('ETag'))
+
+    def test_failed_replace_falls_back_to_index(self):
+        # What Windows does while another worker has the old file mapped.
+        with mock.patch.object(snapshot.os, 'replace', side_effect=PermissionError) as replace, \
+                self.assertLogs('library_app.snapshot', 'WARNING'):
+            self.assertIsInstance(get_catalog(), CatalogIndex)
+            snapshot._rebuilder.join()
+            self.assertIsInstance(get_catalog(), CatalogIndex)
+        self.assertEqual(replace.call_count, 1)
+        # The temporary file was cleaned up.
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['catalog.snapshot.lock'])
+
+
+#ASYNC VIEWS
+@override_settings(ROOT_URLCONF=urlconf_with(async_views))
+class AsyncCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        forget_catalog()
+        self.user = User.objects.create_user('reader', password='pass12345')
+        Book.objects.create(title='Zeta', author='A', year=2000, quantity=1)
+        Book.objects.create(title='Alpha', author='B', year=1990, quantity=2)
+
+    async def test_only_sorting_runs_on_cpu_pool(self):
+        pooled = []
+        run_cpu = async_views.run_cpu
+
+        async def record(func, *args):
+            pooled.append(func.__name__)
+            return await run_cpu(func, *args)
+
+        await self.async_client.aforce_login(self.user)
+        with mock.patch.object(async_views, 'run_cpu', record):
+            first = await self.async_client.get('/?sort=title')
+            second = await self.async_client.get('/?sort=title')
+        self.assertEqual(pooled, ['catalog_page'])
+        for response in (first, second):
+            body = response.content.decode()
+            self.assertLess(body.index('Alpha'), body.index('Zeta'))
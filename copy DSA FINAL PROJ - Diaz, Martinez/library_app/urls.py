@@ -1,15 +1,25 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views, api
+
+
+def flow_patterns(module):
+    # Catalog and borrow flows, from either views or async_views.
+    return [
+        path('', module.library_home, name='library_home'),
+        path('borrow/<int:book_id>/', module.borrow_book, name='borrow_book'),
+        path('my-books/', module.my_books, name='my_books'),
+        path('return-book/<int:borrowing_id>/', module.return_book, name='return_book'),
+    ]
 
-from django.urls import path
-from . import views
 
-urlpatterns = [
-    path('', views.library_home, name='library_home'),
+urlpatterns = flow_patterns(async_views if settings.LIBRARY_ASYNC_VIEWS else views) + [
     path('signup/', views.signup, name='signup'),
-    path('borrow/<int:book_id>/', views.borrow_book, name='borrow_book'),
-    path('my-books/', views.my_books, name='my_books'),
     path('add-book/', views.add_book, name='add_book'),
     path('delete-book/<int:book_id>/', views.delete_book, name='delete_book'),
-    path('return-book/<int:borrowing_id>/', views.return_book, name='return_book'),
-]
\ No newline at end of file
+    path('read/<int:book_id>/', views.read_book, name='read_book'),
+    path('leave-waitlist/<int:reservation_id>/', views.leave_waitlist, name='leave_waitlist'),
+    path('api/books/', api.book_list, name='api_book_list'),
+    path('api/my-borrowings/', api.my_borrowings, name='api_my_borrowings'),
+    path('api/waitlist/<int:book_id>/', api.waitlist_position, name='api_waitlist_position'),
+]
@@ -1,11 +1,26 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
+from django.contrib import messages
+from django.core.exceptions import PermissionDenied
+from django.conf import settings
+from django.http import Http404
+from django.middleware.csrf import get_token
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from django import forms  
-from .models import Book, Borrowing
+from datetime import timedelta
+from .models import Book, Borrowing, Reservation, BORROW_SECONDS
 
-from .algo import merge_sort, binary_search, build_id_hash_map, insert_bst, inorder_traversal, reverse_inorder_traversal
+from .analytics import loan_dashboard
+from .cache import cached_catalog_page, digest, render_cards, cache_report
+from .catalog_index import current_versions, get_catalog
+from .listing import parse_year
+from .perf import perf_report, rendering
+from .stock import borrow_or_reserve, cancel_reservation, queue_position, return_copy
+from .streaming import serve_file
 
 class BookForm(forms.ModelForm):
     class Meta:
@@ -39,98 +54,140 @@ def signup(request):
     return render(request, 'registration/signup.html', {'form': form})
 @login_required
 def library_home(request):
-    all_books = list(Book.objects.all())
-    
-    query = request.GET.get('q')
-    search_type = request.GET.get('type') 
-    
-    sort_by = request.GET.get('sort') 
-    direction = request.GET.get('dir', 'asc')
-    
-    books_to_display = []
-    message = ""
-
-
-    if query:
-        if search_type == 'id':
-            try:
-                target_id = int(query)
-                book_map = build_id_hash_map(all_books)
-                if target_id in book_map:
-                    books_to_display = [book_map[target_id]]
-                else:
-                    message = "Book ID not found."
-            except ValueError:
-                message = "Invalid ID."
-        elif search_type == 'title':
-            sorted_books = merge_sort(all_books, key='title')
-            result = binary_search(sorted_books, query)
-            if result:
-                books_to_display = [result]
-            else:
-                books_to_display = [b for b in sorted_books if query.lower() in b.title.lower()]
-                if not books_to_display:
-                    message = "No exact match found."
-                    books_to_display = sorted_books[:5]
+    # This query replaces get_catalog()'s own, and a 304 needs nothing else.
+    version, loan_version = current_versions()
+    etag = page_etag(request, version, loan_version)
+    if etag:
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified:
+            return not_modified
+    index = get_catalog(version)
+    if index.version != version:
+        # An older snapshot, served while the new one is built: don't let
+        # the browser keep this page under the current version's ETag.
+        etag = None
 
+    page, message, sort_by = cached_catalog_page(index, request.GET)
+
+    # The index's copies don't see borrows; read current stock for this page.
+    stock = dict(Book.objects.filter(id__in=[b.id for b in page.items]).values_list('id', 'available'))
+    page.items = apply_stock(page.items, stock)
+    readable = readable_on_page(request.user, page.items)
+
+    context = library_context(request, page, message, sort_by, readable)
+    with rendering():
+        response = render(request, 'library_app/library.html', context)
+    return with_etag(response, etag)
+
+
+def page_etag(request, version, loan_version):
+    """
+    ETag for a catalog page: the page only changes when a book or a loan
+    does, or for a different user / query / CSRF token. None while flash
+    messages are waiting, since those are shown once.
+    """
+    if len(messages.get_messages(request)):
+        return None
+    # The page renders a CSRF token anyway; creating the secret now keeps
+    # the first response's ETag valid once the cookie is set.
+    get_token(request)
+    user = request.user
+    varies = f"{user.pk}:{user.is_staff}:{user.username}:{request.get_full_path()}:{request.META['CSRF_COOKIE']}"
+    return f'W/"catalog-{version}-{loan_version}-{digest(varies)}"'
 
-    else:
-        if sort_by == 'year':
- 
-            root = None
-            for book in all_books:
-                root = insert_bst(root, book)
-            
-            books_to_display = []
-            
-            if direction == 'desc':
-                reverse_inorder_traversal(root, books_to_display)
-                message = "Sorted by Year: Newest First"
-            else:
-                inorder_traversal(root, books_to_display)
-                message = "Sorted by Year: Oldest First"
-
-        elif sort_by == 'title':
-            is_reverse = (direction == 'desc')
-            books_to_display = merge_sort(all_books, key='title', reverse=is_reverse)
-            
-            if is_reverse:
-                message = "Sorted Alphabetically: Z-A"
-            else:
-                message = "Sorted Alphabetically: A-Z"
-        
-        else:
 
-            books_to_display = merge_sort(all_books, key='title')
+def with_etag(response, etag):
+    if etag and response.status_code == 200:
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+    return response
 
 
+def apply_stock(books, stock):
+    return [book.with_available(stock.get(book.id, book.available)) for book in books]
+
+
+def readable_loans(user):
+    # The clock check too: the sweeper may not have marked it yet.
+    active_since = timezone.now() - timedelta(seconds=BORROW_SECONDS)
+    return Borrowing.objects.filter(user=user, status=Borrowing.ACTIVE, borrowed_at__gt=active_since)
+
+
+def readable_on_page(user, books):
+    """Ids of the books whose PDF this user may open (staff can open them all)."""
+    with_pdf = {book.id for book in books if book.pdf_stub}
+    if user.is_staff or not with_pdf:
+        return with_pdf
+    return set(readable_loans(user).filter(book_id__in=with_pdf).values_list('book_id', flat=True))
+
+
+def library_context(request, page, message, sort_by, readable=()):
+    direction = request.GET.get('dir', 'asc')
     next_title_dir = 'desc' if sort_by == 'title' and direction == 'asc' else 'asc'
     next_year_dir = 'asc' if sort_by == 'year' and direction == 'desc' else 'desc'
 
-    return render(request, 'library_app/library.html', {
-        'books': books_to_display, 
+    return {
+        'books': page.items,
+        'cards': render_cards(page.items, request.user.is_staff, readable),
         'message': message,
         'current_sort': sort_by,       
         'current_dir': direction,      
         'next_title_dir': next_title_dir, 
-        'next_year_dir': next_year_dir    
-    })
+        'next_year_dir': next_year_dir,
+        'year_from': parse_year(request.GET.get('year_from')),
+        'year_to': parse_year(request.GET.get('year_to')),
+        'next_query': cursor_query(request, 'after', page.next_cursor),
+        'prev_query': cursor_query(request, 'before', page.prev_cursor),
+    }
+
+
+def cursor_query(request, name, cursor):
+    if not cursor:
+        return ""
+    params = request.GET.copy()
+    params.pop('after', None)
+    params.pop('before', None)
+    params[name] = cursor
+    return params.urlencode()
 
 @login_required
 def borrow_book(request, book_id):
     book = get_object_or_404(Book, id=book_id)
     
-    if book.available_stock > 0:
-        Borrowing.objects.create(user=request.user, book=book)
+    outcome, _, created = borrow_or_reserve(request.user, book)
+    return borrow_redirect(request, book, outcome, created)
+
+
+def borrow_redirect(request, book, outcome, created):
+    if outcome == 'borrowed':
+        messages.success(request, f'You borrowed "{book.title}".')
+        return redirect('library_home')
+    if created:
+        messages.info(request, f'"{book.title}" is out of stock. You are on the waitlist and will get the next copy returned.')
     else:
-        pass 
-        
-    return redirect('library_home')
+        messages.info(request, f'You are already on the waitlist for "{book.title}".')
+    return redirect('my_books')
 
 @login_required
 def my_books(request):
-    borrowed = Borrowing.objects.filter(user=request.user)
-    return render(request, 'library_app/my_books.html', {'borrowed': borrowed})
+    borrowed = list(Borrowing.objects.filter(user=request.user).select_related('book'))
+    waiting = waitlist_for(request.user)
+    with rendering():
+        return render(request, 'library_app/my_books.html', {'borrowed': borrowed, 'waiting': waiting})
+
+
+def waitlist_for(user):
+    reservations = list(Reservation.objects.filter(user=user).select_related('book').order_by('requested_at'))
+    for reservation in reservations:
+        reservation.position = queue_position(reservation)
+    return reservations
+
+
+@login_required
+def leave_waitlist(request, reservation_id):
+    reservation = get_object_or_404(Reservation, id=reservation_id, user=request.user)
+    cancel_reservation(reservation)
+    return redirect('my_books')
 
 
 @login_required
@@ -158,6 +215,47 @@ def delete_book(request, book_id):
 def return_book(request, borrowing_id):
     borrow_record = get_object_or_404(Borrowing, id=borrowing_id, user=request.user)
     
-    borrow_record.delete()
+    return_copy(borrow_record)
     
-    return redirect('my_books')
\ No newline at end of file
+    return redirect('my_books')
+
+
+@login_required
+def read_book(request, book_id):
+    book = get_object_or_404(Book, id=book_id)
+    if not book.pdf_stub:
+        raise Http404("This book has no PDF.")
+
+    if not request.user.is_staff:
+        if not readable_loans(request.user).filter(book=book).exists():
+            raise PermissionDenied("Borrow this book (and return it before it is overdue) to read it.")
+
+    try:
+        return serve_file(request, book.pdf_stub.path, 'application/pdf', accel_name=book.pdf_stub.name)
+    except FileNotFoundError:
+        raise Http404("PDF file is missing.")
+
+
+@staff_member_required
+def cache_stats(request):
+    return render(request, 'admin/library_app/cache_stats.html', {
+        'title': 'Catalog cache',
+        'stats': cache_report(),
+    })
+
+
+@staff_member_required
+def loan_stats(request):
+    return render(request, 'admin/library_app/loan_stats.html', {
+        'title': 'Loan statistics',
+        **loan_dashboard(),
+    })
+
+
+@staff_member_required
+def perf_stats(request):
+    return render(request, 'admin/library_app/perf_stats.html', {
+        'title': 'Request timings',
+        'stats': perf_report(),
+        'window': settings.PERF_WINDOW,
+    })
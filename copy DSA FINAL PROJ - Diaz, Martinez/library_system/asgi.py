@@ -5,6 +5,24 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Deployment profile (uvicorn):
+
+    LIBRARY_ASYNC_VIEWS=1 LIBRARY_CPU_THREADS=4 \
+    uvicorn library_system.asgi:application \
+        --workers 4 --loop uvloop --http httptools \
+        --limit-concurrency 500 --backlog 2048 --timeout-keep-alive 5
+
+- LIBRARY_ASYNC_VIEWS=1 routes library_home, my_books, borrow_book and
+  return_book to library_app.async_views, so slow clients hold a coroutine
+  instead of a worker thread.
+- One worker per core; each worker keeps its own catalog index and thread
+  pool of LIBRARY_CPU_THREADS for sorting/searching.
+- --limit-concurrency answers 503 instead of queueing without bound.
+- Serve /static/ from the front proxy; PDFs can be handed off with
+  PDF_SENDFILE_MODE.
+
+`python manage.py bench --suite asgi` compares this path with the WSGI one.
 """
 
 import os
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its wall time covers every other middleware.
+    'library_app.perf.PerfMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,35 +55,202 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'library_system.urls'
 
+# LIBRARY_RESPONSE_PROFILE=production is about what goes over the wire:
+# gzip (or Brotli, if the brotli package is installed) for HTML and JSON,
+# 304s for pages whose ETag still matches, and hashed static file names so
+# the web server can cache them for a year (see the precompress_static
+# command). It needs `manage.py collectstatic` before the server starts.
+# The catalog page sets its own ETag from the catalog/loan versions;
+# ConditionalGetMiddleware hashes the body of everything else.
+RESPONSE_PROFILE = os.environ.get('LIBRARY_RESPONSE_PROFILE', 'dev')
+
+RESPONSE_PROFILES = {
+    'dev': {
+        'middleware': [],
+        'static_storage': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    'production': {
+        'middleware': [
+            # Above everything that touches the body; below PerfMiddleware
+            # so the perf log still sees the uncompressed size.
+            'library_app.compression.CompressionMiddleware',
+            # Inside the compression, so it hashes the uncompressed body.
+            'django.middleware.http.ConditionalGetMiddleware',
+        ],
+        'static_storage': 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage',
+    },
+}
+
+MIDDLEWARE[1:1] = RESPONSE_PROFILES[RESPONSE_PROFILE]['middleware']
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Each template is compiled once per process. With DEBUG on, the
+            # autoreloader still clears this cache when a template changes.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'library_system.wsgi.application'
+ASGI_APPLICATION = 'library_system.asgi.application'
+
+# Serve the catalog/borrow flows from library_app.async_views. Only worth it
+# under an ASGI server; under WSGI each async view pays for an event loop.
+LIBRARY_ASYNC_VIEWS = os.environ.get('LIBRARY_ASYNC_VIEWS') == '1'
+# Threads for the CPU-bound sorting/searching in the async views.
+LIBRARY_CPU_THREADS = int(os.environ.get('LIBRARY_CPU_THREADS', '4'))
+
+# Catalog snapshot (library_app/snapshot.py): one read-only file every worker
+# mmaps instead of loading the Book table into its own CatalogIndex.
+# LIBRARY_CATALOG_SNAPSHOT picks:
+#   off    - every process builds its own index (the default)
+#   manual - use the file `manage.py build_snapshot` writes (run it after
+#            deploys and imports, or keep it running with --interval); while
+#            it's older than the catalog, processes fall back to their own index
+#   auto   - like manual, but a request that finds the file missing or stale
+#            starts a rebuild on a background thread (one process at a time)
+#            and workers keep serving the old file until the new one is in
+#            place; with no file yet they use their own index meanwhile
+# On Windows a mapped file can't be replaced: while any worker has the old
+# snapshot open, rebuilds fail (logged once per catalog version) and workers
+# use their own index instead. Prefer 'off' there.
+CATALOG_SNAPSHOT = os.environ.get('LIBRARY_CATALOG_SNAPSHOT', 'off')
+CATALOG_SNAPSHOT_PATH = BASE_DIR / 'catalog.snapshot'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# LIBRARY_DB_PROFILE=production is for serving real traffic from several
+# workers: WAL lets readers run alongside the single writer, busy_timeout and
+# IMMEDIATE transactions make concurrent borrows wait for the write lock
+# instead of failing with "database is locked", and connections are reused
+# between requests. The PRAGMAs are applied to every new connection by
+# library_app.signals.configure_sqlite.
+DB_PROFILE = os.environ.get('LIBRARY_DB_PROFILE', 'dev')
+
+SQLITE_PROFILES = {
+    'dev': {
+        'pragmas': {
+            'busy_timeout': 5000,
+        },
+        'options': {},
+        'conn_max_age': 0,
+    },
+    'production': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -32000,  # negative = KiB, so ~32 MB per connection
+            'temp_store': 'MEMORY',
+        },
+        'options': {
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'conn_max_age': 600,
+    },
+}
+
+SQLITE_PRAGMAS = SQLITE_PROFILES[DB_PROFILE]['pragmas']
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': SQLITE_PROFILES[DB_PROFILE]['options'],
+        'CONN_MAX_AGE': SQLITE_PROFILES[DB_PROFILE]['conn_max_age'],
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
 
+# Cache
+# Local-memory cache is LRU; MAX_ENTRIES bounds it per process. Point this at
+# a shared backend (Redis/Memcached) to share entries between workers.
+
+# LIBRARY_SESSION_CACHE=file shares sessions and cached users between worker
+# processes on one machine; locmem is per process, so invalidating a cached
+# user only reaches the process that saved it. Use locmem only with a single
+# worker process (or with the 'db' session profile, which doesn't use it).
+SESSION_CACHES = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'library-sessions',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'sessions',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'library-catalog',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    'sessions': SESSION_CACHES[os.environ.get('LIBRARY_SESSION_CACHE', 'locmem')],
+}
+
+
+# Sessions and the logged-in user
+# Every view is behind @login_required, so with Django's defaults each request
+# reads django_session and auth_user from the same SQLite file borrows write to.
+# LIBRARY_SESSION_PROFILE picks:
+#   db             - those defaults (the default)
+#   cached_db      - sessions read from the 'sessions' cache, written through to
+#                    the database; the user row cached (library_app.backends)
+#   signed_cookies - session data in a signed cookie, no session table at all
+#                    (a copied cookie stays valid until it expires); user cached
+# The cached profiles need a 'sessions' cache all workers share
+# (LIBRARY_SESSION_CACHE=file, or Redis/Memcached): with locmem, deactivating a
+# user or revoking is_staff only reaches other workers after USER_CACHE_TIMEOUT.
+# Switching profiles logs everyone out once, as sessions remember the backend.
+SESSION_PROFILE = os.environ.get('LIBRARY_SESSION_PROFILE', 'db')
+
+SESSION_PROFILES = {
+    'db': {
+        'engine': 'django.contrib.sessions.backends.db',
+        'backends': ['django.contrib.auth.backends.ModelBackend'],
+    },
+    'cached_db': {
+        'engine': 'django.contrib.sessions.backends.cached_db',
+        'backends': ['library_app.backends.CachedModelBackend'],
+    },
+    'signed_cookies': {
+        'engine': 'django.contrib.sessions.backends.signed_cookies',
+        'backends': ['library_app.backends.CachedModelBackend'],
+    },
+}
+
+SESSION_ENGINE = SESSION_PROFILES[SESSION_PROFILE]['engine']
+SESSION_CACHE_ALIAS = 'sessions'
+AUTHENTICATION_BACKENDS = SESSION_PROFILES[SESSION_PROFILE]['backends']
+USER_CACHE_ALIAS = 'sessions'
+# Also bounds how long a change made behind the signals' back (or in another
+# process, with the per-process locmem cache) can go unnoticed.
+USER_CACHE_TIMEOUT = 300
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -116,16 +286,33 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+# Where collectstatic gathers the files for the web server to serve.
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': RESPONSE_PROFILES[RESPONSE_PROFILE]['static_storage'],
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-import os
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# How read_book hands PDFs over once access is checked:
+#   None       - Django streams the file itself (sendfile via wsgi.file_wrapper when available)
+#   'x-sendfile' - Apache mod_xsendfile / lighttpd serve the path in X-Sendfile
+#   'x-accel'  - nginx serves PDF_ACCEL_REDIRECT_PREFIX + file name from an `internal` location
+PDF_SENDFILE_MODE = None
+PDF_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
 
 # Where to go after logging in:
 LOGIN_REDIRECT_URL = 'library_home'
@@ -134,4 +321,35 @@ LOGIN_REDIRECT_URL = 'library_home'
 LOGOUT_REDIRECT_URL = 'login'
 
 # Where to go if you try to visit a locked page without logging in:
-LOGIN_URL = 'login'
\ No newline at end of file
+LOGIN_URL = 'login'
+
+
+# Request instrumentation (library_app/perf.py)
+# Rolling number of request durations kept per view (in each worker process)
+# for /admin/perf-stats/.
+PERF_WINDOW = 1000
+# Fraction of requests run under cProfile (0 = off); those slower than the
+# threshold are dumped to PERF_PROFILE_DIR as .prof files.
+PERF_PROFILE_RATE = float(os.environ.get('LIBRARY_PROFILE_RATE', '0'))
+PERF_PROFILE_THRESHOLD_MS = 500
+PERF_PROFILE_DIR = BASE_DIR / 'perf_profiles'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'bare': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'perf': {'class': 'logging.StreamHandler', 'formatter': 'bare'},
+    },
+    'loggers': {
+        # Only the slow-request profile notices by default;
+        # LIBRARY_PERF_LOG_LEVEL=INFO adds one JSON line per request.
+        'library_app.perf': {
+            'handlers': ['perf'],
+            'level': os.environ.get('LIBRARY_PERF_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
@@ -16,11 +16,15 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
+from library_app import views as library_views
 
 urlpatterns = [
+    path('admin/cache-stats/', library_views.cache_stats, name='cache_stats'),
+    path('admin/loan-stats/', library_views.loan_stats, name='loan_stats'),
+    path('admin/perf-stats/', library_views.perf_stats, name='perf_stats'),
     path('admin/', admin.site.urls),
     path('accounts/', include('django.contrib.auth.urls')), # Login/Logout
     path('', include('library_app.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+]
+# Book PDFs under MEDIA_ROOT are not served publicly; they go through
+# library_app.views.read_book, which checks the borrow first.
\ No newline at end of file